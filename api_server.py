@@ -0,0 +1,667 @@
+"""
+HTTP API 服务（asyncio，只用标准库）
+
+按 README「API 接口」和 server.js 的约定对外提供生成流水线：
+
+    POST /api/generate   {"novel", "title", "genre", "episodes", "optLevel", "mode"}
+        → {"success", "script", "meta": {"title", "genre", "episodes", "words", "generatedAt", ...},
+           "report", "usage"}
+    POST /api/optimize   {"script", "level"}
+        → {"success", "optimizedScript", "report", "usage"}
+    GET  /api/health     → {"status": "ok", "timestamp", "active", "queued"}
+    GET  /api/metrics    → {"server": 请求计数, "lanes": 公平调度器各道的排队指标}
+
+请求头 Accept: text/event-stream（或 ?stream=1）时以 Server-Sent Events 推送进度和剧本文本：
+    event: status   {"message", "progress"}
+    event: summary  故事概要（分步生成）
+    event: batch    {"batch", "state", "done", "total"}（分步生成的批次状态）
+    event: delta    {"text"}，分步生成另有 {"batch", "state"}（各批生成草稿与优化结果的流式输出）
+    event: done     与 JSON 响应相同的结果
+    event: error    {"error"}
+长时间没有事件时发送注释行保持连接。否则生成完成后一次返回 JSON。
+
+- 事件循环只负责读写连接，流水线在线程池中运行，进度通过 call_soon_threadsafe 交回事件循环
+- 同时运行的请求不超过 max_concurrent 个，最多 max_queued 个请求排队，
+  超出时返回 503 和 Retry-After
+- 客户端断开时取消请求：在 providers.use_cancel_event 块内运行，尚未发出的调用和重试等待
+  立即结束，进行中的流式调用在下一段输出到达时中断，槽位随即释放给排队的请求。
+  断开以连接关闭（connection_lost）或写入失败为准；客户端只关闭写方向（半关闭）时仍照常响应
+- SIGINT / SIGTERM 时停止接受新连接，等待进行中的请求最多 shutdown_grace 秒，之后取消
+
+提供商和 API Key 由服务端配置，请求头 X-API-Key 可覆盖 API Key。每个请求作为一个任务
+交给公平调度器（fairshare），使用各自 API Key 的请求分别受每个 Key 的并发和 token 配额限制，
+同一 Key 的多个请求轮流发出模型调用。
+服务不保存剧本，也不使用检查点；配置了响应缓存时重复请求直接读取缓存。
+
+运行方式:
+    export SCREENPLAY_API_KEY=sk-...
+    python api_server.py --provider deepseek --port 3000
+    python api_server.py --provider fake --no-cache     # 本地模拟提供商，不需要 API Key
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from clients import SDK_FAKE, ClientRegistry
+from fairshare import DEFAULT_KEY_MAX_IN_FLIGHT, FairScheduler, use_job
+from pipeline import (OPTIMIZE_EPISODES, OPTIMIZE_FRAGMENTS, OPTIMIZE_FULL, call_ai_model, optimize_selected,
+                      run_batch_pipeline)
+from providers import (PROVIDERS, CallCancelled, configure_provider, get_call_scheduler, set_call_scheduler,
+                       set_client_registry, set_response_cache, use_cancel_event)
+from report import optimization_report, report_metrics, script_metrics
+from scheduler import BATCH_DONE
+from telemetry import Tracer, use_tracer
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 3000
+
+# 同时运行的请求数与排队上限
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_MAX_QUEUED = 16
+
+# 队列已满时建议客户端重试的等待时间（秒）
+RETRY_AFTER = 5
+
+# 关闭服务时等待进行中请求的时间（秒），超时后取消
+DEFAULT_SHUTDOWN_GRACE = 30.0
+
+# SSE 心跳间隔（秒）
+SSE_PING_INTERVAL = 15.0
+
+# 请求头和请求体上限（请求体与 server.js 的 bodyParser 限制一致）
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# 与 server.js 一致的校验
+MIN_NOVEL_CHARS = 100
+MAX_EPISODES = 200
+
+DEFAULT_TITLE = "未命名剧本"
+DEFAULT_GENRE = "其他"
+DEFAULT_EPISODES = 30
+
+# 生成模式
+MODE_SINGLE = "single"
+MODE_BATCH = "batch"
+DEFAULT_MODE = MODE_BATCH
+
+# 优化级别（optLevel / level）：单次生成直接写入提示词，分步生成和独立优化对应优化范围
+OPT_LEVEL_MODES = {
+    "deep": OPTIMIZE_FULL,
+    "standard": OPTIMIZE_EPISODES,
+    "basic": OPTIMIZE_FRAGMENTS,
+}
+DEFAULT_OPT_LEVEL = "standard"
+
+# SSE 事件
+EVENT_STATUS = "status"
+EVENT_SUMMARY = "summary"
+EVENT_BATCH = "batch"
+EVENT_DELTA = "delta"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Accept, X-API-Key",
+}
+
+_print_lock = threading.Lock()
+
+
+def log(message):
+    """输出一行访问日志"""
+    with _print_lock:
+        print(message, file=sys.stderr, flush=True)
+
+
+class HTTPError(Exception):
+    """以 JSON {"error": message} 返回给客户端的错误"""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def usage_of(tracer):
+    """本次请求的调用用量汇总"""
+    total = tracer.summary()["total"]
+    return dict(total, duration=round(total["duration"], 3), cost=round(total["cost"], 6),
+                cache_savings=round(total["cache_savings"], 6))
+
+
+# ==================== 请求参数 ====================
+
+def generate_params(body):
+    """校验 /api/generate 的请求体，返回流水线参数"""
+    novel = body.get("novel")
+    if not isinstance(novel, str) or len(novel.strip()) < MIN_NOVEL_CHARS:
+        raise HTTPError(400, f"小说内容至少{MIN_NOVEL_CHARS}字")
+    try:
+        episodes = int(body.get("episodes") or DEFAULT_EPISODES)
+    except (TypeError, ValueError):
+        episodes = 0
+    if not 1 <= episodes <= MAX_EPISODES:
+        raise HTTPError(400, f"集数应为 1-{MAX_EPISODES} 的整数")
+    opt_level = body.get("optLevel") or DEFAULT_OPT_LEVEL
+    if opt_level not in OPT_LEVEL_MODES:
+        raise HTTPError(400, f"optLevel 应为 {' / '.join(OPT_LEVEL_MODES)}")
+    mode = body.get("mode") or DEFAULT_MODE
+    if mode not in (MODE_SINGLE, MODE_BATCH):
+        raise HTTPError(400, f"mode 应为 {MODE_BATCH} / {MODE_SINGLE}")
+    return {
+        "novel": novel,
+        "title": str(body.get("title") or DEFAULT_TITLE),
+        "genre": str(body.get("genre") or DEFAULT_GENRE),
+        "episodes": episodes,
+        "opt_level": opt_level,
+        "mode": mode,
+    }
+
+
+def optimize_params(body):
+    """校验 /api/optimize 的请求体"""
+    script = body.get("script")
+    if not isinstance(script, str) or not script.strip():
+        raise HTTPError(400, "请提供剧本内容")
+    level = body.get("level") or DEFAULT_OPT_LEVEL
+    if level not in OPT_LEVEL_MODES:
+        raise HTTPError(400, f"level 应为 {' / '.join(OPT_LEVEL_MODES)}")
+    return {"script": script, "level": level}
+
+
+# ==================== 流水线（在工作线程中运行） ====================
+
+def run_generate(params, api_key, provider, emit):
+    """生成剧本，进度和流式输出通过 emit(event, data) 发出"""
+    tracer = Tracer()
+    started = time.perf_counter()
+    with use_tracer(tracer):
+        if params["mode"] == MODE_SINGLE:
+            emit(EVENT_STATUS, {"message": "正在生成剧本...", "progress": 5})
+            script = call_ai_model(
+                novel=params["novel"],
+                title=params["title"],
+                genre=params["genre"],
+                episodes=params["episodes"],
+                opt_level=params["opt_level"],
+                api_key=api_key,
+                provider=provider,
+                on_delta=lambda text: emit(EVENT_DELTA, {"text": text})
+            )
+            report = script_metrics(script)
+        else:
+            result = run_batch_pipeline(
+                novel=params["novel"],
+                title=params["title"],
+                genre=params["genre"],
+                episodes=params["episodes"],
+                api_key=api_key,
+                provider=provider,
+                optimize_mode=OPT_LEVEL_MODES[params["opt_level"]],
+                on_status=lambda text, progress: emit(EVENT_STATUS, {"message": text, "progress": progress}),
+                on_summary=lambda summary_data: emit(EVENT_SUMMARY, summary_data),
+                on_update=lambda batch_idx, state, states: emit(EVENT_BATCH, {
+                    "batch": batch_idx, "state": state,
+                    "done": states.count(BATCH_DONE), "total": len(states),
+                }),
+                on_delta=lambda batch_idx, state, text: emit(EVENT_DELTA, {
+                    "batch": batch_idx, "state": state, "text": text,
+                })
+            )
+            script = result["script"]
+            report = report_metrics(result["report"])
+    return {
+        "success": True,
+        "script": script,
+        "meta": {
+            "title": params["title"],
+            "genre": params["genre"],
+            "episodes": params["episodes"],
+            "words": len(params["novel"]),
+            "generatedAt": now_iso(),
+            "mode": params["mode"],
+            "provider": provider,
+            "elapsed": round(time.perf_counter() - started, 3),
+        },
+        "report": report,
+        "usage": usage_of(tracer),
+    }
+
+
+def run_optimize(params, api_key, provider, emit):
+    """优化剧本：按 level 对应的优化范围只优化格式检查不合格的部分"""
+    tracer = Tracer()
+    emit(EVENT_STATUS, {"message": "正在优化剧本...", "progress": 5})
+    with use_tracer(tracer):
+        optimized = optimize_selected(params["script"], {}, api_key, provider,
+                                      on_delta=lambda text: emit(EVENT_DELTA, {"text": text}),
+                                      mode=OPT_LEVEL_MODES[params["level"]])
+    return {
+        "success": True,
+        "optimizedScript": optimized,
+        "report": report_metrics(optimization_report([params["script"]], [optimized])),
+        "usage": usage_of(tracer),
+    }
+
+
+ROUTES = {
+    "/api/generate": (generate_params, run_generate),
+    "/api/optimize": (optimize_params, run_optimize),
+}
+
+
+# ==================== HTTP ====================
+
+async def read_request(reader):
+    """
+    读取一个 HTTP/1.1 请求
+
+    Returns:
+        {"method", "path", "query", "headers", "body"}，客户端没有发送请求就关闭时为 None
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "请求头过大")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "无法解析的请求")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Content-Length 无效")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "请求体过大")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        return None
+    path, _, query = target.partition("?")
+    return {"method": method.upper(), "path": path, "query": parse_qs(query), "headers": headers, "body": body}
+
+
+def parse_json_body(request):
+    try:
+        body = json.loads(request["body"] or b"{}")
+    except ValueError:
+        raise HTTPError(400, "请求体不是合法的 JSON")
+    if not isinstance(body, dict):
+        raise HTTPError(400, "请求体应为 JSON 对象")
+    return body
+
+
+def wants_stream(request):
+    return ("text/event-stream" in request["headers"].get("accept", "")
+            or request["query"].get("stream", ["0"])[0] not in ("", "0", "false"))
+
+
+def response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in dict(CORS_HEADERS, Connection="close", **headers).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def json_response(status, payload, headers=None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return response_head(status, dict(
+        headers or {}, **{"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(body))}
+    )) + body
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class APIServer:
+    """剧本生成 HTTP 服务（asyncio），可用 serve() 在当前事件循环运行，或 start() 在后台线程运行"""
+
+    def __init__(self, provider="deepseek", api_key=None, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT, max_queued=DEFAULT_MAX_QUEUED,
+                 shutdown_grace=DEFAULT_SHUTDOWN_GRACE, ping_interval=SSE_PING_INTERVAL, access_log=True):
+        """
+        Args:
+            provider: API 提供商
+            api_key: 默认 API Key（请求头 X-API-Key 可覆盖）
+            host / port: 监听地址，port=0 时自动分配
+            max_concurrent: 同时运行的请求数（流水线线程数）
+            max_queued: 排队等待的请求上限，超出时返回 503
+            shutdown_grace: 关闭时等待进行中请求的时间（秒），超时后取消
+            ping_interval: SSE 心跳间隔（秒）
+            access_log: 是否输出访问日志
+        """
+        self.provider = provider
+        self.api_key = api_key
+        self.host = host
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.shutdown_grace = shutdown_grace
+        self.ping_interval = ping_interval
+        self.access_log = access_log
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._cancel_events = set()
+        self._handlers = set()
+        self._closing = False
+        self._loop = None
+        self._stopping = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    # ---------- 生命周期 ----------
+
+    async def serve(self):
+        """监听端口直到 request_shutdown()，然后优雅关闭"""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="api")
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        if self.access_log:
+            log(f"剧本生成 API 已启动：{self.url}（{self.provider}，并发 {self.max_concurrent}，"
+                f"排队上限 {self.max_queued}）")
+        try:
+            await self._stopping.wait()
+        finally:
+            # 停止接受新连接；等待进行中的请求，超时后取消
+            server.close()
+            self._closing = True
+            if self._handlers:
+                _, pending = await asyncio.wait(set(self._handlers), timeout=self.shutdown_grace)
+                if pending:
+                    for cancel in list(self._cancel_events):
+                        cancel.set()
+                    await asyncio.wait(pending)
+            await server.wait_closed()
+            self._executor.shutdown(wait=True)
+            if self.access_log:
+                log("服务已关闭")
+
+    def request_shutdown(self):
+        """请求关闭服务（线程安全，可在信号处理中调用）"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def start(self):
+        """在后台线程运行服务，端口就绪后返回"""
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="api-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        self.request_shutdown()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        return {"active": self.active, "queued": self.queued, "rejected": self.rejected,
+                "cancelled": self.cancelled}
+
+    # ---------- 请求处理 ----------
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        started = time.perf_counter()
+        request = None
+        status = None
+        try:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                status = await self._dispatch(request, writer)
+            except HTTPError as e:
+                status = e.status
+                writer.write(json_response(e.status, {"error": e.message}, e.headers))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+            if request is not None and self.access_log:
+                log(f"{request['method']} {request['path']} {status or '-'} "
+                    f"{time.perf_counter() - started:.3f}s")
+
+    async def _dispatch(self, request, writer):
+        """处理请求，返回响应状态码（客户端已断开时为 None）"""
+        method, path = request["method"], request["path"]
+        if method == "OPTIONS":
+            writer.write(response_head(204, {"Content-Length": "0"}))
+            return 204
+        if path == "/api/health" and method == "GET":
+            writer.write(json_response(200, dict(self.stats(), status="ok", timestamp=now_iso())))
+            return 200
+        if path == "/api/metrics" and method == "GET":
+            scheduler = get_call_scheduler()
+            writer.write(json_response(200, {
+                "server": self.stats(),
+                "lanes": scheduler.metrics() if scheduler is not None else [],
+            }))
+            return 200
+        if path not in ROUTES:
+            raise HTTPError(404, "接口不存在")
+        if method != "POST":
+            raise HTTPError(405, "只支持 POST", {"Allow": "POST, OPTIONS"})
+
+        validate, work = ROUTES[path]
+        params = validate(parse_json_body(request))
+        api_key = request["headers"].get("x-api-key") or self.api_key
+        if not api_key and PROVIDERS[self.provider]["sdk"] != SDK_FAKE:
+            raise HTTPError(401, "未配置 API Key，请在请求头 X-API-Key 中提供")
+        if self._closing:
+            raise HTTPError(503, "服务正在关闭", {"Retry-After": str(RETRY_AFTER)})
+        if self.active >= self.max_concurrent and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise HTTPError(503, "服务繁忙，请稍后重试", {"Retry-After": str(RETRY_AFTER)})
+
+        # 连接关闭时取消请求，排队中断开的请求不再运行；读到 EOF 可能只是半关闭，不算断开
+        cancel = threading.Event()
+        watcher = asyncio.ensure_future(writer.wait_closed())
+
+        def on_disconnect(task):
+            if not task.cancelled():
+                task.exception()  # 连接异常关闭时取走异常
+                cancel.set()
+
+        watcher.add_done_callback(on_disconnect)
+        self._cancel_events.add(cancel)
+        self.queued += 1
+        try:
+            async with self._semaphore:
+                self.queued -= 1
+                if cancel.is_set():
+                    self.cancelled += 1
+                    return None
+                self.active += 1
+                try:
+                    return await self._run(work, params, api_key, wants_stream(request), cancel, writer)
+                finally:
+                    self.active -= 1
+        finally:
+            watcher.cancel()
+            self._cancel_events.discard(cancel)
+
+    async def _run(self, work, params, api_key, stream, cancel, writer):
+        queue = asyncio.Queue()
+        loop = self._loop
+
+        def emit(event, data):
+            if stream:
+                loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+        def target():
+            with use_cancel_event(cancel), use_job(uuid.uuid4().hex[:12]):
+                return work(params, api_key, self.provider, emit)
+
+        future = loop.run_in_executor(self._executor, target)
+
+        if not stream:
+            try:
+                result = await future
+            except CallCancelled:
+                return self._cancelled(cancel, writer, stream)
+            except Exception as e:
+                writer.write(json_response(500, {"error": str(e)}))
+                return 500
+            writer.write(json_response(200, result))
+            return 200
+
+        writer.write(response_head(200, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }))
+        async for item in self._events(queue, future):
+            if cancel.is_set():
+                continue
+            # 写入失败说明客户端已断开，取消请求，等待工作线程结束后释放槽位
+            try:
+                writer.write(sse_event(*item) if item else b": ping\n\n")
+                await writer.drain()
+            except ConnectionError:
+                cancel.set()
+        if cancel.is_set() and not self._closing:
+            future.exception()  # 取走工作线程的异常（CallCancelled），客户端已断开不再响应
+            self.cancelled += 1
+            return None
+        try:
+            result = future.result()
+        except CallCancelled:
+            return self._cancelled(cancel, writer, stream)
+        except Exception as e:
+            writer.write(sse_event(EVENT_ERROR, {"error": str(e)}))
+            return 200
+        writer.write(sse_event(EVENT_DONE, result))
+        return 200
+
+    def _cancelled(self, cancel, writer, stream):
+        """请求被取消：客户端断开时不再响应，关闭服务时告知客户端"""
+        self.cancelled += 1
+        if not self._closing:
+            return None
+        message = "服务正在关闭，请求已取消"
+        writer.write(sse_event(EVENT_ERROR, {"error": message}) if stream
+                     else json_response(503, {"error": message}, {"Retry-After": str(RETRY_AFTER)}))
+        return 503
+
+    async def _events(self, queue, future):
+        """依次产出工作线程发出的 (event, data)，直到流水线结束；超过心跳间隔没有事件时产出 None"""
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, future}, timeout=self.ping_interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                    getter = None
+                elif future in done:
+                    # 工作线程在结束前发出的事件已全部入队（与结果按 call_soon_threadsafe 的顺序交付）
+                    while not queue.empty():
+                        yield queue.get_nowait()
+                    return
+                else:
+                    yield None
+        finally:
+            if getter is not None:
+                getter.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="剧本生成 HTTP API 服务")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--provider", default=os.environ.get("SCREENPLAY_PROVIDER", "deepseek"),
+                        choices=sorted(PROVIDERS), help="API 提供商，默认读取环境变量 SCREENPLAY_PROVIDER")
+    parser.add_argument("--api-key", default=os.environ.get("SCREENPLAY_API_KEY"),
+                        help="API Key，默认读取环境变量 SCREENPLAY_API_KEY（请求头 X-API-Key 可覆盖）")
+    parser.add_argument("--base-url", default=None, help="覆盖提供商的 API 地址（代理或私有部署）")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT, help="同时运行的请求数")
+    parser.add_argument("--max-queued", type=int, default=DEFAULT_MAX_QUEUED,
+                        help="排队等待的请求上限，超出时返回 503")
+    parser.add_argument("--shutdown-grace", type=float, default=DEFAULT_SHUTDOWN_GRACE,
+                        help="关闭时等待进行中请求的秒数，超时后取消")
+    parser.add_argument("--key-max-in-flight", type=int,
+                        default=int(os.environ.get("SCREENPLAY_KEY_MAX_IN_FLIGHT", DEFAULT_KEY_MAX_IN_FLIGHT)),
+                        help="每个 API Key 同时进行中的模型调用数")
+    parser.add_argument("--key-tokens-per-minute", type=int,
+                        default=int(os.environ.get("SCREENPLAY_KEY_TOKENS_PER_MINUTE", 0)),
+                        help="每个 API Key 每分钟的 token 配额，0 为不限")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 响应缓存")
+    parser.add_argument("--cache-path", default=os.environ.get("SCREENPLAY_CACHE_PATH", DEFAULT_CACHE_PATH),
+                        help="LLM 响应缓存文件")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        configure_provider(args.provider, base_url=args.base_url)
+    set_client_registry(ClientRegistry(max_clients=32, idle_ttl=600))
+    cache = None if args.no_cache else ResponseCache(args.cache_path)
+    set_response_cache(cache)
+    set_call_scheduler(FairScheduler(args.key_max_in_flight, args.key_tokens_per_minute or None))
+
+    server = APIServer(args.provider, args.api_key, args.host, args.port, max(1, args.max_concurrent),
+                       max(0, args.max_queued), args.shutdown_grace)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, server.request_shutdown)
+        await server.serve()
+
+    try:
+        asyncio.run(run())
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,519 +4,239 @@
 """
 
 import streamlit as st
-import time
 import os
 
-# 导入 AI SDK
-import anthropic
-from openai import OpenAI
-
-
-# ==================== AI API 调用函数 ====================
-
-def call_claude_api(system_prompt, user_prompt, api_key):
-    """调用 Claude API"""
-    client = anthropic.Anthropic(api_key=api_key)
-
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=128000,
-        system=system_prompt,
-        messages=[
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-
-    return message.content[0].text
-
-
-def call_openai_api(system_prompt, user_prompt, api_key):
-    """调用 OpenAI API"""
-    client = OpenAI(api_key=api_key)
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        max_tokens=64000,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-
-    return response.choices[0].message.content
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from checkpoint import DEFAULT_CHECKPOINT_DIR, CheckpointStore, make_run_id
+from clients import ClientRegistry
+from fairshare import DEFAULT_KEY_MAX_IN_FLIGHT, FairScheduler, key_fingerprint
+from jobs import (
+    DEFAULT_JOB_WORKERS, FINISHED_STATES, JOB_FAILED, JOB_STATE_LABELS, MODE_BATCH, MODE_REDO, MODE_SINGLE,
+    JobQueue, MemoryJobStore, SQLiteJobStore, generation_runner
+)
+from pipeline import (
+    DEFAULT_OPTIMIZE_MODE, OPTIMIZE_MODE_LABELS, REDO_LABELS, SPAN_LABELS, batch_label, plan_batches
+)
+from providers import (
+    PROVIDERS, get_call_scheduler, get_response_cache, set_call_scheduler, set_client_registry, set_response_cache
+)
+from report import report_metrics
+from routing import provider_stats
+from scheduler import BATCH_STATE_LABELS, get_max_in_flight
+from script_store import DEFAULT_SCRIPT_DIR, ScriptStore
+from telemetry import Tracer
 
 
-def call_deepseek_api(system_prompt, user_prompt, api_key):
-    """调用 DeepSeek API"""
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.deepseek.com"
-    )
-
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-    return response.choices[0].message.content
+# ==================== 主 UI 代码 ====================
 
+# 页面配置
+st.set_page_config(
+    page_title="短剧剧本生成器",
+    page_icon="📝",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
 
-def call_gemini_api(system_prompt, user_prompt, api_key):
-    """调用 Google Gemini API (Flash) - OpenAI 兼容格式"""
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
 
-    response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-    return response.choices[0].message.content
+@st.cache_resource
+def shared_client_registry():
+    """跨会话、跨重跑共享的 API 客户端注册表（复用连接池）"""
+    return ClientRegistry(max_clients=32, idle_ttl=600)
 
 
-def call_gemini_pro_api(system_prompt, user_prompt, api_key):
-    """调用 Google Gemini API (Pro) - OpenAI 兼容格式"""
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
+set_client_registry(shared_client_registry())
 
-    response = client.chat.completions.create(
-        model="gemini-2.5-pro",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-    return response.choices[0].message.content
 
+@st.cache_resource
+def shared_response_cache():
+    """跨会话共享的 LLM 响应缓存"""
+    return ResponseCache(os.environ.get("SCREENPLAY_CACHE_PATH", DEFAULT_CACHE_PATH))
 
-def call_deepseek_api(system_prompt, user_prompt, api_key):
-    """调用 DeepSeek API"""
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.deepseek.com"
-    )
 
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
-    return response.choices[0].message.content
+set_response_cache(shared_response_cache())
 
 
-def call_ai_model(novel, title, genre, episodes, opt_level, api_key, provider):
+@st.cache_resource
+def shared_call_scheduler():
     """
-    调用 AI 模型生成剧本
-
-    Args:
-        novel: 小说原文
-        title: 剧本标题
-        genre: 题材类型
-        episodes: 总集数
-        opt_level: 优化级别
-        api_key: API Key
-        provider: claude / openai / gemini / deepseek / qwen / ernie / chatglm / kimi
-
-    Returns:
-        生成的剧本内容
+    跨会话共享的公平调度器：各用户的模型调用按 API Key 排队，各任务轮流发出
+
+    每个 API Key 的并发默认为该提供商的最大并发数（SCREENPLAY_KEY_MAX_IN_FLIGHT 统一覆盖），
+    SCREENPLAY_KEY_TOKENS_PER_MINUTE 为每个 API Key 每分钟的 token 配额（默认不限）。
     """
-    # 题材侧重点
-    genre_focus = {
-        "都市": "职场、生活、现实情感",
-        "古装宅斗": "心机算计、身份地位、主仆关系",
-        "仙侠玄幻": "修炼升级、法宝灵器、门派恩怨",
-        "甜宠": "感情互动、身份差距、浪漫桥段",
-        "重生复仇": "信息差、预知未来、改变命运",
-        "穿越": "身份错位、古代与现代碰撞",
-        "豪门": "财产争夺、家族恩怨、身份差距",
-        "其他": "情感纠葛、人物成长"
+    key_max_in_flight = os.environ.get("SCREENPLAY_KEY_MAX_IN_FLIGHT")
+    tokens_per_minute = os.environ.get("SCREENPLAY_KEY_TOKENS_PER_MINUTE")
+    quotas = {} if key_max_in_flight else {
+        provider: {"max_in_flight": get_max_in_flight(provider)} for provider in PROVIDERS
     }
+    return FairScheduler(
+        max_in_flight=int(key_max_in_flight) if key_max_in_flight else DEFAULT_KEY_MAX_IN_FLIGHT,
+        tokens_per_minute=int(tokens_per_minute) if tokens_per_minute else None,
+        quotas=quotas
+    )
 
-    # 生成提示词
-    system_prompt = """你是一个专业的短剧编剧，擅长将小说改编成专业格式的短剧剧本。请务必使用简体中文，不要使用繁体中文。"""
-
-    user_prompt = f"""请将以下小说转换成专业格式的短剧剧本。
-
-=== 基础配置 ===
-标题：{title}
-题材：{genre}
-总集数：{episodes}
-
-=== 格式模板 ===
-# 短剧剧本：{title}
-
-**题材：** {genre}
-**总集数：** {episodes}集
-
-**故事梗概：** 1-2句话概括核心冲突
-
-**人物小传：**
-
-| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
-|------|------|-----------|---------|----------|
-| 主角 | xx岁 | xxx | xxx | xxx |
-| 配角1 | xx岁 | xxx | xxx | xxx |
-
-**表演记忆点：**
-
-| 角色 | 性格标签 | 口头禅 | 标志性动作 |
-|------|---------|--------|------------|
-| 主角 | xxx | xxx | xxx |
-| 配角1 | xxx | xxx | xxx |
-
----
-
-**第1集：标题**
-**核心剧情：** ...
-
-1-1   场景名称     日/夜    内/外
-人物：xxx
-
-▲ 场景描述
-【特写】关键镜头
-人物（情绪）：台词
-【★表演提示】
-
-▲ 切镜
-
-1-2   场景名称     日/夜    内/外
-人物：xxx
-
-...
-
-=== 格式要求 ===
-1. 场次编号：1-1, 1-2, 2-1...（连续递增）
-2. 场景标注：日/夜 + 内/外（必填）
-3. 关键镜头：【特写】+ 描述
-4. 表演提示：【★表演提示】+ 情绪/动作
-5. 转场：【切镜】【黑屏】【字幕：X年后】【闪回】【蒙太奇】
-6. 内心独白：【画外音·人物名】
-7. 配角必须有口头禅和标志性动作
-
-=== 题材侧重点 ===
-{genre}题材关注：{genre_focus.get(genre, '情感纠葛')}
-
-请直接输出完整剧本。
-
-小说原文：
-{novel}"""
-
-    if provider == "claude":
-        return call_claude_api(system_prompt, user_prompt, api_key)
-    elif provider == "openai":
-        return call_openai_api(system_prompt, user_prompt, api_key)
-    elif provider == "deepseek":
-        return call_deepseek_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_flash":
-        return call_gemini_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_pro":
-        return call_gemini_pro_api(system_prompt, user_prompt, api_key)
-    else:
-        raise ValueError(f"不支持的 API 提供商: {provider}")
-
-
-def generate_mock_script(title, genre, episodes):
-    """模拟生成脚本（无 API Key 时使用）"""
-    return f'''# 短剧剧本：{title}
-
-**题材：** {genre}
-**总集数：** {episodes}集
-
-**故事梗概：** 丫鬟苏清晏被逼替小姐与姑爷同床三年，求解放时被迫与侯府病弱大公子沈景珩结阴亲。
-
-**人物小传：**
 
-| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
-|------|------|-----------|---------|----------|
-| 苏清晏 | 18岁 | 陪嫁丫鬟 | 隐忍坚韧 | 家生子 |
-| 沈景珩 | 27岁 | 侯府嫡长子 | 清冷才子 | 注定早逝 |
+set_call_scheduler(shared_call_scheduler())
 
-**表演记忆点：**
 
-| 角色 | 性格标签 | 口头禅 | 标志性动作 |
-|------|---------|--------|------------|
-| 苏清晏 | 隐忍坚韧 | "奴婢不敢" | 低眉顺眼 |
+@st.cache_resource
+def shared_checkpoint_store():
+    """分步生成的断点存储（启动时清理过期检查点）"""
+    store = CheckpointStore(os.environ.get("SCREENPLAY_CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR))
+    store.prune()
+    return store
 
----
 
-（共{episodes}集，请配置 API Key 生成完整剧本）
-'''
+checkpoints = shared_checkpoint_store()
 
 
-# ==================== 主 UI 代码 ====================
+@st.cache_resource
+def shared_script_store():
+    """生成结果的剧本文件存储（启动时清理过期文件）"""
+    store = ScriptStore(os.environ.get("SCREENPLAY_SCRIPT_DIR", DEFAULT_SCRIPT_DIR))
+    store.prune()
+    return store
 
-# 页面配置
-st.set_page_config(
-    page_title="短剧剧本生成器",
-    page_icon="📝",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
 
+script_store = shared_script_store()
 
-# ==================== 第一步：提取故事概要 ====================
 
-def extract_story_summary(novel, title, genre, total_episodes, api_key, provider):
-    """
-    从完整小说中提取：
-    1. 故事梗概、人物设定
-    2. 全局优化要点（格式规范、表演提示、特写镜头、配角记忆点）
+@st.cache_resource
+def shared_job_queue():
     """
-    import json
-
-    genre_focus = {
-        "都市": "职场、生活、现实情感",
-        "古装宅斗": "心机算计、身份地位、主仆关系",
-        "仙侠玄幻": "修炼升级、法宝灵器、门派恩怨",
-        "甜宠": "感情互动、身份差距、浪漫桥段",
-        "重生复仇": "信息差、预知未来、改变命运",
-        "穿越": "身份错位、古代与现代碰撞",
-        "豪门": "财产争夺、家族恩怨、身份差距",
-        "其他": "情感纠葛、人物成长"
-    }
+    跨会话共享的后台任务队列
 
-    system_prompt = """你是一个专业的短剧编剧。请从小说中提取关键信息，用于后续分集剧本生成。"""
-
-    user_prompt = f"""请从以下小说中提取关键信息，用于后续生成分集剧本和优化。
-
-=== 任务说明 ===
-请提取以下信息（JSON格式输出）：
-
-1. **故事梗概**（200字内）：一句话概括核心冲突
-2. **人物小传**（主要角色 3-5 人）：包含姓名、年龄、身份、性格特点、核心背景
-3. **分集大纲**（共{total_episodes}集）：每集一句话核心事件
-4. **全局优化要点**：
-   - 格式规范：该题材的特殊格式要求
-   - 表演提示：该题材的表演风格要点
-   - 特写镜头：该题材常需要的镜头类型
-   - 配角记忆点：主要配角需要具备的标志性特征
-
-=== 输出格式 ===
-请直接输出JSON对象（不要用markdown代码块）：
-
-{{
-  "story_summary": "一句话核心冲突概括",
-  "characters": [
-    {{
-      "name": "角色名",
-      "age": "年龄",
-      "identity": "身份/职业",
-      "personality": "性格特点",
-      "background": "核心背景"
-    }}
-  ],
-  "episode_plan": [
-    "第1集核心事件",
-    "第2集核心事件",
-    ...
-  ],
-  "optimization_points": {{
-    "format_notes": "格式规范要点列表（每条换行）",
-    "performance_notes": "表演提示要点列表",
-    "camera_notes": "特写镜头要点列表",
-    "character_marks": "配角记忆点：角色A-口头禅+动作，角色B-口头禅+动作"
-  }}
-}}
-
-=== 题材侧重点 ===
-{genre}题材关注：{genre_focus.get(genre, '情感纠葛')}
-
-=== 小说原文 ===
-{novel[:10000]}  <!-- 截取前10000字 -->
-
-...（小说内容较长，已截取关键部分用于提取概要）"""
-
-    if provider == "claude":
-        result = call_claude_api(system_prompt, user_prompt, api_key)
-    elif provider == "openai":
-        result = call_openai_api(system_prompt, user_prompt, api_key)
-    elif provider == "deepseek":
-        result = call_deepseek_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_flash":
-        result = call_gemini_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_pro":
-        result = call_gemini_pro_api(system_prompt, user_prompt, api_key)
-    else:
-        raise ValueError(f"不支持的 API 提供商: {provider}")
-
-    try:
-        result = result.strip()
-        if result.startswith("```json"):
-            result = result[7:]
-        if result.startswith("```"):
-            result = result[3:]
-        if result.endswith("```"):
-            result = result[:-3]
-        result = result.strip()
-
-        parsed = json.loads(result)
-        return {
-            "story_summary": parsed.get("story_summary", ""),
-            "characters": parsed.get("characters", []),
-            "episode_plan": parsed.get("episode_plan", []),
-            "optimization_points": parsed.get("optimization_points", {})
-        }
-    except json.JSONDecodeError:
-        return {
-            "story_summary": result[:500],
-            "characters": [],
-            "episode_plan": [],
-            "optimization_points": {}
-        }
-
-
-# ==================== 第二步：分集生成 ====================
-
-def generate_batch_with_summary(summary_data, title, genre, batch_num, total_episodes, api_key, provider):
+    设置 SCREENPLAY_JOB_DB 时任务记录保存在该 SQLite 文件中，否则只保存在内存中；
+    SCREENPLAY_JOB_WORKERS 为同时执行的生成任务数。
     """
-    使用故事概要生成分集剧本（不传完整小说，解决 token 限制）
-    """
-    import json
-
-    batch_size = 15
-    start_ep = batch_num * batch_size + 1
-    end_ep = min((batch_num + 1) * batch_size, total_episodes)
-
-    current_episodes = list(range(start_ep, end_ep + 1))
-    episode_plan = summary_data.get("episode_plan", [])
-
-    batch_plan_text = ""
-    for ep in current_episodes:
-        if ep <= len(episode_plan):
-            batch_plan_text += f"- 第{ep}集：{episode_plan[ep-1]}\n"
-
-    genre_focus = {
-        "都市": "职场、生活、现实情感",
-        "古装宅斗": "心机算计、身份地位、主仆关系",
-        "仙侠玄幻": "修炼升级、法宝灵器、门派恩怨",
-        "甜宠": "感情互动、身份差距、浪漫桥段",
-        "重生复仇": "信息差、预知未来、改变命运",
-        "穿越": "身份错位、古代与现代碰撞",
-        "豪门": "财产争夺、家族恩怨、身份差距",
-        "其他": "情感纠葛、人物成长"
-    }
+    db_path = os.environ.get("SCREENPLAY_JOB_DB")
+    return JobQueue(
+        generation_runner(checkpoints, script_store),
+        store=SQLiteJobStore(db_path) if db_path else MemoryJobStore(),
+        max_workers=int(os.environ.get("SCREENPLAY_JOB_WORKERS", DEFAULT_JOB_WORKERS))
+    )
 
-    system_prompt = """你是一个专业的短剧编剧，擅长将小说改编成专业格式的短剧剧本。请务必使用简体中文，不要使用繁体中文。"""
 
-    user_prompt = f"""请根据以下故事概要，为第 {start_ep}-{end_ep} 集创作剧本。
+job_queue = shared_job_queue()
 
-=== 故事概要 ===
-{summary_data.get('story_summary', '')}
+# 页面轮询任务进度的间隔（秒）
+JOB_POLL_INTERVAL = 1.0
 
-=== 人物设定 ===
-{json.dumps(summary_data.get('characters', []), ensure_ascii=False, indent=2)}
+# 侧边栏可选的 API 提供商
+PROVIDER_LABELS = {
+    "claude": "Claude (Anthropic) - sonnet-4",
+    "openai": "OpenAI - GPT-4o",
+    "deepseek": "DeepSeek - chat",
+    "gemini_pro": "Google Gemini - 2.5 Pro",
+    "gemini_flash": "Google Gemini - 2.5 Flash",
+}
 
-=== 当前批次分集计划 ===
-{batch_plan_text}
 
-=== 格式模板 ===
-**第X集：标题**
-**核心剧情：** ...
+# ==================== 任务进度与结果 ====================
 
-1-X   场景名称     日/夜    内/外
-人物：xxx
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_job_progress(job_id):
+    """定时刷新的任务进度，任务结束后整页重跑以显示结果"""
+    job = job_queue.get(job_id)
+    if job is None or job["status"] in FINISHED_STATES:
+        st.rerun()
 
-▲ 场景描述
-【特写】关键镜头
-人物（情绪）：台词
-【★表演提示】
+    st.progress(job["progress"])
+    st.text(f"{JOB_STATE_LABELS[job['status']]}  {job['message']}")
+    live = job.get("live") or {}
 
-=== 格式要求 ===
-1. 场次编号：{start_ep}-1, {start_ep}-2, ...
-2. 场景标注：日/夜 + 内/外（必填）
-3. 关键镜头：【特写】+ 描述
-4. 表演提示：【★表演提示】+ 情绪/动作
-5. 转场：【切镜】【字幕：X年后】【蒙太奇】
-6. 配角必须有口头禅和标志性动作
-7. 每集至少 4 场
+    summary_data = live.get("summary")
+    if summary_data:
+        with st.expander("📖 故事概要（AI提取）", expanded=True):
+            st.markdown(f"**故事梗概：** {summary_data.get('story_summary', '')}")
+            st.markdown(f"**人物数量：** {len(summary_data.get('characters', []))} 人")
+            st.markdown(f"**分集计划：** {len(summary_data.get('episode_plan', []))} 集")
 
-=== 题材侧重点 ===
-{genre}题材关注：{genre_focus.get(genre, '情感纠葛')}
+    if live.get("plan"):
+        st.markdown("\n".join(
+            f"- {batch_label(*live['plan'][i])}：{BATCH_STATE_LABELS[state]}"
+            for i, state in enumerate(live["batch_states"])
+        ))
 
-请直接输出第 {start_ep}-{end_ep} 集的完整剧本内容。"""
+    if job.get("partial"):
+        if live.get("structure"):
+            st.caption(f"已输出 {live['structure']['episodes']} 集、{live['structure']['scenes']} 场")
+        with st.expander("📝 实时预览", expanded=True):
+            st.markdown(job["partial"])
 
-    if provider == "claude":
-        return call_claude_api(system_prompt, user_prompt, api_key)
-    elif provider == "openai":
-        return call_openai_api(system_prompt, user_prompt, api_key)
-    elif provider == "deepseek":
-        return call_deepseek_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_flash":
-        return call_gemini_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_pro":
-        return call_gemini_pro_api(system_prompt, user_prompt, api_key)
-    else:
-        raise ValueError(f"不支持的 API 提供商: {provider}")
+    st.caption("生成在后台进行，可以离开或刷新页面，通过当前链接回到本任务")
 
 
-# ==================== 第三步：分批优化 ====================
+def show_partial_download(partial, title):
+    """生成失败后，提供已生成部分的下载"""
+    if partial:
+        st.warning(f"已保留生成中断前的部分剧本（{len(partial)} 字）")
+        st.download_button(
+            label="📥 下载已生成的部分剧本",
+            data=partial,
+            file_name=f"{title}_部分.md",
+            mime="text/markdown",
+            key="download_partial"
+        )
 
-def optimize_batch(batch_content, optimization_points, api_key, provider):
-    """
-    基于全局优化要点优化单批剧本内容
-
-    Args:
-        batch_content: 当前批次的剧本内容
-        optimization_points: extract_story_summary 返回的优化要点
-        api_key: API Key
-        provider: API 提供商
 
-    Returns:
-        优化后的剧本内容
+def show_telemetry(tracer, title, context=None):
     """
-    opt_points = optimization_points
-
-    system_prompt = """你是一个专业的短剧剧本优化专家，负责优化剧本的格式规范、表演提示、特写镜头和配角记忆点。"""
-
-    user_prompt = f"""请优化以下剧本内容，根据全局优化要点进行修正和补充。
-
-=== 全局优化要点 ===
-**格式规范：**
-{opt_points.get('format_notes', '按标准格式规范执行')}
-
-**表演提示：**
-{opt_points.get('performance_notes', '无特殊要求')}
-
-**特写镜头：**
-{opt_points.get('camera_notes', '无特殊要求')}
-
-**配角记忆点：**
-{opt_points.get('character_marks', '配角需有口头禅和标志性动作')}
+    按阶段显示本次运行的耗时、token 和估算费用，并提供追踪数据下载
 
-=== 需要优化的剧本内容 ===
-{batch_content}
-
-=== 优化要求 ===
-1. 检查并修复格式问题
-2. 补充缺失的表演提示
-3. 补充必要的特写镜头
-4. 确保配角有口头禅和标志性动作
-5. 保持原有剧情不变
-
-请直接输出优化后的剧本内容，不需要说明。"""
+    context 为分步生成按批裁剪人物设定的汇总（CastIndex.report()）
+    """
+    summary = tracer.summary()
+    total = summary["total"]
+    with st.expander("⏱️ 耗时与费用", expanded=False):
+        cached_share = total["cached_input_tokens"] / total["input_tokens"] if total["input_tokens"] else 0.0
+        cols = st.columns(5)
+        cols[0].metric("总耗时", f"{total['duration']:.1f} 秒")
+        cols[1].metric("模型调用", f"{total['calls']} 次", f"缓存命中 {total['cached']}", delta_color="off")
+        cols[2].metric("输入 / 输出 token", f"{total['input_tokens']:,} / {total['output_tokens']:,}")
+        cols[3].metric("前缀缓存命中", f"{total['cached_input_tokens']:,} token", f"{cached_share:.0%} 的输入",
+                       delta_color="off")
+        cols[4].metric("估算费用", f"${total['cost']:.4f}", f"前缀缓存节省 ${total['cache_savings']:.4f}",
+                       delta_color="off")
+        st.table([
+            {
+                "阶段": SPAN_LABELS.get(stage["name"], stage["name"]),
+                "次数": stage["count"],
+                "累计耗时（秒）": round(stage["duration"], 2),
+                "平均首字延迟（秒）": None if stage["first_token"] is None else round(stage["first_token"], 2),
+                "输入 token": stage["input_tokens"],
+                "输出 token": stage["output_tokens"],
+                "缓存命中 token": stage["cached_input_tokens"],
+                "重试": stage["retries"],
+                "费用（美元）": round(stage["cost"], 4),
+            }
+            for stage in summary["stages"]
+        ])
+        st.caption("各批次并发执行，分批生成、分批优化的累计耗时会超过实际用时；费用按公开价格估算")
+        if context and context["pruned"]:
+            sent = [batch["characters"] for batch in context["batches"]]
+            st.caption(
+                f"按批裁剪人物设定：人物表 {context['characters']} 人，各批平均发送 "
+                f"{sum(sent) / max(1, len(sent)):.1f} 人，估算节省输入 {context['tokens_saved']:,} token"
+            )
+        cols = st.columns(2)
+        cols[0].download_button(
+            "导出 JSONL", tracer.to_jsonl(), file_name=f"{title}_trace.jsonl", mime="application/jsonl"
+        )
+        cols[1].download_button(
+            "导出 OpenTelemetry", tracer.to_otlp(), file_name=f"{title}_trace.otlp.json", mime="application/json"
+        )
+
+
+@st.fragment
+def show_script_preview(name, pages):
+    """按集分页预览剧本：翻页只重跑本片段，每次只读取并渲染一集"""
+    page = st.selectbox(
+        "选择集数", range(len(pages)), format_func=lambda i: pages[i]["title"], key=f"preview_page_{name}"
+    )
+    st.caption(f"第 {page + 1} / {len(pages)} 页")
+    st.markdown(script_store.read(name, pages[page]["start"], pages[page]["end"]))
 
-    if provider == "claude":
-        return call_claude_api(system_prompt, user_prompt, api_key)
-    elif provider == "openai":
-        return call_openai_api(system_prompt, user_prompt, api_key)
-    elif provider == "deepseek":
-        return call_deepseek_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_flash":
-        return call_gemini_api(system_prompt, user_prompt, api_key)
-    elif provider == "gemini_pro":
-        return call_gemini_pro_api(system_prompt, user_prompt, api_key)
-    else:
-        raise ValueError(f"不支持的 API 提供商: {provider}")
 
 # 初始化 session state
 if "api_key" not in st.session_state:
@@ -578,14 +298,8 @@ with st.sidebar:
 
     api_provider = st.selectbox(
         "API 提供商",
-        ["claude", "openai", "deepseek", "gemini_pro", "gemini_flash"],
-        format_func=lambda x: {
-            "claude": "Claude (Anthropic) - sonnet-4",
-            "openai": "OpenAI - GPT-4o",
-            "deepseek": "DeepSeek - chat",
-            "gemini_pro": "Google Gemini - 2.5 Pro",
-            "gemini_flash": "Google Gemini - 2.5 Flash"
-        }[x],
+        list(PROVIDER_LABELS),
+        format_func=PROVIDER_LABELS.get,
         help="选择要使用的 AI API"
     )
 
@@ -600,6 +314,100 @@ with st.sidebar:
         st.session_state.api_provider = api_provider
         st.success("✅ API Key 已配置")
 
+    fallback_provider = st.selectbox(
+        "备用 API 提供商",
+        [None] + [provider for provider in PROVIDER_LABELS if provider != api_provider],
+        format_func=lambda x: "不使用" if x is None else PROVIDER_LABELS[x],
+        help="主 API 慢时向备用 API 发出对冲请求、先输出的一方胜出；主 API 出错时转移到备用 API"
+    )
+    if fallback_provider:
+        fallback_api_key = st.text_input(
+            "备用 API Key",
+            type="password",
+            help="备用 API 提供商的 API Key（不会保存，仅本次使用）"
+        )
+        hedge = st.checkbox(
+            "对冲慢请求",
+            value=True,
+            help="主 API 超过以往 95% 请求的首字延迟仍没有输出时，同时请求备用 API；"
+                 "关闭后只在主 API 出错时转移"
+        )
+        routing_stats = provider_stats()
+        for provider in (api_provider, fallback_provider):
+            stats = routing_stats.get(provider)
+            if stats and stats["samples"]:
+                st.caption(
+                    f"{PROVIDER_LABELS[provider]}：首字延迟 P50 ≤ {stats['p50']:g}s、P95 ≤ {stats['p95']:g}s，"
+                    f"失败 {stats['failures']} 次{'' if stats['healthy'] else '（冷却中）'}"
+                )
+    else:
+        fallback_api_key = ""
+        hedge = True
+
+    if generation_mode == "batch":
+        max_in_flight = st.number_input(
+            "最大并发请求数",
+            min_value=1,
+            max_value=16,
+            value=get_max_in_flight(api_provider),
+            help="本任务分步生成时同时进行中的请求上限；同一 API Key 的所有任务另受服务端并发配额限制，"
+                 "各任务的请求轮流发出"
+        )
+        optimize_mode = st.selectbox(
+            "优化范围",
+            list(OPTIMIZE_MODE_LABELS),
+            index=list(OPTIMIZE_MODE_LABELS).index(DEFAULT_OPTIMIZE_MODE),
+            format_func=OPTIMIZE_MODE_LABELS.get,
+            help="生成后先在本地检查格式（场景标注、人物行、表演提示、特写、核心剧情），"
+                 "只把不合格的集或场交给模型优化；格式已合格的批次不再调用模型"
+        )
+        continuity = st.checkbox(
+            "跨批衔接",
+            value=True,
+            help="各批并行生成前，先用一次小调用推演每批结尾时的人物状态和悬念，"
+                 "注入下一批的提示词，避免批次之间剧情断裂"
+        )
+        sidebar_plan = plan_batches(episodes, api_provider)
+        st.caption(
+            f"按该 API 的输出上限分 {len(sidebar_plan)} 批生成，"
+            f"每批最多 {max(end - start + 1 for start, end in sidebar_plan)} 集"
+        )
+    else:
+        max_in_flight = None
+        optimize_mode = DEFAULT_OPTIMIZE_MODE
+        continuity = True
+
+    st.divider()
+
+    # 响应缓存统计
+    st.header("🗄️ 响应缓存")
+    cache_stats = get_response_cache().stats()
+    cache_cols = st.columns(2)
+    cache_cols[0].metric("命中", cache_stats["hits"])
+    cache_cols[1].metric("未命中", cache_stats["misses"])
+    st.caption(f"已缓存 {cache_stats['entries']} 条，共 {cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+    if st.button("清空缓存"):
+        get_response_cache().clear()
+        st.rerun()
+
+    st.divider()
+
+    # 公平调度：当前 API Key 的排队情况（其他用户的 Key 只计入合计）
+    st.header("🚦 调度队列")
+    lanes = get_call_scheduler().metrics()
+    queue_cols = st.columns(2)
+    queue_cols[0].metric("排队中的调用", sum(lane["queued"] for lane in lanes))
+    queue_cols[1].metric("进行中的调用", sum(lane["in_flight"] for lane in lanes))
+    own_key = key_fingerprint(st.session_state.get("api_key"))
+    for lane in lanes:
+        if lane["key"] == own_key and lane["granted"]:
+            quota = f"，每分钟 {lane['tokens_per_minute']:,} token" if lane["tokens_per_minute"] else ""
+            st.caption(
+                f"{PROVIDER_LABELS.get(lane['provider'], lane['provider'])}：并发 {lane['in_flight']}/"
+                f"{lane['max_in_flight']}{quota}，排队 {lane['queued']} 个，"
+                f"排队等待 P95 {lane['wait_p95']:.1f}s"
+            )
+
     st.divider()
 
     st.markdown("""
@@ -633,186 +441,183 @@ novel_input = st.text_area(
     help="建议字数：5,000 - 30,000 字"
 )
 
-# 生成按钮
-if st.button("🎬 生成剧本", type="primary", disabled=not novel_input):
+# 当前任务：本会话提交的任务，或通过链接中的 ?job= 回到的任务
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+job = job_queue.get(job_id) if job_id else None
+job_active = job is not None and job["status"] not in FINISHED_STATES
+
+# 分步生成的断点：参数相同的运行共用同一组检查点
+plan = plan_batches(episodes, st.session_state.api_provider)
+run_id = make_run_id(novel_input, title, genre, episodes, st.session_state.api_provider, plan,
+                     optimize_mode, continuity)
+resume_run = False
+if generation_mode == "batch" and novel_input and not job_active:
+    run_status = checkpoints.status(run_id)
+    if run_status and not run_status["complete"]:
+        st.info(
+            f"检测到未完成的分步生成：故事概要{'已完成' if run_status['summary'] else '未完成'}，"
+            f"已生成 {run_status['drafts']}/{run_status['total_batches']} 批，"
+            f"已优化 {run_status['optimized']}/{run_status['total_batches']} 批"
+        )
+        resume_run = st.button("▶️ 继续上次生成", help="跳过已完成的阶段，从第一个未完成的阶段继续")
+
+# 生成按钮（同一会话同时只运行一个任务）
+start_run = st.button("🎬 生成剧本", type="primary", disabled=not novel_input or job_active)
+if start_run or resume_run:
     if not novel_input.strip():
         st.error("请输入小说内容")
     elif not st.session_state.api_key:
         st.error("请先在左侧配置 API Key")
     else:
-        if generation_mode == "single":
-            # ========== 单次生成模式 ==========
-            with st.spinner("正在生成剧本，请稍候（可能需要 30-60 秒）..."):
-                try:
-                    script_content = call_ai_model(
-                        novel=novel_input,
-                        title=title,
-                        genre=genre,
-                        episodes=episodes,
-                        opt_level=opt_level,
-                        api_key=st.session_state.api_key,
-                        provider=st.session_state.api_provider
-                    )
-
-                    report = {
-                        "格式问题修复": 3,
-                        "表演提示补充": 5,
-                        "特写镜头补充": 2,
-                        "配角记忆点补充": 1
-                    }
-
-                    st.success("生成完成！")
-
-                except Exception as e:
-                    st.error(f"生成失败：{str(e)}")
-                    script_content = None
-
-        else:
-            # ========== 分步生成模式 ==========
-            batch_size = 15
-            total_batches = (episodes + batch_size - 1) // batch_size
-
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            try:
-                # 第一步：提取故事概要（只做一次）
-                status_text.text("正在提取故事概要...")
-                progress_bar.progress(5)
-
-                summary_data = extract_story_summary(
-                    novel=novel_input,
-                    title=title,
-                    genre=genre,
-                    total_episodes=episodes,
-                    api_key=st.session_state.api_key,
-                    provider=st.session_state.api_provider
-                )
-
-                progress_bar.progress(15)
-
-                # 显示故事概要确认
-                with st.expander("📖 故事概要（AI提取）", expanded=True):
-                    st.markdown(f"**故事梗概：** {summary_data.get('story_summary', '')}")
-                    st.markdown(f"**人物数量：** {len(summary_data.get('characters', []))} 人")
-                    st.markdown(f"**分集计划：** {len(summary_data.get('episode_plan', []))} 集")
-
-                # 第二步：分批生成剧本
-                all_episodes_content = []
-                optimization_report = {
-                    "格式问题修复": 0,
-                    "表演提示补充": 0,
-                    "特写镜头补充": 0,
-                    "配角记忆点补充": 0
-                }
-
-                for batch_idx in range(total_batches):
-                    current_batch = batch_idx + 1
-                    status_text.text(f"正在生成分集剧本 {batch_idx * batch_size + 1}-{min((batch_idx + 1) * batch_size, episodes)} 集 ({current_batch}/{total_batches}批)...")
-
-                    # 生成该批剧本
-                    batch_content = generate_batch_with_summary(
-                        summary_data=summary_data,
-                        title=title,
-                        genre=genre,
-                        batch_num=batch_idx,
-                        total_episodes=episodes,
-                        api_key=st.session_state.api_key,
-                        provider=st.session_state.api_provider
-                    )
-
-                    # 立即优化该批剧本
-                    status_text.text(f"正在优化第 {batch_idx * batch_size + 1}-{min((batch_idx + 1) * batch_size, episodes)} 集...")
-                    optimized_batch = optimize_batch(
-                        batch_content=batch_content,
-                        optimization_points=summary_data.get("optimization_points", {}),
-                        api_key=st.session_state.api_key,
-                        provider=st.session_state.api_provider
-                    )
-
-                    # 累加内容
-                    all_episodes_content.append(f"\n{'='*50}\n")
-                    all_episodes_content.append(f"# 第 {batch_idx * batch_size + 1}-{min((batch_idx + 1) * batch_size, episodes)} 集\n")
-                    all_episodes_content.append(optimized_batch)
-
-                    # 更新进度
-                    progress = 15 + int(80 * (current_batch / total_batches))
-                    progress_bar.progress(progress)
-
-                # 组合完整剧本
-                script_content = f"""# 短剧剧本：{title}
-
-**题材：** {genre}
-**总集数：** {episodes}集
-
----
-
-## 故事梗概
-{summary_data.get('story_summary', '')}
-
----
-
-## 人物小传
-| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
-|------|------|-----------|---------|----------|
-"""
-
-                for char in summary_data.get('characters', []):
-                    script_content += f"| {char.get('name', '')} | {char.get('age', '')} | {char.get('identity', '')} | {char.get('personality', '')} | {char.get('background', '')} |\n"
-
-                script_content += """
----
+        # 提交后台任务，页面只负责轮询进度
+        job_id = job_queue.submit(
+            {
+                "mode": MODE_SINGLE if generation_mode == "single" else MODE_BATCH,
+                "novel": novel_input,
+                "title": title,
+                "genre": genre,
+                "episodes": episodes,
+                "opt_level": opt_level,
+                "provider": st.session_state.api_provider,
+                "max_in_flight": max_in_flight,
+                "optimize_mode": optimize_mode,
+                "continuity": continuity,
+                "plan": plan,
+                "run_id": run_id,
+                "resume": resume_run,
+                "fallback_provider": fallback_provider,
+                "hedge": hedge,
+            },
+            secrets={"api_key": st.session_state.api_key, "fallback_api_key": fallback_api_key}
+        )
+        st.session_state.job_id = job_id
+        st.query_params["job"] = job_id
+        job = job_queue.get(job_id)
+
+if job is not None and job["status"] not in FINISHED_STATES:
+    show_job_progress(job["id"])
+
+elif job is not None and job["status"] == JOB_FAILED:
+    st.error(f"生成失败：{job['error']}")
+    if job["params"]["mode"] == MODE_BATCH:
+        st.info("已完成的阶段已保存，点击「▶️ 继续上次生成」可从失败的批次继续")
+    show_partial_download(job.get("partial"), job["params"]["title"])
+
+elif job is not None:
+    # 显示结果（两种模式共用）
+    result = job["result"]
+    result_title = job["params"]["title"]
+    script_file = result["script_file"]
+
+    if result["mode"] == MODE_SINGLE:
+        # 单次生成没有优化前后可对比，统计剧本本身的指标
+        report_title = "📊 剧本质量"
+        report = result["quality"]
+        report_details = None
+    elif result["mode"] == MODE_REDO:
+        report_title = "📊 重做报告"
+        report = report_metrics(result["report"])
+        report_details = None
+    else:
+        report_title = "📊 优化报告"
+        report = report_metrics(result["report"])
+        report_details = [
+            {
+                "批次": batch_label(*result["plan"][i]),
+                "送优化集数": batch["episodes_optimized"],
+                "表演提示": batch["performance_added"],
+                "特写镜头": batch["closeup_added"],
+                "格式修复": batch["format_fixed"],
+                "剩余格式问题": batch["format_remaining"],
+                "新增行": batch["lines_added"],
+                "删除行": batch["lines_removed"],
+            }
+            for i, batch in enumerate(result["report"]["batches"])
+        ]
 
-## 表演记忆点
-| 角色 | 性格标签 | 口头禅 | 标志性动作 |
-|------|---------|--------|------------|
-"""
-                for char in summary_data.get('characters', []):
-                    name = char.get('name', '')
-                    script_content += f"| {name} | {char.get('personality', '')} | 待补充 | 待补充 |\n"
-
-                # 添加各集内容
-                script_content += "\n" + "".join(all_episodes_content)
-
-                progress_bar.progress(100)
-                status_text.text("生成完成！")
-
-                report = {
-                    "格式问题修复": 3,
-                    "表演提示补充": 5,
-                    "特写镜头补充": 2,
-                    "配角记忆点补充": 1
-                }
-
-                st.success("生成完成！")
-
-            except Exception as e:
-                st.error(f"生成失败：{str(e)}")
-                script_content = None
-                progress_bar.progress(0)
-
-        # 显示结果（两种模式共用）
-        if script_content:
-            # 显示优化报告
-            with st.expander("📊 优化报告", expanded=True):
-                cols = st.columns(4)
-                for i, (item, count) in enumerate(report.items()):
-                    cols[i % 4].metric(item, count)
-
-            # 显示剧本
-            st.subheader("📄 生成的剧本")
-
-            # 剧本预览（可折叠）
-            with st.expander("预览完整剧本", expanded=True):
-                st.markdown(script_content)
-
-            # 下载按钮
-            st.download_button(
-                label="📥 下载剧本",
-                data=script_content,
-                file_name=f"{title}.md",
-                mime="text/markdown"
-            )
+    if result["mode"] == MODE_REDO:
+        st.success(f"已重做第 {'、'.join(str(number) for number in result['redone'])} 集，其余各集保持不变")
+    else:
+        st.success("生成完成！")
+
+    # 显示优化报告
+    with st.expander(report_title, expanded=True):
+        cols = st.columns(4)
+        for i, (item, count) in enumerate(report.items()):
+            cols[i % 4].metric(item, count)
+        if report_details:
+            st.caption("各批优化前后对比")
+            st.table(report_details)
+
+    show_telemetry(Tracer.from_records(result["trace"]), result_title, result.get("context"))
+
+    # 剧本结构：集、场、台词和人物出场统计（生成完成时已统计）
+    with st.expander("📑 剧本结构", expanded=False):
+        stats = result["structure"]["stats"]
+        cols = st.columns(4)
+        cols[0].metric("集数", stats["episodes"])
+        cols[1].metric("场次", stats["scenes"])
+        cols[2].metric("台词", stats["dialogue"])
+        cols[3].metric("人物", stats["characters"])
+        if result["structure"]["characters"]:
+            st.table([
+                {"人物": char["name"], "出场场次": char["scenes"], "台词数": char["lines"]}
+                for char in result["structure"]["characters"]
+            ])
+
+    # 显示剧本
+    st.subheader("📄 生成的剧本")
+
+    if not script_store.exists(script_file):
+        st.warning("剧本文件已过期清理，请重新生成")
+    else:
+        # 剧本预览（可折叠，按集分页）
+        with st.expander("预览剧本", expanded=True):
+            show_script_preview(script_file, result["pages"])
+
+        # 下载按钮：点击时才读取文件
+        st.download_button(
+            label=f"📥 下载剧本（{result['script_size'] / 1024:.0f} KB）",
+            data=lambda: script_store.read_bytes(script_file),
+            file_name=f"{result_title}.md",
+            mime="text/markdown",
+            on_click="ignore"
+        )
+
+        # 按集重做：沿用本次的故事概要，只重做选中的几集并拼回原处
+        episode_numbers = [page["episode"] for page in result["pages"] if page["episode"] is not None]
+        if episode_numbers:
+            with st.expander("🔁 按集重做", expanded=False):
+                redo_numbers = st.multiselect(
+                    "选择要重做的集", episode_numbers, format_func=lambda number: f"第{number}集",
+                    key=f"redo_episodes_{script_file}"
+                )
+                redo_action = st.radio(
+                    "重做方式", list(REDO_LABELS), format_func=REDO_LABELS.get, horizontal=True,
+                    key=f"redo_action_{script_file}",
+                    help="重新生成：按故事概要和相邻集的剧情重写后再优化；重新优化：保留剧情，只修正格式和表演提示"
+                )
+                st.caption("只调用模型处理选中的集，不重新提取故事概要，也不重做其他批次")
+                if st.button("🔁 重做选中的集", disabled=not redo_numbers):
+                    if not st.session_state.api_key:
+                        st.error("请先在左侧配置 API Key")
+                    else:
+                        job_id = job_queue.submit(
+                            dict(
+                                job["params"],
+                                mode=MODE_REDO,
+                                provider=st.session_state.api_provider,
+                                fallback_provider=fallback_provider,
+                                hedge=hedge,
+                                script_file=script_file,
+                                redo_episodes=redo_numbers,
+                                redo_action=redo_action,
+                            ),
+                            secrets={"api_key": st.session_state.api_key, "fallback_api_key": fallback_api_key}
+                        )
+                        st.session_state.job_id = job_id
+                        st.query_params["job"] = job_id
+                        st.rerun()
 
 # 底部说明
 st.divider()
@@ -0,0 +1,129 @@
+"""
+HTTP API 服务压力测试
+
+在后台线程启动 api_server.APIServer（本地模拟提供商），用多个客户端并发请求 /api/generate
+（SSE 流式输出），统计：
+- 成功、被拒（503）的请求数，完成请求的吞吐量
+- 首个事件、首段剧本文本的延迟和整次请求耗时的 p50 / p95
+- 客户端在生成途中断开后，服务端释放槽位所用的时间（取消是否及时）
+
+运行方式:
+    python -m benchmarks.bench_api --clients 16 --max-concurrent 4 --max-queued 8 --episodes 10
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+
+import providers
+from api_server import APIServer
+from benchmarks.bench_pipeline import PROVIDER, sample_novel
+from benchmarks.bench_resilience import _percentile
+
+
+def stream_generate(port, body):
+    """发出一次 SSE 生成请求，返回 {"status", "first_event", "first_text", "duration", "events"}"""
+    started = time.perf_counter()
+    result = {"first_event": None, "first_text": None, "events": 0}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    conn.request("POST", "/api/generate", json.dumps(body),
+                 {"Content-Type": "application/json", "Accept": "text/event-stream"})
+    response = conn.getresponse()
+    result["status"] = response.status
+    if response.status == 200:
+        for line in response:
+            if not line.startswith(b"event: "):
+                continue
+            elapsed = time.perf_counter() - started
+            result["events"] += 1
+            if result["first_event"] is None:
+                result["first_event"] = elapsed
+            if line.startswith(b"event: delta") and result["first_text"] is None:
+                result["first_text"] = elapsed
+    else:
+        response.read()
+    conn.close()
+    result["duration"] = time.perf_counter() - started
+    return result
+
+
+def measure_load(server, body, clients):
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        result = stream_generate(server.port, body)
+        with lock:
+            results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    done = [result for result in results if result["status"] == 200]
+    return {
+        "ok": len(done),
+        "rejected": sum(result["status"] == 503 for result in results),
+        "elapsed": elapsed,
+        "first_event": [result["first_event"] for result in done if result["first_event"] is not None],
+        "first_text": [result["first_text"] for result in done if result["first_text"] is not None],
+        "duration": [result["duration"] for result in done],
+    }
+
+
+def measure_cancel(server, body, after):
+    """生成 after 秒后断开连接，返回服务端释放槽位所用的秒数"""
+    payload = json.dumps(body).encode("utf-8")
+    sock = socket.create_connection(("127.0.0.1", server.port))
+    sock.sendall(b"POST /api/generate HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n"
+                 b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(payload) + payload)
+    sock.recv(1024)
+    time.sleep(after)
+    sock.close()
+    closed = time.perf_counter()
+    while server.active:
+        time.sleep(0.005)
+    return time.perf_counter() - closed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API 服务压力测试")
+    parser.add_argument("--clients", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="服务端同时运行的请求数")
+    parser.add_argument("--max-queued", type=int, default=8, help="服务端排队上限")
+    parser.add_argument("--episodes", type=int, default=10, help="每个请求的集数")
+    parser.add_argument("--mode", default="batch", choices=["batch", "single"], help="生成模式")
+    parser.add_argument("--novel-chars", type=int, default=10000, help="样例小说字数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟首字延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=5000, help="模拟输出速度")
+    parser.add_argument("--cancel-after", type=float, default=0.3, help="取消测试中断开连接前等待的秒数")
+    args = parser.parse_args()
+
+    providers.set_response_cache(None)
+    providers.configure_provider(PROVIDER, latency=args.latency, tokens_per_second=args.tokens_per_second)
+    body = {"novel": sample_novel(args.novel_chars), "title": "样例", "genre": "古装宅斗",
+            "episodes": args.episodes, "mode": args.mode}
+
+    with APIServer(PROVIDER, port=0, max_concurrent=args.max_concurrent, max_queued=args.max_queued,
+                   access_log=False) as server:
+        r = measure_load(server, body, args.clients)
+        print(f"{args.clients} 个客户端（并发 {args.max_concurrent}，排队上限 {args.max_queued}）："
+              f"成功 {r['ok']}，拒绝 {r['rejected']}，用时 {r['elapsed']:.2f}s，"
+              f"吞吐 {r['ok'] / r['elapsed'] * 60:.1f} 请求/分钟")
+        for name, label in (("first_event", "首个事件"), ("first_text", "首段文本"), ("duration", "整次请求")):
+            if r[name]:
+                print(f"{label:<6} p50 {_percentile(r[name], 50):6.2f}s  p95 {_percentile(r[name], 95):6.2f}s")
+
+        released = measure_cancel(server, body, args.cancel_after)
+        print(f"客户端断开后 {released * 1000:.0f} ms 释放槽位（{server.stats()}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+剧本组合与分页读取基准测试
+
+用样例剧本模拟各批优化结果，对比在内存中拼出整部剧本（assemble_script）与
+逐段写入剧本文件（write_script + ScriptStore）的峰值内存，以及文件扫描分页、
+读取单集的耗时。
+
+运行方式:
+    python -m benchmarks.bench_assembly --episodes 200 --scenes 6
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_script_index import sample_script
+from pipeline import assemble_script, split_episodes, write_script
+from script_store import ScriptStore
+
+SUMMARY = {
+    "story_summary": "丫鬟替嫁入侯府，步步为营揭开当年旧案。",
+    "characters": [{"name": f"角色{i}", "personality": "隐忍"} for i in range(6)],
+}
+
+
+def measure(fn):
+    """返回 (结果, 耗时, 峰值内存字节数)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剧本组合与分页读取基准测试")
+    parser.add_argument("--episodes", type=int, default=200, help="集数")
+    parser.add_argument("--scenes", type=int, default=6, help="每集场次")
+    parser.add_argument("--batch-size", type=int, default=5, help="每批集数")
+    args = parser.parse_args()
+
+    episodes = [text for _, text in split_episodes(sample_script(args.episodes, args.scenes))]
+    plan = [(start, min(start + args.batch_size - 1, args.episodes))
+            for start in range(1, args.episodes + 1, args.batch_size)]
+    batches = ["".join(episodes[start - 1:end]) for start, end in plan]
+    print(f"{args.episodes} 集 {len(plan)} 批，各批合计 {sum(len(batch) for batch in batches)} 字")
+
+    script, elapsed, peak = measure(
+        lambda: assemble_script("样例", "古装宅斗", args.episodes, SUMMARY, plan, batches)
+    )
+    print(f"assemble_script（内存拼接）: {elapsed * 1000:.1f}ms  峰值内存 {peak / 1024:.0f} KB")
+    del script
+
+    with tempfile.TemporaryDirectory() as root:
+        store = ScriptStore(root)
+
+        def write():
+            with store.writer("bench") as f:
+                write_script(f, "样例", "古装宅斗", args.episodes, SUMMARY, plan, batches)
+
+        _, elapsed, peak = measure(write)
+        print(f"write_script（写入文件）: {elapsed * 1000:.1f}ms  峰值内存 {peak / 1024:.0f} KB  "
+              f"文件 {store.size('bench') / 1024:.0f} KB")
+
+        (pages, _), elapsed, _ = measure(lambda: store.scan("bench"))
+        print(f"scan（分页 + 结构索引）: {elapsed * 1000:.1f}ms  {len(pages)} 页")
+
+        page = pages[len(pages) // 2]
+        text, elapsed, peak = measure(lambda: store.read("bench", page["start"], page["end"]))
+        print(f"read（读取 {page['title']}）: {elapsed * 1000:.2f}ms  {len(text)} 字  峰值内存 {peak / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+客户端复用基准测试
+
+对比「每次调用新建客户端」与「ClientRegistry 复用客户端」在本地桩服务器上的
+耗时和 TCP 连接数。启用 --tls 时使用临时自签名证书走 HTTPS，可直接看到
+TLS 握手的开销（需要本机有 openssl 命令）。
+
+运行方式:
+    python -m benchmarks.bench_clients --calls 50 --tls
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from benchmarks.stub_server import StubLLMServer
+from clients import SDK_OPENAI, ClientRegistry, _create_openai_client
+
+
+def _make_self_signed_cert(directory):
+    """生成 localhost 的自签名证书，返回 (certfile, keyfile)"""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", keyfile, "-out", certfile, "-days", "1",
+            "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def _call(client):
+    response = client.chat.completions.create(
+        model="stub",
+        messages=[{"role": "user", "content": "ping"}],
+    )
+    return response.choices[0].message.content
+
+
+def run_per_call(server, base_url, calls):
+    """每次调用新建客户端（旧实现）"""
+    server.reset_counters()
+    start = time.perf_counter()
+    for _ in range(calls):
+        client = _create_openai_client("stub-key", base_url)
+        _call(client)
+        client.close()
+    return time.perf_counter() - start, server.connections
+
+
+def run_pooled(server, base_url, calls):
+    """通过 ClientRegistry 复用客户端"""
+    server.reset_counters()
+    registry = ClientRegistry()
+    start = time.perf_counter()
+    for _ in range(calls):
+        with registry.client(SDK_OPENAI, "stub-key", base_url) as client:
+            _call(client)
+    elapsed = time.perf_counter() - start
+    registry.clear()
+    return elapsed, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="客户端复用基准测试")
+    parser.add_argument("--calls", type=int, default=50, help="调用次数")
+    parser.add_argument("--tls", action="store_true", help="使用自签名证书走 HTTPS")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_clients_")
+    try:
+        certfile = keyfile = None
+        if args.tls:
+            certfile, keyfile = _make_self_signed_cert(tmpdir)
+            # httpx 默认读取 SSL_CERT_FILE 作为信任的 CA
+            os.environ["SSL_CERT_FILE"] = certfile
+
+        with StubLLMServer(certfile=certfile, keyfile=keyfile) as server:
+            base_url = server.url + "/v1"
+            # 预热：加载 SDK 与 TLS 上下文
+            run_pooled(server, base_url, 1)
+
+            results = [
+                ("每次新建客户端", run_per_call(server, base_url, args.calls)),
+                ("复用客户端", run_pooled(server, base_url, args.calls)),
+            ]
+
+        print(f"{'模式':<12}{'调用次数':>8}{'TCP连接':>8}{'总耗时(s)':>12}{'平均(ms)':>10}")
+        for name, (elapsed, connections) in results:
+            print(f"{name:<12}{args.calls:>8}{connections:>8}{elapsed:>12.3f}{elapsed / args.calls * 1000:>10.2f}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+按批裁剪人物设定基准测试
+
+模拟长篇 map-reduce 提取出的大人物表（每集的分集大纲只提到其中几人），
+对比每批生成提示词发送完整人物设定与按批裁剪后的输入 token（本地估算，不调用模型）。
+
+运行方式:
+    python -m benchmarks.bench_context --characters 30 --episodes 60 --batch-size 5
+"""
+
+import argparse
+import random
+
+from cast_index import CastIndex
+from prompts import build_batch_prompt
+from tokens import estimate_tokens
+
+SURNAMES = "苏沈柳王李周吴郑陈林黄赵钱孙冯韩杨朱秦许何吕施张孔曹严华金魏陶姜"
+GIVEN_NAMES = "清晏景珩如烟婉宁承泽若雪子衿明远云舒念安书瑶怀瑾知意"
+
+
+def sample_summary(characters, episodes, per_episode, seed=0):
+    rng = random.Random(seed)
+    names = []
+    while len(names) < characters:
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES)
+        if name not in names:
+            names.append(name)
+    cast = [
+        {"name": name, "age": f"{rng.randint(16, 60)}岁", "identity": "侯府中人",
+         "personality": "外柔内刚、心思缜密", "background": "自幼入府，与主角有旧怨，掌握当年旧案的关键线索"}
+        for name in names
+    ]
+    plan = []
+    for ep in range(1, episodes + 1):
+        # 主角几乎每集出场，配角按剧情段落轮流出场
+        present = names[:2] + rng.sample(names[2:], per_episode)
+        plan.append(f"第{ep}集：{'、'.join(present)}在祠堂对峙，旧案线索再进一步")
+    marks = "，".join(f"{name}-口头禅「罢了」+ 捻佛珠" for name in names[2:])
+    return {
+        "story_summary": "丫鬟替嫁入侯府，步步为营揭开当年旧案。",
+        "characters": cast,
+        "episode_plan": plan,
+        "optimization_points": {"character_marks": marks},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按批裁剪人物设定基准测试")
+    parser.add_argument("--characters", type=int, default=30, help="人物表人数")
+    parser.add_argument("--episodes", type=int, default=60, help="集数")
+    parser.add_argument("--batch-size", type=int, default=5, help="每批集数")
+    parser.add_argument("--per-episode", type=int, default=3, help="每集出场的配角数")
+    parser.add_argument("--provider", default="deepseek", help="估算 token 时使用的提供商")
+    args = parser.parse_args()
+
+    summary = sample_summary(args.characters, args.episodes, args.per_episode)
+    cast = CastIndex(summary, args.provider)
+    full_tokens = pruned_tokens = 0
+    for start in range(1, args.episodes + 1, args.batch_size):
+        end = min(start + args.batch_size - 1, args.episodes)
+        plan_text = "".join(f"- 第{ep}集：{summary['episode_plan'][ep - 1]}\n" for ep in range(start, end + 1))
+        full = build_batch_prompt(summary, "古装宅斗", start, end, plan_text)
+        characters, marks = cast.batch_context(start, end)
+        pruned = build_batch_prompt(summary, "古装宅斗", start, end, plan_text,
+                                    characters=characters, character_marks=marks)
+        full_tokens += estimate_tokens(full.system + full.user, args.provider)
+        pruned_tokens += estimate_tokens(pruned.system + pruned.user, args.provider)
+
+    report = cast.report()
+    sent = [batch["characters"] for batch in report["batches"]]
+    print(f"{args.characters} 人、{args.episodes} 集、{len(sent)} 批，各批平均发送 {sum(sent) / len(sent):.1f} 人")
+    print(f"各批生成提示词合计：完整人物设定 {full_tokens:,} token，按批裁剪 {pruned_tokens:,} token"
+          f"（减少 {1 - pruned_tokens / full_tokens:.0%}）")
+    print(f"估算节省：裁剪人物 {report['tokens_saved']:,} token，"
+          f"人物设定由缩进 JSON 改为紧凑文本 {report['format_tokens_saved']:,} token")
+
+
+if __name__ == "__main__":
+    main()
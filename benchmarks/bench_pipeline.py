@@ -0,0 +1,169 @@
+"""
+端到端流水线基准测试
+
+使用本地模拟提供商（fake_provider）跑完整的单次生成和分步生成流程，不联网、结果确定，
+可在 CI 中发现性能回退。每种模式、每个集数统计：
+- 吞吐量：每分钟产出的完整集数（单次生成输出被截断时只计完整的集）
+- 整次运行耗时的 p50 / p95，单次模型调用耗时的 p95
+- 每次运行的模型调用次数、重试次数
+- 峰值内存（tracemalloc，计时之外单独运行，取几次中的最小值）
+
+模拟提供商的首字延迟、输出速度、出错和截断概率可以调整。--output 保存结果，
+--baseline 与之前保存的结果对比：调用次数增加，或耗时、峰值内存超出 --tolerance 时以非零状态退出。
+
+运行方式:
+    python -m benchmarks.bench_pipeline --episodes 3,10,30,50 --runs 3 --output pipeline.json
+    python -m benchmarks.bench_pipeline --baseline pipeline.json
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import providers
+from benchmarks.bench_resilience import _percentile
+from fake_provider import reset_fake_provider
+from pipeline import call_ai_model, run_batch_pipeline, split_episodes
+from telemetry import LLM_SPAN, Tracer, use_tracer
+
+PROVIDER = "fake"
+MODE_SINGLE = "single"
+MODE_BATCH = "batch"
+
+# 测量峰值内存的运行次数
+MEMORY_RUNS = 3
+
+CHAPTER_TEXT = "苏清晏低着头跟在小姐身后走进侯府，廊下的灯笼被风吹得摇晃，她攥紧了袖中的旧帕子。"
+
+
+def sample_novel(chars):
+    """按章节排列的样例小说，约 chars 字"""
+    chapters = []
+    total = 0
+    while total < chars:
+        chapter = f"第{len(chapters) + 1}章\n" + CHAPTER_TEXT * 40 + "\n"
+        chapters.append(chapter)
+        total += len(chapter)
+    return "".join(chapters)
+
+
+def run_once(mode, novel, episodes, max_in_flight):
+    """跑一次完整流程，返回 (剧本, Tracer)"""
+    reset_fake_provider()
+    tracer = Tracer()
+    with use_tracer(tracer):
+        if mode == MODE_SINGLE:
+            script = call_ai_model(novel, "样例", "古装宅斗", episodes, "deep", None, PROVIDER)
+        else:
+            script = run_batch_pipeline(novel, "样例", "古装宅斗", episodes, None, PROVIDER,
+                                        max_in_flight=max_in_flight)["script"]
+    return script, tracer
+
+
+def measure(mode, novel, episodes, runs, max_in_flight):
+    durations = []
+    call_durations = []
+    calls = retries = completed = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        script, tracer = run_once(mode, novel, episodes, max_in_flight)
+        durations.append(time.perf_counter() - started)
+        llm_spans = [record for record in tracer.spans if record["name"] == LLM_SPAN]
+        call_durations += [record["duration"] for record in llm_spans]
+        calls += len(llm_spans)
+        retries += sum(record["attributes"].get("retries") or 0 for record in llm_spans)
+        completed += len({number for number, _ in split_episodes(script)})
+
+    # 并发批次的交错顺序不同，峰值内存偶尔偏高，取 MEMORY_RUNS 次中的最小值
+    peaks = []
+    for _ in range(MEMORY_RUNS):
+        gc.collect()
+        tracemalloc.start()
+        run_once(mode, novel, episodes, max_in_flight)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "episodes_per_minute": completed / sum(durations) * 60,
+        "completed_episodes": completed / runs,
+        "run_p50": _percentile(durations, 50),
+        "run_p95": _percentile(durations, 95),
+        "call_p95": _percentile(call_durations, 95),
+        "calls_per_run": calls / runs,
+        "retries_per_run": retries / runs,
+        "peak_kb": min(peaks) / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回回退项的说明"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current["calls_per_run"] > previous["calls_per_run"]:
+            regressions.append(f"{name} 调用次数 {previous['calls_per_run']:g} → {current['calls_per_run']:g}")
+        for key in ("run_p95", "call_p95", "peak_kb"):
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name} {key} {previous[key]:.3f} → {current[key]:.3f}")
+        if current["episodes_per_minute"] < previous["episodes_per_minute"] * (1 - tolerance):
+            regressions.append(f"{name} 吞吐量 {previous['episodes_per_minute']:.1f} → "
+                               f"{current['episodes_per_minute']:.1f} 集/分钟")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端流水线基准测试")
+    parser.add_argument("--episodes", default="3,10,30,50", help="逗号分隔的集数")
+    parser.add_argument("--modes", default="single,batch", help="逗号分隔的生成模式")
+    parser.add_argument("--runs", type=int, default=3, help="每种组合的运行次数")
+    parser.add_argument("--novel-chars", type=int, default=30000, help="样例小说字数")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="分步生成的最大并发请求数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟首字延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=20000, help="模拟输出速度，0 为不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟可重试错误的概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="模拟输出被截断的概率")
+    parser.add_argument("--output", default=None, help="结果写入的 JSON 文件")
+    parser.add_argument("--baseline", default=None, help="对比的基线结果 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="耗时和峰值内存允许的回退比例")
+    args = parser.parse_args()
+
+    providers.BACKOFF_BASE = 0.01
+    providers.set_response_cache(None)
+    providers.configure_provider(PROVIDER, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                 error_rate=args.error_rate, truncate_rate=args.truncate_rate)
+    novel = sample_novel(args.novel_chars)
+
+    print(f"{'组合':<12}{'集/分钟':>9}{'完成集数':>9}{'运行 p50':>10}{'运行 p95':>10}"
+          f"{'调用 p95':>10}{'调用数':>8}{'重试':>6}{'峰值内存':>11}")
+    results = {}
+    for mode in args.modes.split(","):
+        for episodes in (int(value) for value in args.episodes.split(",")):
+            name = f"{mode}-{episodes}"
+            r = results[name] = measure(mode, novel, episodes, args.runs, args.max_in_flight)
+            print(f"{name:<12}{r['episodes_per_minute']:>9.1f}{r['completed_episodes']:>9.1f}"
+                  f"{r['run_p50']:>9.2f}s{r['run_p95']:>9.2f}s{r['call_p95']:>9.2f}s"
+                  f"{r['calls_per_run']:>8.1f}{r['retries_per_run']:>6.1f}{r['peak_kb']:>8.0f} KB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n性能回退：")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print("\n与基线相比没有回退")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+提示词前缀缓存基准测试
+
+在模拟前缀缓存的本地桩服务器上运行一次完整的分步生成流程，按阶段统计
+输入 token、命中前缀缓存的输入 token 和节省的费用（桩服务器以字符数模拟 token 数）。
+
+运行方式:
+    python -m benchmarks.bench_prefix_cache --episodes 40 --provider deepseek
+    python -m benchmarks.bench_prefix_cache --episodes 40 --provider claude
+"""
+
+import argparse
+import json
+import re
+import time
+
+import providers
+from benchmarks.stub_server import StubLLMServer, _content_text
+from pipeline import SPAN_LABELS, run_batch_pipeline
+from telemetry import Tracer, use_tracer
+
+CHARACTERS = [
+    {"name": f"角色{i}", "age": f"{18 + i}岁", "identity": "侯府旧人", "personality": "隐忍坚韧、心思缜密",
+     "background": "自幼入府，见证侯府三十年兴衰，与主角有旧怨" * 2}
+    for i in range(8)
+]
+
+OPTIMIZATION_POINTS = {
+    "format_notes": "\n".join(f"{i}. 场景标注必须包含日/夜、内/外，宅斗场景注明所在院落" for i in range(1, 9)),
+    "performance_notes": "\n".join(f"{i}. 对峙戏以眼神和停顿表现暗流，避免直白喊叫" for i in range(1, 9)),
+    "camera_notes": "\n".join(f"{i}. 关键道具（玉佩、账本、药碗）出现时给特写" for i in range(1, 9)),
+    "character_marks": "，".join(f"角色{i}-口头禅「罢了」+ 捻佛珠" for i in range(8)),
+}
+
+
+def make_reply(episodes):
+    summary = json.dumps({
+        "story_summary": "丫鬟替嫁入侯府，步步为营揭开当年旧案。" * 4,
+        "characters": CHARACTERS,
+        "episode_plan": [f"第{i}集的核心事件：主角设局反击，旧案线索再进一步" for i in range(1, episodes + 1)],
+        "optimization_points": OPTIMIZATION_POINTS,
+    }, ensure_ascii=False)
+
+    def reply(body):
+        user = _content_text(body["messages"][-1]["content"])
+        if "交接点" in user:
+            return json.dumps({"handoffs": []})
+        match = re.search(r"为第 (\d+)-(\d+) 集创作剧本", user)
+        if match:
+            return "".join(
+                f"**第{ep}集：标题**\n**核心剧情：** 事件{ep}\n\n"
+                f"{ep}-1   书房     日    内\n人物：角色0\n\n▲ 场景描述\n角色0（平静）：台词\n"
+                for ep in range(int(match.group(1)), int(match.group(2)) + 1)
+            )
+        if "=== 需要优化的剧本内容 ===\n" in user:
+            return user.split("=== 需要优化的剧本内容 ===\n", 1)[1]
+        return summary
+
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词前缀缓存基准测试")
+    parser.add_argument("--provider", default="deepseek", help="使用的提供商配置")
+    parser.add_argument("--episodes", type=int, default=40, help="集数")
+    parser.add_argument("--batch-size", type=int, default=4, help="每批集数")
+    args = parser.parse_args()
+
+    with StubLLMServer(reply=make_reply(args.episodes), prefix_cache=True) as server:
+        suffix = "" if providers.get_provider_config(args.provider)["sdk"] == "anthropic" else "/v1"
+        providers.configure_provider(args.provider, base_url=server.url + suffix, requests_per_minute=60000)
+        plan = [(start, min(start + args.batch_size - 1, args.episodes))
+                for start in range(1, args.episodes + 1, args.batch_size)]
+
+        tracer = Tracer()
+        started = time.perf_counter()
+        with use_tracer(tracer):
+            run_batch_pipeline("小说内容。" * 200, "基准", "古装宅斗", args.episodes, "stub-key", args.provider,
+                               plan=plan, optimize_mode="full")
+        elapsed = time.perf_counter() - started
+
+    summary = tracer.summary()
+    print(f"{args.provider}：{args.episodes} 集 {len(plan)} 批，{server.requests} 次请求，耗时 {elapsed:.2f}s")
+    print(f"{'阶段':<10}{'输入 token':>12}{'缓存命中':>12}{'命中率':>8}{'节省（美元）':>14}")
+    for stage in summary["stages"] + [dict(summary["total"], name="total")]:
+        share = stage["cached_input_tokens"] / stage["input_tokens"] if stage["input_tokens"] else 0.0
+        print(f"{SPAN_LABELS.get(stage['name'], stage['name']):<10}{stage['input_tokens']:>12,}"
+              f"{stage['cached_input_tokens']:>12,}{share:>8.0%}{stage['cache_savings']:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+优化报告对比耗时基准测试
+
+生成样例剧本作为优化前草稿，模拟优化（补充表演提示、特写，修复场景标注），
+对比 report.diff_batch（按场次对齐 + 行多重集合差）与 difflib 整篇逐行对比的耗时。
+
+运行方式:
+    python -m benchmarks.bench_report --episodes 200 --scenes 6
+"""
+
+import argparse
+import difflib
+import re
+import time
+
+from benchmarks.bench_script_index import sample_script
+from report import diff_batch
+
+
+def simulate_optimize(draft):
+    """模拟优化：每场补一条表演提示和特写，并补全缺失的内/外标注"""
+    optimized = draft.replace("【切镜】", "【★表演提示】停顿一拍\n【特写】烛火\n【切镜】")
+    return re.sub(r"^(\d+-\d+\s+\S+\s+[日夜])$", r"\1    内", optimized, flags=re.M)
+
+
+def difflib_report(before, after):
+    """基线：整篇逐行 difflib 对比后统计新增的标记"""
+    added = [
+        line for line in difflib.unified_diff(before.split("\n"), after.split("\n"), lineterm="", n=0)
+        if line.startswith("+") and not line.startswith("+++")
+    ]
+    return {
+        "performance_added": sum(line.count("【★表演提示") for line in added),
+        "closeup_added": sum(line.count("【特写") for line in added),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="优化报告对比耗时基准测试")
+    parser.add_argument("--episodes", type=int, default=200, help="集数")
+    parser.add_argument("--scenes", type=int, default=6, help="每集场次")
+    parser.add_argument("--skip-difflib", action="store_true", help="不运行 difflib 基线")
+    args = parser.parse_args()
+
+    # 草稿中每隔一场去掉内/外标注，作为待修复的格式问题
+    draft = sample_script(args.episodes, args.scenes)
+    draft = re.sub(r"^(\d+-\d*[13579]\s+\S+\s+[日夜])\s+内$", r"\1", draft, flags=re.M)
+    optimized = simulate_optimize(draft)
+    print(f"草稿 {len(draft)} 字，优化后 {len(optimized)} 字")
+
+    started = time.perf_counter()
+    result = diff_batch(draft, optimized)
+    elapsed = time.perf_counter() - started
+    print(f"diff_batch: {elapsed * 1000:.1f}ms  {result}")
+
+    if not args.skip_difflib:
+        started = time.perf_counter()
+        baseline = difflib_report(draft, optimized)
+        elapsed = time.perf_counter() - started
+        print(f"difflib 逐行对比: {elapsed * 1000:.1f}ms  {baseline}")
+
+
+if __name__ == "__main__":
+    main()
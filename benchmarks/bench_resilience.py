@@ -0,0 +1,77 @@
+"""
+调用层容错基准测试
+
+在注入延迟和错误的本地桩服务器上并发调用 providers.complete，
+统计成功率、重试次数、限流等待和耗时分位数。
+
+运行方式:
+    python -m benchmarks.bench_resilience --calls 40 --concurrency 8 --error-rate 0.3 --latency 0.05
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import providers
+from benchmarks.stub_server import StubLLMServer
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="调用层容错基准测试")
+    parser.add_argument("--provider", default="deepseek", help="使用的提供商配置")
+    parser.add_argument("--calls", type=int, default=40, help="调用次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务器响应延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="随机错误概率")
+    parser.add_argument("--error-status", type=int, default=503, help="随机错误状态码")
+    parser.add_argument("--retry-after", type=float, default=None, help="错误响应的 Retry-After（秒）")
+    parser.add_argument("--rpm", type=int, default=6000, help="令牌桶请求频率（次/分钟）")
+    parser.add_argument("--stream", action="store_true", help="使用流式请求")
+    args = parser.parse_args()
+
+    providers.BACKOFF_BASE = 0.05
+    server = StubLLMServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+    )
+    with server:
+        suffix = "" if providers.get_provider_config(args.provider)["sdk"] == "anthropic" else "/v1"
+        providers.configure_provider(args.provider, base_url=server.url + suffix, requests_per_minute=args.rpm)
+
+        def one_call(_):
+            start = time.perf_counter()
+            try:
+                result = providers.complete(
+                    args.provider, "system", "user", "stub-key",
+                    on_delta=(lambda text: None) if args.stream else None
+                )
+                return True, time.perf_counter() - start, result["retries"], result["rate_limit_wait"]
+            except Exception:
+                return False, time.perf_counter() - start, providers.MAX_RETRIES, 0.0
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(one_call, range(args.calls)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for ok, latency, _, _ in results if ok]
+    print(f"调用次数      {args.calls}")
+    print(f"成功          {sum(ok for ok, _, _, _ in results)}")
+    print(f"服务端请求数  {server.requests}（注入错误 {server.errors} 次）")
+    print(f"重试总数      {sum(retries for _, _, retries, _ in results)}")
+    print(f"限流等待(s)   {sum(wait for _, _, _, wait in results):.2f}")
+    print(f"总耗时(s)     {elapsed:.2f}")
+    print(f"p50 / p95(ms) {_percentile(latencies, 50) * 1000:.0f} / {_percentile(latencies, 95) * 1000:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+多提供商路由基准测试
+
+两个本地桩服务器分别模拟主提供商和备用提供商，主提供商按比例随机出现慢请求（长尾延迟），
+对比只用主提供商、路由对冲两种方式的延迟分位数和额外请求数；再让主提供商全部出错，
+验证故障转移后调用仍然成功。最后用脚本化的提供商检查「先输出的一方中途失败、
+被取消的对冲请求仍未结束」时，非流式调用会换提供商或报错，而不是一直等待。
+
+运行方式:
+    python -m benchmarks.bench_routing --calls 60 --slow-rate 0.03 --slow-latency 2
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import providers
+import routing
+from benchmarks.bench_resilience import _percentile
+from benchmarks.stub_server import StubLLMServer
+from routing import Router, provider_stats, reset_provider_stats
+
+
+def run_calls(args, router, stream):
+    """并发发出 args.calls 次调用，返回 [(成功, 耗时, 给出结果的提供商)]"""
+    def one_call(index):
+        started = time.perf_counter()
+        try:
+            with providers.use_router(router):
+                result = providers.call_provider_result(
+                    "system", f"user {index}", "stub-key", args.primary,
+                    on_delta=(lambda text: None) if stream else None
+                )
+            return True, time.perf_counter() - started, result.get("provider", args.primary)
+        except Exception:
+            return False, time.perf_counter() - started, None
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(one_call, range(args.calls)))
+
+
+def report(name, results, primary, secondary):
+    latencies = [latency for ok, latency, _ in results if ok]
+    winners = [provider for ok, _, provider in results if ok]
+    print(f"{name:<12}成功 {len(latencies)}/{len(results)}  "
+          f"p50 {_percentile(latencies, 50) * 1000:.0f}ms  p95 {_percentile(latencies, 95) * 1000:.0f}ms  "
+          f"p99 {_percentile(latencies, 99) * 1000:.0f}ms  "
+          f"请求 {primary.requests}+{secondary.requests}  备用胜出 {winners.count(secondary.name)}")
+    primary.reset_counters()
+    secondary.reset_counters()
+
+
+def check_owner_failure(primary, secondary, failover):
+    """
+    主提供商先输出后失败，此时已取消的对冲请求还挂着没有输出；
+    返回 (结果或异常, 耗时)，超过 5 秒未返回视为卡住
+    """
+    calls = {secondary: 0}
+    lock = threading.Lock()
+
+    def scripted(system_prompt, user_prompt, api_key, provider, on_delta=None, prefix=None):
+        if provider == primary:
+            time.sleep(0.1)
+            on_delta("片段")
+            time.sleep(0.1)
+            raise RuntimeError("主提供商中途失败")
+        with lock:
+            calls[secondary] += 1
+            first = calls[secondary] == 1
+        if first:
+            time.sleep(3)
+        on_delta("备用")
+        return {"text": "备用", "truncated": False, "cached": False}
+
+    outcome = {}
+
+    def call():
+        router = Router([primary, secondary], hedge_delay=0.05, failover=failover)
+        try:
+            outcome["result"] = router.call("system", "user", "stub-key", primary)
+        except Exception as e:
+            outcome["result"] = e
+
+    original = routing.call_provider_direct
+    routing.call_provider_direct = scripted
+    try:
+        started = time.perf_counter()
+        thread = threading.Thread(target=call, daemon=True)
+        thread.start()
+        thread.join(5)
+        return outcome.get("result", "卡住"), time.perf_counter() - started
+    finally:
+        routing.call_provider_direct = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多提供商路由基准测试")
+    parser.add_argument("--primary", default="deepseek", help="主提供商配置")
+    parser.add_argument("--secondary", default="gemini_flash", help="备用提供商配置")
+    parser.add_argument("--calls", type=int, default=60, help="每种方式的调用次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发数")
+    parser.add_argument("--latency", type=float, default=0.05, help="两个桩服务器的基础延迟（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="主提供商慢请求的概率")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="慢请求的额外延迟（秒）")
+    parser.add_argument("--stream", action="store_true", help="调用方使用流式输出")
+    args = parser.parse_args()
+
+    providers.BACKOFF_BASE = 0.05
+    with StubLLMServer(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency) as primary, \
+            StubLLMServer(latency=args.latency) as secondary:
+        primary.name, secondary.name = args.primary, args.secondary
+        for provider, server in ((args.primary, primary), (args.secondary, secondary)):
+            suffix = "" if providers.get_provider_config(provider)["sdk"] == "anthropic" else "/v1"
+            providers.configure_provider(provider, base_url=server.url + suffix, requests_per_minute=60000)
+
+        print(f"主提供商 {args.primary}（{args.slow_rate:.0%} 的请求慢 {args.slow_latency}s），"
+              f"备用 {args.secondary}，{args.calls} 次调用")
+        report("只用主提供商", run_calls(args, None, args.stream), primary, secondary)
+
+        router = Router([args.primary, args.secondary])
+        # 先用一轮调用积累延迟直方图，对冲阈值取主提供商的 P95
+        run_calls(args, router, args.stream)
+        primary.reset_counters()
+        secondary.reset_counters()
+        print(f"对冲阈值 {router.delay_for(args.primary) * 1000:.0f}ms")
+        report("路由对冲", run_calls(args, router, args.stream), primary, secondary)
+
+        reset_provider_stats()
+        primary.error_rate, primary.error_status = 1.0, 500
+        report("主提供商故障", run_calls(args, Router([args.primary, args.secondary], hedge=False),
+                                     args.stream), primary, secondary)
+
+    for provider, stats in provider_stats().items():
+        print(f"{provider}: {stats}")
+
+    reset_provider_stats()
+    for failover in (True, False):
+        result, elapsed = check_owner_failure(args.primary, args.secondary, failover)
+        print(f"输出方失败、对冲已取消（failover={failover}）：{elapsed:.2f}s 返回 {result!r}")
+
+
+if __name__ == "__main__":
+    main()
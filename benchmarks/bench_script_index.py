@@ -0,0 +1,77 @@
+"""
+剧本结构索引基准测试
+
+生成指定集数的样例剧本，分别一次性解析和按流式输出的小片段增量解析，
+统计耗时并校验两种方式得到的索引一致。
+
+运行方式:
+    python -m benchmarks.bench_script_index --episodes 50 --scenes 6 --chunk 16
+"""
+
+import argparse
+import time
+
+from script_index import ScriptParser, parse_script
+
+
+CHARACTERS = ["苏清晏", "沈景珩", "柳嬷嬷", "沈夫人"]
+
+
+def sample_script(episodes, scenes):
+    """按提示词格式生成样例剧本"""
+    lines = ["# 短剧剧本：样例", ""]
+    for ep in range(1, episodes + 1):
+        lines += [f"**第{ep}集：第{ep}集标题**", f"**核心剧情：** 第{ep}集的核心事件", ""]
+        for sc in range(1, scenes + 1):
+            a, b = CHARACTERS[sc % 4], CHARACTERS[(sc + 1) % 4]
+            lines += [
+                f"{ep}-{sc}   侯府书房     {'日' if sc % 2 else '夜'}    内",
+                f"人物：{a}、{b}",
+                "",
+                f"▲ {a}推门而入，{b}放下手中的书卷，屋内烛火摇晃。",
+                f"【特写】{b}握笔的手一顿",
+                f"{a}（低声）：这件事，奴婢不敢瞒着您。",
+                "【★表演提示】眼神躲闪，声音发颤",
+                f"{b}（冷淡）：说下去。",
+                f"【画外音·{a}】若是说错一个字，便再没有回头路了。",
+                "【切镜】",
+                "",
+            ]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剧本结构索引基准测试")
+    parser.add_argument("--episodes", type=int, default=50, help="集数")
+    parser.add_argument("--scenes", type=int, default=6, help="每集场次")
+    parser.add_argument("--chunk", type=int, default=16, help="增量解析时每段文本的字数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    text = sample_script(args.episodes, args.scenes)
+    print(f"样例剧本：{args.episodes} 集，{len(text)} 字，{text.count(chr(10)) + 1} 行")
+
+    full_times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        full = parse_script(text, CHARACTERS)
+        full_times.append(time.perf_counter() - started)
+
+    stream_times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        incremental = ScriptParser(CHARACTERS)
+        for i in range(0, len(text), args.chunk):
+            incremental.feed(text[i:i + args.chunk])
+        streamed = incremental.close()
+        stream_times.append(time.perf_counter() - started)
+
+    same = full.episodes == streamed.episodes and full.characters == streamed.characters
+    print(f"索引：{full.stats()}")
+    print(f"一次性解析: {min(full_times) * 1000:.1f}ms")
+    print(f"增量解析（每段 {args.chunk} 字，共 {len(text) // args.chunk + 1} 段）: {min(stream_times) * 1000:.1f}ms")
+    print(f"两种方式结果一致: {'是' if same else '否'}")
+
+
+if __name__ == "__main__":
+    main()
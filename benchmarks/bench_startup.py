@@ -0,0 +1,139 @@
+"""
+启动与重跑耗时基准测试
+
+- 模块导入：在新进程中用 python -X importtime 导入各模块，统计累计导入耗时，
+  并检查导入后是否已经加载了 anthropic / openai SDK（应在首次调用时才加载）
+- 冷启动：在新进程中用 Streamlit AppTest 首次执行 app.py
+- 重跑：同一进程中切换侧边栏控件后重复执行 app.py，统计每次重跑耗时
+
+结果可用 --output 写入 JSON，与之前的结果对比即可发现启动耗时回退。
+
+运行方式:
+    python -m benchmarks.bench_startup --reruns 20 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["prompts", "providers", "extraction", "pipeline", "streamlit", "app_deps"]
+
+# app.py 除 streamlit 以外导入的本地模块
+APP_DEPS = "cache, checkpoint, clients, pipeline, providers, scheduler"
+
+SDK_MODULES = ["anthropic", "openai"]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure_import(module):
+    """在新进程中导入模块，返回累计导入耗时、进程总耗时（毫秒）和导入后已加载的 SDK"""
+    statement = f"import {APP_DEPS}" if module == "app_deps" else f"import {module}"
+    code = f"{statement}; import sys; print(','.join(m for m in {SDK_MODULES!r} if m in sys.modules))"
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    wall = (time.perf_counter() - started) * 1000
+
+    # importtime 每行: "import time: self | cumulative | name"，嵌套导入的 name 带缩进，
+    # 只累加被测模块自身（顶层）的累计耗时，不含解释器启动时的 site 等模块
+    targets = set(statement[len("import "):].replace(" ", "").split(","))
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name[1:] in targets:
+            total_us += int(cumulative)
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return {"import_ms": total_us / 1000, "process_ms": wall, "sdks_loaded": loaded}
+
+
+def measure_app(reruns, novel_chars=0):
+    """在当前进程中执行 app.py，返回冷启动（不含 streamlit 自身导入）和每次重跑耗时（毫秒）"""
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    cold = (time.perf_counter() - started) * 1000
+
+    if novel_chars:
+        at.text_area[0].set_value("小说内容。" * (novel_chars // 5))
+        at.run()
+
+    timings = []
+    for i in range(reruns):
+        # 模拟只操作侧边栏的用户：每次重跑切换一次集数
+        at.sidebar.slider[0].set_value(20 + i % 10)
+        started = time.perf_counter()
+        at.run()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    sdks = [m for m in SDK_MODULES if m in sys.modules]
+    return {"cold_start_ms": cold, "rerun_ms": timings, "sdks_loaded": sdks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动与重跑耗时基准测试")
+    parser.add_argument("--reruns", type=int, default=20, help="重跑次数")
+    parser.add_argument("--novel-chars", type=int, default=0, help="重跑前在输入框中填入的小说字数")
+    parser.add_argument("--output", default=None, help="结果写入的 JSON 文件")
+    parser.add_argument("--app-only", action="store_true", help="只测 app.py（由主进程在子进程中调用）")
+    args = parser.parse_args()
+
+    if args.app_only:
+        print(json.dumps(measure_app(args.reruns, args.novel_chars)))
+        return
+
+    results = {"imports": {}}
+    print(f"{'模块':<12} {'导入耗时':>10} {'进程耗时':>10}  已加载 SDK")
+    for module in MODULES:
+        r = measure_import(module)
+        results["imports"][module] = r
+        print(f"{module:<12} {r['import_ms']:>8.1f}ms {r['process_ms']:>8.1f}ms  {','.join(r['sdks_loaded']) or '-'}")
+
+    # 冷启动必须在新进程中测量，否则模块已被导入
+    cache_path = os.path.join(ROOT, ".cache", "bench_startup.sqlite3")
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--app-only",
+         "--reruns", str(args.reruns), "--novel-chars", str(args.novel_chars)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env=dict(os.environ, SCREENPLAY_CACHE_PATH=cache_path)
+    )
+    app = json.loads(proc.stdout.strip().splitlines()[-1])
+    reruns = app["rerun_ms"]
+    results["app"] = {
+        "cold_start_ms": app["cold_start_ms"],
+        "rerun_p50_ms": _percentile(reruns, 50),
+        "rerun_p95_ms": _percentile(reruns, 95),
+        "rerun_max_ms": max(reruns) if reruns else 0.0,
+        "sdks_loaded": app["sdks_loaded"],
+    }
+
+    a = results["app"]
+    print(f"\napp.py 冷启动: {a['cold_start_ms']:.1f}ms")
+    print(f"app.py 重跑 ({len(reruns)} 次): p50 {a['rerun_p50_ms']:.1f}ms  "
+          f"p95 {a['rerun_p95_ms']:.1f}ms  max {a['rerun_max_ms']:.1f}ms")
+    print(f"重跑后已加载 SDK: {','.join(a['sdks_loaded']) or '-'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+本地 LLM 桩服务器（仅用于基准测试与联调）
+
+在本地端口上模拟 OpenAI 兼容的 /chat/completions 和 Anthropic 的 /v1/messages
+接口，支持流式（SSE）输出，并统计建立的 TCP 连接数与请求数。
+按请求的 max_tokens 截断过长的回复（以字符数模拟 token 数）。
+可注入响应延迟、按比例随机出现的慢请求（模拟长尾延迟）和错误（按比例随机出错，
+或让接下来的若干次请求出错），用于验证 providers 的超时、重试、限流和 routing 的对冲、故障转移。
+prefix_cache=True 时模拟提供商的前缀缓存并在用量中返回命中的输入 token：
+OpenAI 接口按与此前请求的最长公共前缀计算，Anthropic 接口按 cache_control 标记的前缀计算。
+
+用法:
+    with StubLLMServer() as server:
+        client = OpenAI(api_key="stub", base_url=server.url + "/v1")
+"""
+
+import json
+import os
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_REPLY = "**第1集：初遇**\n**核心剧情：** 桩服务器返回的示例剧本。\n"
+
+# 模拟 OpenAI 的前缀缓存：公共前缀至少 1024 个 token 才缓存，按 128 个 token 为单位命中
+PREFIX_CACHE_MIN = 1024
+PREFIX_CACHE_BLOCK = 128
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        stub._count_request()
+
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.slow_rate and random.random() < stub.slow_rate:
+            time.sleep(stub.slow_latency)
+
+        error = stub._next_error()
+        if error:
+            status, retry_after = error
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+            self._send_json(status, {"error": {"message": f"injected {status}", "type": "stub_error"}}, headers)
+            return
+
+        reply = stub.reply(body) if callable(stub.reply) else stub.reply
+        # 以字符数模拟 token 数，超过请求的 max_tokens 时截断
+        truncated = bool(body.get("max_tokens")) and len(reply) > body["max_tokens"]
+        if truncated:
+            reply = reply[:body["max_tokens"]]
+        if self.path.endswith("/messages"):
+            cache = stub._anthropic_cache(body)
+            if body.get("stream"):
+                self._send_sse(_anthropic_events(reply, body, truncated, cache))
+            else:
+                self._send_json(200, _anthropic_message(reply, body, truncated, cache))
+        elif self.path.endswith("/chat/completions"):
+            cached = stub._openai_cache(body)
+            if body.get("stream"):
+                self._send_sse(_openai_events(reply, body, truncated, cached))
+            else:
+                self._send_json(200, _openai_completion(reply, body, truncated, cached))
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_sse(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event, payload in events:
+            chunk = ""
+            if event:
+                chunk += f"event: {event}\n"
+            data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+            chunk += f"data: {data}\n\n"
+            self._write_chunk(chunk.encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _split_reply(reply, size=16):
+    return [reply[i:i + size] for i in range(0, len(reply), size)] or [""]
+
+
+def _openai_completion(reply, body, truncated=False, cached=0):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": reply},
+            "finish_reason": "length" if truncated else "stop",
+        }],
+        "usage": _openai_usage(reply, body, cached),
+    }
+
+
+def _content_text(content):
+    """消息内容的文本（字符串，或 Anthropic 的内容块列表）"""
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content or ""
+
+
+def _prompt_text(body):
+    return _content_text(body.get("system")) + "".join(
+        _content_text(message.get("content")) for message in body.get("messages", [])
+    )
+
+
+def _prompt_chars(body):
+    """请求中各消息的字数，作为桩服务器的输入 token 数"""
+    return len(_prompt_text(body))
+
+
+def _openai_usage(reply, body, cached=0):
+    prompt_tokens = _prompt_chars(body)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(reply),
+        "total_tokens": prompt_tokens + len(reply),
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+def _openai_events(reply, body, truncated=False, cached=0):
+    base = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+    }
+    for piece in _split_reply(reply):
+        yield None, dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+    finish_reason = "length" if truncated else "stop"
+    yield None, dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield None, dict(base, choices=[], usage=_openai_usage(reply, body, cached))
+    yield None, "[DONE]"
+
+
+def _anthropic_message(reply, body, truncated=False, cache=(0, 0)):
+    cache_read, cache_write = cache
+    return {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "stub"),
+        "content": [{"type": "text", "text": reply}],
+        "stop_reason": "max_tokens" if truncated else "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": _prompt_chars(body) - cache_read - cache_write,
+            "output_tokens": len(reply),
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_write,
+        },
+    }
+
+
+def _anthropic_events(reply, body, truncated=False, cache=(0, 0)):
+    message = _anthropic_message("", body, cache=cache)
+    message["content"] = []
+    yield "message_start", {"type": "message_start", "message": message}
+    yield "content_block_start", {
+        "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+    }
+    for piece in _split_reply(reply):
+        yield "content_block_delta", {
+            "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}
+        }
+    yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": "max_tokens" if truncated else "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": len(reply)},
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class _CountingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        self.stub._count_connection()
+        super().process_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # 客户端超时断开后继续写响应会触发 BrokenPipe，属于预期情况
+        pass
+
+
+class StubLLMServer:
+    """在后台线程运行的本地 LLM 桩服务器"""
+
+    def __init__(self, host="127.0.0.1", port=0, reply=DEFAULT_REPLY, latency=0.0,
+                 error_rate=0.0, error_status=503, retry_after=None,
+                 certfile=None, keyfile=None, prefix_cache=False, slow_rate=0.0, slow_latency=0.0):
+        """
+        Args:
+            host / port: 监听地址，port=0 时自动分配
+            reply: 每次请求返回的文本，或 reply(request_body) -> 文本；
+                文本长度（按字符计）超过请求的 max_tokens 时截断并返回 length / max_tokens
+            latency: 每次请求的固定响应延迟（秒）
+            error_rate: 随机返回错误的概率
+            error_status / retry_after: 随机错误的状态码和 Retry-After 头（秒）
+            certfile / keyfile: 提供时启用 HTTPS
+            prefix_cache: 模拟前缀缓存（以字符数模拟 token 数）
+            slow_rate / slow_latency: 随机慢请求的概率和额外延迟（秒）
+        """
+        self.reply = reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._scripted_errors = []
+        self.prefix_cache = prefix_cache
+        self._prompts = []
+        self._cached_prefixes = set()
+        self.errors = 0
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        self._server = _CountingHTTPServer((host, port), _StubHandler)
+        self._server.stub = self
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            self.scheme = "https"
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"{self.scheme}://{'localhost' if self.scheme == 'https' else host}:{port}"
+
+    def _count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def fail_next(self, count, status=503, retry_after=None):
+        """让接下来的 count 次请求返回 status 错误"""
+        with self._lock:
+            self._scripted_errors.extend([(status, retry_after)] * count)
+
+    def _next_error(self):
+        with self._lock:
+            if self._scripted_errors:
+                self.errors += 1
+                return self._scripted_errors.pop(0)
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors += 1
+                return self.error_status, self.retry_after
+            return None
+
+    def _openai_cache(self, body):
+        """与此前请求的最长公共前缀，按 PREFIX_CACHE_BLOCK 取整"""
+        if not self.prefix_cache:
+            return 0
+        text = _prompt_text(body)
+        with self._lock:
+            longest = max((len(os.path.commonprefix([text, seen])) for seen in self._prompts), default=0)
+            self._prompts.append(text)
+        if longest < PREFIX_CACHE_MIN:
+            return 0
+        return longest // PREFIX_CACHE_BLOCK * PREFIX_CACHE_BLOCK
+
+    def _anthropic_cache(self, body):
+        """(缓存读取, 缓存写入)：截至最后一个 cache_control 标记的内容此前出现过则读取，否则写入"""
+        if not self.prefix_cache:
+            return 0, 0
+        prefix = _content_text(body.get("system"))
+        marked = ""
+        for message in body.get("messages", []):
+            content = message.get("content")
+            for block in content if isinstance(content, list) else [{"text": content or ""}]:
+                prefix += block.get("text", "")
+                if block.get("cache_control"):
+                    marked = prefix
+        if not marked:
+            return 0, 0
+        with self._lock:
+            if marked in self._cached_prefixes:
+                return len(marked), 0
+            self._cached_prefixes.add(marked)
+        return 0, len(marked)
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
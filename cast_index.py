@@ -0,0 +1,200 @@
+"""
+人物相关性索引
+
+分步生成时每批只需要本批出场的人物。CastIndex 按故事概要的分集大纲建立
+人物 → 集数 的索引，为每批挑选：
+- 本批及前后 CONTEXT_WINDOW 集的分集大纲、上一批交接状态中提到的人物
+- 主角（人物表前 MAIN_CHARACTER_COUNT 位，见 report.main_characters_of）
+配角记忆点（口头禅、标志性动作）按人物拆开，只保留选中人物的条目；
+优化时按剧本内容中实际出场的人物挑选。
+
+分集大纲完全没有提到人物表中的名字时索引没有依据，不做裁剪。
+每次调用记录裁剪去掉的输入 token（没有去掉人物时为 0），report() 汇总为本次运行的节省量；
+人物设定由缩进 JSON 改为紧凑文本节省的 token 另计为 format_tokens_saved。
+"""
+
+import json
+import re
+import threading
+
+from prompts import format_characters
+from report import main_characters_of
+from tokens import estimate_tokens
+
+
+# 本批前后各取几集的分集大纲判断相关人物
+CONTEXT_WINDOW = 1
+
+# 三字及以上的人物名也按最后两个字（名）匹配
+GIVEN_NAME_MIN_LENGTH = 3
+
+# 配角记忆点的分隔符和每条开头的人物名（「角色A-口头禅+动作，角色B-口头禅+动作」）
+MARK_SEPARATOR = re.compile(r"[，,；;\n]+")
+MARK_OWNER_PATTERN = re.compile(r"^(?:\d+[.、)]\s*|[-*•]\s*)?([^\s\-－—:：（(，,]{1,8})\s*[-－—:：（(]")
+
+# 裁剪记录的阶段
+STAGE_GENERATE = "generate"
+STAGE_OPTIMIZE = "optimize"
+
+
+def name_variants(name):
+    """匹配人物时使用的名字（全名，三字以上时另加名）"""
+    variants = [name]
+    if len(name) >= GIVEN_NAME_MIN_LENGTH:
+        variants.append(name[-2:])
+    return variants
+
+
+def split_character_marks(text):
+    """
+    把配角记忆点拆成 [(人物名, 条目)]
+
+    每条以「人物名-」开头；没有人物名的片段归入上一条，开头就无法归属时人物名为 None。
+    """
+    entries = []
+    for segment in MARK_SEPARATOR.split(text or ""):
+        segment = segment.strip()
+        if not segment:
+            continue
+        match = MARK_OWNER_PATTERN.match(segment)
+        if match:
+            entries.append((match.group(1), segment))
+        elif entries:
+            entries[-1] = (entries[-1][0], f"{entries[-1][1]}，{segment}")
+        else:
+            entries.append((None, segment))
+    return entries
+
+
+class CastIndex:
+    """按分集大纲为各批挑选相关人物和配角记忆点（线程安全地记录节省的 token）"""
+
+    def __init__(self, summary_data, provider=None, window=CONTEXT_WINDOW):
+        """
+        Args:
+            summary_data: extract_story_summary 的结果
+            provider: 估算 token 时使用的提供商
+            window: 本批前后各取几集的分集大纲
+        """
+        self.characters = [char for char in summary_data.get("characters", []) if char.get("name")]
+        self.marks = split_character_marks(summary_data.get("optimization_points", {}).get("character_marks", ""))
+        self.main_characters = set(main_characters_of(summary_data))
+        self.episode_plan = summary_data.get("episode_plan", [])
+        self.provider = provider
+        self.window = window
+        # 人物 → 分集大纲中提到该人物的集数
+        self.episodes = {
+            char["name"]: {
+                number for number, event in enumerate(self.episode_plan, 1)
+                if self._mentions(event, char["name"])
+            }
+            for char in self.characters
+        }
+        self.enabled = any(self.episodes.values())
+        self.savings = []
+        self._lock = threading.Lock()
+        self._json_characters = estimate_tokens(
+            json.dumps(self.characters, ensure_ascii=False, indent=2), provider
+        )
+        self._full_characters = estimate_tokens(format_characters(self.characters), provider)
+        self._full_marks = estimate_tokens(self.format_marks(None), provider)
+
+    @staticmethod
+    def _mentions(text, name):
+        return any(variant in text for variant in name_variants(name))
+
+    def _names_in(self, text):
+        """text 中提到的人物（人物表和配角记忆点中的人物）"""
+        names = {char["name"] for char in self.characters}
+        names.update(owner for owner, _ in self.marks if owner)
+        return {name for name in names if self._mentions(text, name)}
+
+    def format_marks(self, names):
+        """names 中人物的配角记忆点（names 为 None 时全部保留，无法归属的条目总是保留）"""
+        return "，".join(
+            entry for owner, entry in self.marks
+            if names is None or owner is None or owner in names
+        )
+
+    def batch_names(self, start_ep, end_ep, handoff=None):
+        """第 start_ep-end_ep 集的相关人物（索引没有依据时为 None，表示不裁剪）"""
+        if not self.enabled:
+            return None
+        first = max(1, start_ep - self.window)
+        last = min(len(self.episode_plan), end_ep + self.window)
+        names = {
+            name for name, numbers in self.episodes.items()
+            if any(first <= number <= last for number in numbers)
+        }
+        text = "\n".join(self.episode_plan[first - 1:last])
+        if handoff:
+            text += json.dumps(handoff, ensure_ascii=False)
+        return names | self._names_in(text) | self.main_characters
+
+    def batch_context(self, start_ep, end_ep, handoff=None):
+        """
+        生成第 start_ep-end_ep 集时的人物设定和配角记忆点
+
+        Returns:
+            (人物设定文本, 配角记忆点文本)
+        """
+        names = self.batch_names(start_ep, end_ep, handoff)
+        characters = [char for char in self.characters if names is None or char["name"] in names]
+        characters_text = format_characters(characters)
+        marks_text = self.format_marks(names)
+        tokens_saved = 0
+        if names is not None:
+            tokens_saved = (self._full_characters + self._full_marks
+                            - estimate_tokens(characters_text, self.provider)
+                            - estimate_tokens(marks_text, self.provider))
+        # 以前每批发送缩进 JSON 的人物设定
+        self._record(STAGE_GENERATE, f"{start_ep}-{end_ep}", len(characters), tokens_saved,
+                     self._json_characters - self._full_characters)
+        return characters_text, marks_text
+
+    def optimize_marks(self, batch_content):
+        """优化 batch_content 时的配角记忆点：只保留剧本中出场的人物"""
+        if not self.marks:
+            return ""
+        names = self._names_in(batch_content) | self.main_characters
+        marks_text = self.format_marks(names)
+        self._record(STAGE_OPTIMIZE, None, len(names),
+                     self._full_marks - estimate_tokens(marks_text, self.provider))
+        return marks_text
+
+    def _record(self, stage, episodes, characters, tokens_saved, format_saved=0):
+        with self._lock:
+            self.savings.append({
+                "stage": stage, "episodes": episodes, "characters": characters,
+                "tokens_saved": tokens_saved, "format_saved": format_saved,
+            })
+
+    def report(self):
+        """
+        本次运行裁剪上下文的汇总
+
+        Returns:
+            {"characters": 人物表人数, "pruned": 是否按分集大纲裁剪, "calls": 裁剪的调用次数,
+             "tokens_saved": 裁剪人物估算节省的输入 token（相对发送全部人物设定和配角记忆点，
+                 不裁剪时为 0）,
+             "format_tokens_saved": 人物设定改为紧凑文本（相对缩进 JSON）估算节省的输入 token,
+             "stages": {阶段: 裁剪节省的 token},
+             "batches": [{"episodes": "1-5", "characters": 生成时发送的人数}]（含续写的调用）}
+        """
+        with self._lock:
+            savings = list(self.savings)
+        stages = {}
+        for item in savings:
+            stages[item["stage"]] = stages.get(item["stage"], 0) + item["tokens_saved"]
+        return {
+            "characters": len(self.characters),
+            "pruned": self.enabled,
+            "calls": len(savings),
+            "tokens_saved": sum(stages.values()),
+            "format_tokens_saved": sum(item["format_saved"] for item in savings),
+            "stages": stages,
+            "batches": [
+                {"episodes": item["episodes"], "characters": item["characters"]}
+                for item in savings if item["stage"] == STAGE_GENERATE
+            ],
+        }
@@ -0,0 +1,129 @@
+"""
+分步生成断点存储
+
+分步生成的每个阶段（故事概要、各批生成、各批优化）完成后立即写入本地
+检查点目录，按运行 ID 区分。生成中途失败后重新运行，已完成的阶段直接
+读取检查点，只需重做失败的批次。
+
+目录结构:
+    <root>/<run_id>/meta.json
+    <root>/<run_id>/summary.json
+    <root>/<run_id>/batch_000_draft.json
+    <root>/<run_id>/batch_000_optimized.json
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+DEFAULT_CHECKPOINT_DIR = ".checkpoints"
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+# 批次阶段
+STAGE_DRAFT = "draft"
+STAGE_OPTIMIZED = "optimized"
+
+
+def make_run_id(*parts):
+    """由生成参数计算运行 ID，参数相同的运行共用同一组检查点"""
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def batch_stage(batch_idx, kind):
+    """批次阶段名，kind 为 STAGE_DRAFT 或 STAGE_OPTIMIZED"""
+    return f"batch_{batch_idx:03d}_{kind}"
+
+
+class CheckpointStore:
+    """基于本地目录的检查点存储（每个阶段一个 JSON 文件，原子写入）"""
+
+    def __init__(self, root=DEFAULT_CHECKPOINT_DIR, max_age=DEFAULT_MAX_AGE):
+        """
+        Args:
+            root: 检查点根目录
+            max_age: 检查点保留时间（秒），超过后在 prune() 时删除
+        """
+        self.root = root
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, run_id, stage):
+        return os.path.join(self.root, run_id, f"{stage}.json")
+
+    def load(self, run_id, stage, default=None):
+        """读取阶段结果，不存在或文件损坏时返回 default"""
+        try:
+            with open(self._path(run_id, stage), encoding="utf-8") as f:
+                return json.load(f)["value"]
+        except (OSError, ValueError, KeyError):
+            return default
+
+    def save(self, run_id, stage, value):
+        """写入阶段结果（先写临时文件再替换，中途崩溃不会留下半个文件）"""
+        directory = os.path.join(self.root, run_id)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"value": value, "saved_at": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(run_id, stage))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def has(self, run_id, stage):
+        return os.path.exists(self._path(run_id, stage))
+
+    def stage(self, run_id, stage, compute, on_hit=None):
+        """
+        读取阶段结果，不存在时调用 compute() 计算并保存
+
+        Args:
+            on_hit: 命中检查点时以读取到的结果回调 on_hit(value)
+        """
+        value = self.load(run_id, stage)
+        if value is not None:
+            if on_hit:
+                on_hit(value)
+            return value
+        value = compute()
+        self.save(run_id, stage, value)
+        return value
+
+    def status(self, run_id):
+        """
+        返回运行进度，没有检查点时返回 None
+
+        Returns:
+            {"summary": bool, "drafts": int, "optimized": int,
+             "total_batches": int, "complete": bool}
+        """
+        meta = self.load(run_id, "meta")
+        if meta is None:
+            return None
+        total = meta.get("total_batches", 0)
+        return {
+            "summary": self.has(run_id, "summary"),
+            "drafts": sum(self.has(run_id, batch_stage(i, STAGE_DRAFT)) for i in range(total)),
+            "optimized": sum(self.has(run_id, batch_stage(i, STAGE_OPTIMIZED)) for i in range(total)),
+            "total_batches": total,
+            "complete": meta.get("complete", False),
+        }
+
+    def discard(self, run_id):
+        """删除运行的全部检查点"""
+        shutil.rmtree(os.path.join(self.root, run_id), ignore_errors=True)
+
+    def prune(self):
+        """删除超过保留时间的检查点"""
+        cutoff = time.time() - self.max_age
+        for run_id in os.listdir(self.root):
+            directory = os.path.join(self.root, run_id)
+            if os.path.isdir(directory) and os.path.getmtime(directory) < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,348 @@
+"""
+命令行批处理入口
+
+不经过 Streamlit 页面，批量把小说转换为剧本，适合 cron / 任务队列中的夜间批量转换。
+
+输入可以是:
+- 目录：目录下每个 .txt / .md 文件是一部小说，文件名（不含扩展名）作为任务 ID 和剧本标题
+- JSONL 文件：每行一个任务，字段 id / novel（或 path）/ title / genre / episodes，
+  未给出的字段使用命令行参数的默认值；id 用作输出文件名，路径分隔符等特殊字符替换为下划线
+
+每个任务输出:
+    <output_dir>/<id>.md            剧本
+    <output_dir>/<id>.metrics.json  耗时、字数、token 用量和估算费用等指标（失败时记录错误信息）
+    <output_dir>/<id>.trace.jsonl   各阶段和每次模型调用的追踪数据（--trace jsonl，
+                                    --trace otlp 时为 <id>.trace.otlp.json）
+
+剧本已存在的任务直接跳过（--force 强制重新生成）。分步生成的检查点与页面共用，
+中途失败的任务再次运行时从失败的批次继续。
+指定 --fallback-provider 时，主提供商慢或失败的调用对冲、转移到备用提供商（见 routing.py）。
+--provider fake 使用本地模拟提供商（见 fake_provider.py），不联网、不需要 API Key。
+
+运行方式:
+    python cli.py novels/ --output-dir scripts/ --provider deepseek --workers 4
+    python cli.py jobs.jsonl --output-dir scripts/ --mode single
+    python cli.py novels/ --provider deepseek --fallback-provider gemini_flash --fallback-api-key ...
+    python cli.py novels/ --provider fake --no-cache
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from checkpoint import DEFAULT_CHECKPOINT_DIR, CheckpointStore, make_run_id
+from clients import SDK_FAKE, ClientRegistry
+from pipeline import DEFAULT_OPTIMIZE_MODE, OPTIMIZE_MODE_LABELS, call_ai_model, plan_batches, run_batch_pipeline
+from providers import PROVIDERS, configure_provider, set_client_registry, set_response_cache, use_router
+from routing import make_router
+from script_index import parse_script
+from telemetry import Tracer, use_tracer
+
+
+NOVEL_EXTENSIONS = (".txt", ".md")
+
+# 任务 ID 用作输出文件名，其中的路径分隔符和其他特殊字符替换为下划线
+UNSAFE_ID_CHARS = re.compile(r"[^\w.\-]+")
+
+# 任务状态
+JOB_DONE = "done"
+JOB_SKIPPED = "skipped"
+JOB_FAILED = "failed"
+
+# 追踪数据导出格式
+TRACE_JSONL = "jsonl"
+TRACE_OTLP = "otlp"
+
+_print_lock = threading.Lock()
+
+
+def log(message):
+    """输出一行进度日志（多个任务并发时按行输出，不会交错）"""
+    with _print_lock:
+        print(message, file=sys.stderr, flush=True)
+
+
+# ==================== 任务读取 ====================
+
+def load_jobs(source, defaults):
+    """
+    读取任务列表
+
+    Args:
+        source: 小说目录或 JSONL 文件路径
+        defaults: 未给出字段的默认值 {"genre": ..., "episodes": ...}
+
+    Returns:
+        [{"id", "title", "genre", "episodes", "novel" 或 "path"}]，
+        小说文件只记录路径，执行任务时才由 read_novel 读取
+    """
+    if os.path.isdir(source):
+        jobs = []
+        for name in sorted(os.listdir(source)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in NOVEL_EXTENSIONS:
+                continue
+            jobs.append(dict(defaults, id=stem, title=stem, path=os.path.join(source, name)))
+        return jobs
+
+    jobs = []
+    seen = set()
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            raw_id = str(record.get("id") or f"job_{line_no:04d}")
+            try:
+                job_id = safe_job_id(raw_id)
+            except ValueError as e:
+                raise ValueError(f"{source} 第 {line_no} 行：{e}") from None
+            if job_id in seen:
+                raise ValueError(f"{source} 第 {line_no} 行：任务 ID {raw_id!r} 与前面的任务重复（输出文件名 {job_id}）")
+            seen.add(job_id)
+            job = {
+                "id": job_id,
+                "title": record.get("title") or raw_id,
+                "genre": record.get("genre") or defaults["genre"],
+                "episodes": int(record.get("episodes") or defaults["episodes"]),
+            }
+            if "novel" in record:
+                job["novel"] = record["novel"]
+            else:
+                job["path"] = os.path.join(base_dir, record["path"])
+            jobs.append(job)
+    return jobs
+
+
+def safe_job_id(value):
+    """把任务 ID 变成输出目录内的文件名（不含路径分隔符，不以 . 开头），无法转换时抛出 ValueError"""
+    job_id = UNSAFE_ID_CHARS.sub("_", str(value)).lstrip(".")
+    if not job_id.strip("_"):
+        raise ValueError(f"任务 ID 无法用作文件名：{value!r}")
+    return job_id
+
+
+def read_novel(job):
+    """任务的小说正文（JSONL 中直接给出的，或从文件读取）"""
+    if "novel" in job:
+        return job["novel"]
+    with open(job["path"], encoding="utf-8") as f:
+        return f.read()
+
+
+def write_atomic(path, content):
+    """先写临时文件再替换，中途中断不会留下半个输出文件"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ==================== 任务执行 ====================
+
+def write_telemetry(job, args, tracer, metrics):
+    """把调用用量汇总写入指标，按 --trace 导出追踪数据"""
+    summary = tracer.summary()
+    total = summary["total"]
+    metrics["usage"] = dict(total, cost=round(total["cost"], 6), cache_savings=round(total["cache_savings"], 6))
+    metrics["stages"] = [
+        dict(stage, duration=round(stage["duration"], 3), cost=round(stage["cost"], 6),
+             cache_savings=round(stage["cache_savings"], 6))
+        for stage in summary["stages"]
+    ]
+    if args.trace == TRACE_JSONL:
+        write_atomic(os.path.join(args.output_dir, f"{job['id']}.trace.jsonl"), tracer.to_jsonl())
+    elif args.trace == TRACE_OTLP:
+        write_atomic(os.path.join(args.output_dir, f"{job['id']}.trace.otlp.json"), tracer.to_otlp())
+
+
+def run_job(job, args, checkpoints):
+    """执行单个任务，写出剧本和指标文件，返回任务状态"""
+    script_path = os.path.join(args.output_dir, f"{job['id']}.md")
+    metrics_path = os.path.join(args.output_dir, f"{job['id']}.metrics.json")
+
+    if os.path.exists(script_path) and not args.force:
+        log(f"[{job['id']}] 已存在，跳过")
+        return JOB_SKIPPED
+
+    try:
+        novel = read_novel(job)
+    except (OSError, UnicodeDecodeError) as e:
+        write_atomic(metrics_path, json.dumps(
+            {"id": job["id"], "title": job["title"], "status": JOB_FAILED, "error": f"{type(e).__name__}: {e}"},
+            ensure_ascii=False, indent=2))
+        log(f"[{job['id']}] 失败：无法读取小说：{e}")
+        return JOB_FAILED
+
+    metrics = {
+        "id": job["id"],
+        "title": job["title"],
+        "genre": job["genre"],
+        "episodes": job["episodes"],
+        "mode": args.mode,
+        "provider": args.provider,
+        "fallback_provider": args.fallback_provider,
+        "novel_chars": len(novel),
+    }
+    tracer = Tracer(job["id"])
+    started = time.perf_counter()
+    log(f"[{job['id']}] 开始（{len(novel)} 字，{job['episodes']} 集）")
+
+    router = make_router(args.provider, args.api_key, args.fallback_provider, args.fallback_api_key,
+                         hedge=not args.no_hedge, hedge_delay=args.hedge_delay)
+    try:
+        with use_tracer(tracer), use_router(router):
+            if args.mode == "single":
+                script_content = call_ai_model(
+                    novel=novel,
+                    title=job["title"],
+                    genre=job["genre"],
+                    episodes=job["episodes"],
+                    opt_level=args.opt_level,
+                    api_key=args.api_key,
+                    provider=args.provider
+                )
+            else:
+                plan = plan_batches(job["episodes"], args.provider, args.batch_size)
+                run_id = make_run_id(novel, job["title"], job["genre"], job["episodes"],
+                                     args.provider, plan, args.optimize_mode, not args.no_continuity)
+                if args.force:
+                    checkpoints.discard(run_id)
+                result = run_batch_pipeline(
+                    novel=novel,
+                    title=job["title"],
+                    genre=job["genre"],
+                    episodes=job["episodes"],
+                    api_key=args.api_key,
+                    provider=args.provider,
+                    max_in_flight=args.max_in_flight,
+                    checkpoints=checkpoints,
+                    run_id=run_id,
+                    plan=plan,
+                    optimize_mode=args.optimize_mode,
+                    continuity=not args.no_continuity,
+                    on_status=lambda text, progress: log(f"[{job['id']}] {progress:3d}% {text}")
+                )
+                script_content = result["script"]
+                metrics["batches"] = len(result["batches"])
+                metrics["optimization"] = dict(
+                    result["report"]["total"],
+                    catchphrase=result["report"]["catchphrase"],
+                    episodes_optimized=sum(batch["episodes_optimized"] for batch in result["report"]["batches"])
+                )
+                metrics["context"] = {
+                    key: result["context"][key] for key in ("pruned", "tokens_saved", "format_tokens_saved", "stages")
+                }
+                metrics["timings"] = {name: round(seconds, 3) for name, seconds in result["timings"].items()}
+                checkpoints.discard(run_id)
+    except Exception as e:
+        metrics.update(status=JOB_FAILED, error=f"{type(e).__name__}: {e}",
+                       elapsed=round(time.perf_counter() - started, 3))
+        write_telemetry(job, args, tracer, metrics)
+        write_atomic(metrics_path, json.dumps(metrics, ensure_ascii=False, indent=2))
+        log(f"[{job['id']}] 失败：{e}")
+        return JOB_FAILED
+
+    metrics.update(status=JOB_DONE, script_chars=len(script_content),
+                   structure=parse_script(script_content).stats(),
+                   elapsed=round(time.perf_counter() - started, 3))
+    write_telemetry(job, args, tracer, metrics)
+    write_atomic(script_path, script_content)
+    write_atomic(metrics_path, json.dumps(metrics, ensure_ascii=False, indent=2))
+    log(f"[{job['id']}] 完成，用时 {metrics['elapsed']:.1f} 秒")
+    return JOB_DONE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量把小说转换为短剧剧本")
+    parser.add_argument("source", help="小说目录（.txt / .md）或 JSONL 任务文件")
+    parser.add_argument("--output-dir", default="scripts", help="剧本和指标输出目录")
+    parser.add_argument("--provider", default="deepseek", choices=sorted(PROVIDERS), help="API 提供商")
+    parser.add_argument("--api-key", default=os.environ.get("SCREENPLAY_API_KEY"),
+                        help="API Key，默认读取环境变量 SCREENPLAY_API_KEY")
+    parser.add_argument("--base-url", default=None, help="覆盖提供商的 API 地址（代理或私有部署）")
+    parser.add_argument("--fallback-provider", default=None, choices=sorted(PROVIDERS),
+                        help="备用 API 提供商：主提供商慢时发出对冲请求，失败时转移到备用提供商")
+    parser.add_argument("--fallback-api-key", default=os.environ.get("SCREENPLAY_FALLBACK_API_KEY"),
+                        help="备用提供商的 API Key，默认读取环境变量 SCREENPLAY_FALLBACK_API_KEY，"
+                             "未设置时使用 --api-key")
+    parser.add_argument("--fallback-base-url", default=None, help="覆盖备用提供商的 API 地址")
+    parser.add_argument("--no-hedge", action="store_true", help="只在主提供商失败时转移，不发出对冲请求")
+    parser.add_argument("--hedge-delay", type=float, default=None,
+                        help="对冲等待阈值（秒），默认按主提供商首字延迟的 P95 自动调整")
+    parser.add_argument("--mode", default="batch", choices=["batch", "single"], help="生成模式")
+    parser.add_argument("--opt-level", default="deep", choices=["deep", "standard", "basic"],
+                        help="单次生成的优化级别")
+    parser.add_argument("--genre", default="其他", help="默认题材类型")
+    parser.add_argument("--episodes", type=int, default=30, help="默认总集数")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="分步生成每批最多集数，默认按提供商输出上限自动规划")
+    parser.add_argument("--optimize-mode", default=DEFAULT_OPTIMIZE_MODE, choices=sorted(OPTIMIZE_MODE_LABELS),
+                        help="分步生成的优化范围：full 整批优化，episodes 只优化格式检查不合格的集，"
+                             "fragments 只优化不合格的场")
+    parser.add_argument("--no-continuity", action="store_true",
+                        help="分步生成时不规划跨批衔接（少一次调用，各批只依据故事概要生成）")
+    parser.add_argument("--trace", default=None, choices=[TRACE_JSONL, TRACE_OTLP],
+                        help="为每个任务导出追踪数据：jsonl 每行一个 span，otlp 为 OpenTelemetry OTLP/JSON")
+    parser.add_argument("--workers", type=int, default=2, help="同时处理的小说数")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="每个提供商最多同时进行的请求数，默认按提供商配置")
+    parser.add_argument("--force", action="store_true", help="重新生成已存在的剧本")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 响应缓存")
+    parser.add_argument("--cache-path", default=os.environ.get("SCREENPLAY_CACHE_PATH", DEFAULT_CACHE_PATH),
+                        help="LLM 响应缓存文件")
+    parser.add_argument("--checkpoint-dir",
+                        default=os.environ.get("SCREENPLAY_CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR),
+                        help="分步生成检查点目录")
+    args = parser.parse_args(argv)
+
+    if not args.api_key and PROVIDERS[args.provider]["sdk"] != SDK_FAKE:
+        parser.error("请通过 --api-key 或环境变量 SCREENPLAY_API_KEY 提供 API Key")
+
+    try:
+        jobs = load_jobs(args.source, {"genre": args.genre, "episodes": args.episodes})
+    except ValueError as e:
+        parser.error(str(e))
+    if not jobs:
+        log(f"{args.source} 中没有可处理的小说")
+        return 0
+
+    if args.base_url:
+        configure_provider(args.provider, base_url=args.base_url)
+    if args.fallback_base_url and args.fallback_provider:
+        configure_provider(args.fallback_provider, base_url=args.fallback_base_url)
+    set_client_registry(ClientRegistry(max_clients=32, idle_ttl=600))
+    cache = None if args.no_cache else ResponseCache(args.cache_path)
+    set_response_cache(cache)
+    checkpoints = CheckpointStore(args.checkpoint_dir)
+    checkpoints.prune()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        statuses = list(pool.map(lambda job: run_job(job, args, checkpoints), jobs))
+    if cache is not None:
+        cache.close()
+
+    counts = {state: statuses.count(state) for state in (JOB_DONE, JOB_SKIPPED, JOB_FAILED)}
+    log(f"共 {len(jobs)} 个任务：完成 {counts[JOB_DONE]}，跳过 {counts[JOB_SKIPPED]}，"
+        f"失败 {counts[JOB_FAILED]}，总用时 {time.perf_counter() - started:.1f} 秒")
+    return 1 if counts[JOB_FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+API 客户端注册表
+
+复用 anthropic.Anthropic / OpenAI 客户端及其 keep-alive 连接池，
+避免每次调用都新建 HTTP 连接池、重新进行 TLS 握手。
+
+客户端按 (SDK, api_key, base_url) 缓存，通过 with registry.client(...) 借用，淘汰策略：
+- 空闲超过 idle_ttl 秒且无人借用的客户端在下次取用时关闭并移除
+- 客户端数量超过 max_clients 时移除最久未使用的客户端
+被移除时仍有借用者的客户端等最后一个借用者归还后再关闭；新客户端在锁外创建。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# SDK 类型
+SDK_ANTHROPIC = "anthropic"
+SDK_OPENAI = "openai"
+SDK_FAKE = "fake"        # 本地模拟（fake_provider），不创建客户端
+
+
+# 重试、超时由 providers 统一处理，关闭 SDK 自带的重试
+def _create_anthropic_client(api_key, base_url):
+    import anthropic
+    if base_url:
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0)
+    return anthropic.Anthropic(api_key=api_key, max_retries=0)
+
+
+def _create_openai_client(api_key, base_url):
+    from openai import OpenAI
+    if base_url:
+        return OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    return OpenAI(api_key=api_key, max_retries=0)
+
+
+CLIENT_FACTORIES = {
+    SDK_ANTHROPIC: _create_anthropic_client,
+    SDK_OPENAI: _create_openai_client,
+}
+
+
+class _Entry:
+    """注册表中的一个客户端（由 ClientRegistry 的锁保护）"""
+
+    __slots__ = ("client", "last_used", "leases", "retired")
+
+    def __init__(self, client, now):
+        self.client = client
+        self.last_used = now
+        self.leases = 0          # 正在使用该客户端的调用数
+        self.retired = False     # 已被淘汰，最后一个使用者归还后关闭
+
+
+class ClientRegistry:
+    """线程安全的 API 客户端注册表（LRU + 空闲超时淘汰）"""
+
+    def __init__(self, max_clients=32, idle_ttl=600, factories=None):
+        """
+        Args:
+            max_clients: 最多保留的客户端数量
+            idle_ttl: 客户端最长空闲时间（秒）
+            factories: {SDK 类型: factory(api_key, base_url)}，默认 CLIENT_FACTORIES
+        """
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.factories = factories or CLIENT_FACTORIES
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def client(self, sdk, api_key, base_url=None):
+        """
+        在 with 块内借用 (sdk, api_key, base_url) 对应的客户端，不存在时创建
+
+        借用期间客户端即使被淘汰也不会关闭，最后一个借用者归还时才关闭
+        """
+        entry = self._lease(sdk, api_key, base_url)
+        try:
+            yield entry.client
+        finally:
+            self._return(entry)
+
+    def _lease(self, sdk, api_key, base_url):
+        key = (sdk, api_key, base_url)
+        closing = []
+        with self._lock:
+            entry = self._take(key, closing)
+        _close_clients(closing)
+        if entry is not None:
+            return entry
+
+        # 在锁外创建客户端，其他调用不必等待 SDK 初始化
+        client = self.factories[sdk](api_key, base_url)
+        closing = []
+        with self._lock:
+            entry = self._take(key, closing)
+            if entry is None:
+                self.misses += 1
+                entry = _Entry(client, time.monotonic())
+                entry.leases = 1
+                self._clients[key] = entry
+                self._evict(self._pop_lru(), closing)
+            else:
+                # 其他线程已先创建了同一个客户端
+                closing.append(client)
+        _close_clients(closing)
+        return entry
+
+    def _take(self, key, closing):
+        """借出已缓存的客户端，并淘汰空闲超时的客户端（调用方需持有锁）"""
+        now = time.monotonic()
+        self._evict(self._pop_idle(now), closing)
+        entry = self._clients.get(key)
+        if entry is None:
+            return None
+        self._clients.move_to_end(key)
+        entry.last_used = now
+        entry.leases += 1
+        self.hits += 1
+        return entry
+
+    def _return(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            close = entry.retired and entry.leases == 0
+        if close:
+            _close_client(entry.client)
+
+    def _pop_idle(self, now):
+        """移除空闲超时且没有借用者的客户端（调用方需持有锁）"""
+        expired = [
+            key for key, entry in self._clients.items()
+            if entry.leases == 0 and now - entry.last_used > self.idle_ttl
+        ]
+        return [self._clients.pop(key) for key in expired]
+
+    def _pop_lru(self):
+        """客户端数量超过 max_clients 时移除最久未使用的客户端（调用方需持有锁）"""
+        entries = []
+        while len(self._clients) > self.max_clients:
+            _, entry = self._clients.popitem(last=False)
+            entries.append(entry)
+        return entries
+
+    def _evict(self, entries, closing):
+        """标记被移除的客户端，没有借用者的放入 closing 待锁外关闭，其余留到归还时关闭（调用方需持有锁）"""
+        self.evictions += len(entries)
+        for entry in entries:
+            entry.retired = True
+            if entry.leases == 0:
+                closing.append(entry.client)
+
+    def clear(self):
+        """移除全部客户端，空闲的立即关闭，借用中的在归还时关闭"""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+            for entry in entries:
+                entry.retired = True
+            idle = [entry.client for entry in entries if entry.leases == 0]
+        _close_clients(idle)
+
+    def stats(self):
+        """返回注册表统计信息"""
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "leased": sum(entry.leases for entry in self._clients.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._clients)
+
+
+def _close_client(client):
+    """关闭客户端的连接池，忽略关闭过程中的错误"""
+    close = getattr(client, "close", None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _close_clients(clients):
+    for client in clients:
+        _close_client(client)
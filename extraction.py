@@ -0,0 +1,482 @@
+"""
+故事概要提取
+
+短篇小说一次调用直接提取；长篇小说走 map-reduce：
+1. 按章节、段落边界切分为不超过 CHUNK_CHARS 字的片段
+2. 并发提取每个片段的摘要、人物、事件（map），每段按篇幅分配集数
+3. 片段摘要过多时逐层合并相邻片段，最后一次调用合并为
+   story_summary / characters / episode_plan / optimization_points（reduce）
+
+模型输出的 JSON 由 jsonstream 容错解析（流式输出时边接收边扫描），按字段类型校验；
+分集大纲的集数不足时只请求补写缺少的各集，不重新提取整份概要。
+
+片段按需切出、滑动窗口提交，内存占用只与并发数和片段大小有关，
+与小说总长度无关。
+"""
+
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from jsonstream import JSONExtractor, extract_json
+from prompts import PROMPTS, genre_focus
+from providers import call_provider
+from scheduler import get_max_in_flight, run_semaphore
+from telemetry import bind
+
+
+# 单个片段的最大字数（不超过此长度的小说一次调用直接提取）
+CHUNK_CHARS = 10000
+
+# reduce 阶段单次调用输入的片段摘要最大字数，超过时先逐层合并
+REDUCE_CHARS = 30000
+
+# 每个片段最多保留的事件数（在分配集数之外）
+EXTRA_EVENTS_PER_CHUNK = 3
+
+CHAPTER_PATTERN = re.compile(
+    r"^[ \t　]*(?:第[0-9０-９零〇一二两三四五六七八九十百千万]+[章回节卷]|Chapter\s+\d+)",
+    re.M | re.I,
+)
+PARAGRAPH_PATTERN = re.compile(r"\n")
+
+
+# ==================== 切分 ====================
+
+def _chapter_bounds(novel):
+    """按章节标题切分，返回各章的 (start, end)"""
+    starts = [m.start() for m in CHAPTER_PATTERN.finditer(novel)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(novel)
+        if end > start:
+            yield start, end
+
+
+def _split_units(novel, max_chars):
+    """把小说切为不超过 max_chars 的最小单元：章节 → 段落 → 定长"""
+    for start, end in _chapter_bounds(novel):
+        if end - start <= max_chars:
+            yield start, end
+            continue
+        para_start = start
+        for m in PARAGRAPH_PATTERN.finditer(novel, start, end):
+            para_end = m.end()
+            while para_end - para_start > max_chars:
+                yield para_start, para_start + max_chars
+                para_start += max_chars
+            if para_end - para_start > 0:
+                yield para_start, para_end
+            para_start = para_end
+        while end - para_start > max_chars:
+            yield para_start, para_start + max_chars
+            para_start += max_chars
+        if end > para_start:
+            yield para_start, end
+
+
+def split_novel(novel, max_chars=CHUNK_CHARS):
+    """
+    按章节、段落边界把小说切分为不超过 max_chars 字的片段
+
+    相邻的短章节会合并到同一片段；超长章节在段落边界处切开，
+    没有换行的超长段落按定长切开。
+
+    Yields:
+        (start, end) 片段在原文中的位置
+    """
+    chunk_start = chunk_end = 0
+    for start, end in _split_units(novel, max_chars):
+        if end - chunk_start > max_chars and chunk_end > chunk_start:
+            yield chunk_start, chunk_end
+            chunk_start = start
+        chunk_end = end
+    if chunk_end > chunk_start:
+        yield chunk_start, chunk_end
+
+
+def allocate_episodes(weights, total_episodes):
+    """按权重（片段字数）用最大余数法分配集数，总和等于 total_episodes"""
+    total_weight = sum(weights) or 1
+    quotas = [w * total_episodes / total_weight for w in weights]
+    shares = [int(q) for q in quotas]
+    remainder = total_episodes - sum(shares)
+    order = sorted(range(len(weights)), key=lambda i: quotas[i] - shares[i], reverse=True)
+    for i in order[:remainder]:
+        shares[i] += 1
+    return shares
+
+
+# ==================== 解析 ====================
+
+def parse_json_response(result):
+    """
+    解析模型输出中的 JSON 对象，失败时抛出 json.JSONDecodeError
+
+    容错：跳过代码块标记和前后的说明文字，去掉尾随逗号，补全被截断的字符串、数组和对象。
+    """
+    return extract_json(result)
+
+
+def _text(value):
+    """标量转为去掉首尾空白的字符串，列表按行拼接，其他类型为空字符串"""
+    if isinstance(value, list):
+        return "\n".join(filter(None, (_text(item) for item in value)))
+    if value is None or isinstance(value, dict):
+        return ""
+    return str(value).strip()
+
+
+def _plan_item(item):
+    """分集大纲的一项：字符串，或 {"episode", "event"} 之类的对象"""
+    if isinstance(item, dict):
+        for field in ("event", "summary", "content", "title"):
+            if _text(item.get(field)):
+                return _text(item[field])
+        return "；".join(filter(None, (_text(value) for value in item.values())))
+    return _text(item)
+
+
+def validate_summary(parsed):
+    """
+    按概要的字段类型校验并规整解析结果
+
+    characters 只保留有姓名的对象，字段转为字符串；episode_plan 每项转为一句话
+    （丢弃空项）；optimization_points 的列表值按行拼接。
+    """
+    characters = []
+    for char in parsed.get("characters") or []:
+        if isinstance(char, dict) and _text(char.get("name")):
+            characters.append({
+                field: _text(char.get(field))
+                for field in ("name", "age", "identity", "personality", "background")
+            })
+    plan = parsed.get("episode_plan")
+    points = parsed.get("optimization_points")
+    return {
+        "story_summary": _text(parsed.get("story_summary")),
+        "characters": characters,
+        "episode_plan": [event for event in map(_plan_item, plan if isinstance(plan, list) else []) if event],
+        "optimization_points": {
+            key: _text(value) for key, value in points.items()
+        } if isinstance(points, dict) else {},
+    }
+
+
+def _summary_from(parsed, result):
+    """校验解析结果，不是 JSON 对象时退化为纯文本梗概"""
+    if not isinstance(parsed, dict):
+        return {
+            "story_summary": result.strip()[:500],
+            "characters": [],
+            "episode_plan": [],
+            "optimization_points": {}
+        }
+    return validate_summary(parsed)
+
+
+def _call_summary(prompt, api_key, provider, on_delta=None):
+    """发起概要调用并返回校验后的概要；流式输出时边接收边扫描 JSON"""
+    extractor = JSONExtractor()
+
+    def feed(text):
+        extractor.feed(text)
+        on_delta(text)
+
+    result = call_provider(prompt.system, prompt.user, api_key, provider,
+                           on_delta=feed if on_delta else None, prefix=prompt.prefix)
+    if not on_delta:
+        extractor.feed(result)
+    try:
+        parsed = extractor.value()
+    except json.JSONDecodeError:
+        parsed = None
+    return _summary_from(parsed, result)
+
+
+def request_missing_episodes(summary, total_episodes, api_key, provider, context=""):
+    """
+    分集大纲不足 total_episodes 集时，只请求补写缺少的各集
+
+    Args:
+        context: 补写时参考的材料（例如对应片段的摘要）
+
+    Returns:
+        补写的各集核心事件（可能仍少于缺少的集数）
+    """
+    plan = summary["episode_plan"]
+    start_ep = len(plan) + 1
+    count = total_episodes - len(plan)
+    prompt = PROMPTS["episode_plan"].render(
+        story_summary=summary["story_summary"],
+        characters=json.dumps([char["name"] for char in summary["characters"]], ensure_ascii=False),
+        plan_text="\n".join(f"- 第{i}集：{event}" for i, event in enumerate(plan, 1)) or "（无）",
+        context_text=f"\n=== 参考材料 ===\n{context}\n" if context else "",
+        start_ep=start_ep,
+        end_ep=total_episodes,
+        count=count,
+    )
+    result = call_provider(prompt.system, prompt.user, api_key, provider, prefix=prompt.prefix)
+    try:
+        parsed = parse_json_response(result)
+    except json.JSONDecodeError:
+        return []
+    items = parsed.get("episode_plan") if isinstance(parsed, dict) else None
+    return [event for event in map(_plan_item, items if isinstance(items, list) else []) if event][:count]
+
+
+def _fit_episode_plan(summary, total_episodes, api_key, provider, context=""):
+    """把分集大纲调整为 total_episodes 集：多余的截掉，不足的请求补写"""
+    plan = summary["episode_plan"][:total_episodes]
+    summary["episode_plan"] = plan
+    if len(plan) < total_episodes:
+        summary["episode_plan"] = plan + request_missing_episodes(
+            summary, total_episodes, api_key, provider, context
+        )
+    return summary
+
+
+def _as_list(value):
+    """模型偶尔把列表字段写成单个字符串：非空字符串视为一项，其他非列表值视为空"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.strip():
+        return [value]
+    return []
+
+
+def _parse_chunk(result, episodes):
+    """解析片段摘要 JSON，失败时以原文前 300 字作为摘要"""
+    try:
+        parsed = parse_json_response(result)
+        summary = {
+            "summary": str(parsed.get("summary", "")),
+            "characters": [c for c in _as_list(parsed.get("characters")) if isinstance(c, dict)],
+            "events": [str(e) for e in _as_list(parsed.get("events"))],
+        }
+    except (json.JSONDecodeError, AttributeError):
+        summary = {"summary": result.strip()[:300], "characters": [], "events": []}
+    summary["events"] = summary["events"][:episodes + EXTRA_EVENTS_PER_CHUNK]
+    summary["episodes"] = episodes
+    return summary
+
+
+# ==================== map ====================
+
+def summarize_chunk(chunk, index, total_chunks, episodes, genre, api_key, provider):
+    """提取单个片段的摘要、人物和关键事件（map）"""
+    if episodes:
+        events_note = f"本段约占全剧 {episodes} 集，请按时间顺序给出至少 {episodes} 条关键事件，每条可独立成为一集的核心事件"
+    else:
+        events_note = "本段篇幅较短，不单独成集，请给出 1-3 条关键事件"
+
+    prompt = PROMPTS["chunk"].render(
+        index=index + 1, total_chunks=total_chunks, events_note=events_note, genre=genre, chunk=chunk
+    )
+    result = call_provider(prompt.system, prompt.user, api_key, provider, prefix=prompt.prefix)
+    return _parse_chunk(result, episodes)
+
+
+def merge_chunk_group(parts, genre, api_key, provider):
+    """把若干相邻片段的摘要合并为一个片段摘要（逐层 reduce 的中间步骤）"""
+    episodes = sum(part["episodes"] for part in parts)
+    prompt = PROMPTS["merge"].render(min_events=max(episodes, 1), genre=genre, parts=_format_parts(parts))
+    result = call_provider(prompt.system, prompt.user, api_key, provider, prefix=prompt.prefix)
+    return _parse_chunk(result, episodes)
+
+
+def _map_bounded(fn, items, max_workers, semaphore, on_done=None):
+    """
+    并发执行 fn(item)，最多同时提交 max_workers 个任务，按输入顺序返回结果
+
+    items 可以是生成器：只在有空闲并发时才取下一项，片段原文不会一次性全部驻留内存。
+    """
+    results = {}
+    pending = {}
+
+    def run(item):
+        with semaphore:
+            return fn(item)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extract") as executor:
+        items = iter(items)
+        index = 0
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_workers:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(bind(run), item)] = index
+                index += 1
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                if on_done:
+                    on_done(len(results))
+
+    return [results[i] for i in range(len(results))]
+
+
+# ==================== reduce ====================
+
+def merge_characters(parts, limit=8):
+    """按姓名合并各片段的人物，保留信息最完整的字段，按出场片段数排序"""
+    merged = {}
+    counts = {}
+    for part in parts:
+        for char in part["characters"]:
+            name = str(char.get("name", "")).strip()
+            if not name:
+                continue
+            counts[name] = counts.get(name, 0) + 1
+            current = merged.setdefault(name, {"name": name})
+            for field in ("age", "identity", "personality", "background"):
+                value = str(char.get(field, "") or "")
+                if len(value) > len(current.get(field, "")):
+                    current[field] = value
+    ranked = sorted(merged, key=lambda name: counts[name], reverse=True)
+    return [merged[name] for name in ranked[:limit]]
+
+
+def _format_parts(parts, first_episode=1, first_part=0):
+    """把片段摘要格式化为 reduce 提示词中的文本，并标注每段对应的集数"""
+    lines = []
+    episode = first_episode
+    for i, part in enumerate(parts, first_part):
+        if part["episodes"]:
+            span = f"第{episode}-{episode + part['episodes'] - 1}集"
+            episode += part["episodes"]
+        else:
+            span = "并入相邻集"
+        lines.append(f"【片段{i + 1}｜{span}】{part['summary']}")
+        for event in part["events"]:
+            lines.append(f"- {event}")
+    return "\n".join(lines)
+
+
+def _pack_groups(parts, max_chars):
+    """把相邻片段摘要打包成不超过 max_chars 的分组（每组至少两段）"""
+    groups = []
+    current = []
+    size = 0
+    for part in parts:
+        part_size = len(_format_parts([part]))
+        if current and size + part_size > max_chars and len(current) >= 2:
+            groups.append(current)
+            current, size = [], 0
+        current.append(part)
+        size += part_size
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def _fallback_episode_plan(parts, total_episodes):
+    """reduce 结果的分集大纲集数不对时，用各片段分配的事件拼出分集大纲"""
+    plan = []
+    for part in parts:
+        events = part["events"] or [part["summary"]]
+        for i in range(part["episodes"]):
+            plan.append(events[min(i, len(events) - 1)])
+    return plan[:total_episodes]
+
+
+def reduce_summaries(parts, title, genre, total_episodes, api_key, provider, on_delta=None):
+    """把按顺序排列的片段摘要合并为最终概要（reduce）"""
+    characters = merge_characters(parts)
+
+    prompt = PROMPTS["reduce"].render(
+        total_episodes=total_episodes,
+        genre=genre,
+        genre_focus=genre_focus(genre),
+        characters=json.dumps(characters, ensure_ascii=False, separators=(",", ":")),
+        parts=_format_parts(parts),
+    )
+    summary = _call_summary(prompt, api_key, provider, on_delta)
+
+    if not summary["characters"]:
+        summary["characters"] = characters[:5]
+    if len(summary["episode_plan"]) < total_episodes:
+        context = _parts_from_episode(parts, len(summary["episode_plan"]) + 1)
+    else:
+        context = ""
+    summary = _fit_episode_plan(summary, total_episodes, api_key, provider, context)
+    # 补写后仍不足时，缺少的各集用对应片段的事件补齐
+    plan = summary["episode_plan"]
+    if len(plan) < total_episodes:
+        summary["episode_plan"] = plan + _fallback_episode_plan(parts, total_episodes)[len(plan):]
+    return summary
+
+
+def _parts_from_episode(parts, start_ep):
+    """从第 start_ep 集所在的片段开始的各片段摘要（补写分集大纲时的参考材料）"""
+    episode = 1
+    for i, part in enumerate(parts):
+        if episode + part["episodes"] > start_ep:
+            return _format_parts(parts[i:], episode, i)
+        episode += part["episodes"]
+    return ""
+
+
+# ==================== 入口 ====================
+
+def extract_story_summary(novel, title, genre, total_episodes, api_key, provider, on_delta=None,
+                          on_progress=None, max_in_flight=None):
+    """
+    从完整小说中提取：
+    1. 故事梗概、人物设定
+    2. 全局优化要点（格式规范、表演提示、特写镜头、配角记忆点）
+
+    Args:
+        on_delta: 最终一次调用的流式输出回调
+        on_progress: on_progress(done, total)，长篇小说每完成一个片段回调一次（在调用线程中）
+        max_in_flight: 片段并发提取数，默认取提供商的最大并发数
+    """
+    if len(novel) <= CHUNK_CHARS:
+        return _extract_single(novel, genre, total_episodes, api_key, provider, on_delta)
+
+    bounds = list(split_novel(novel))
+    shares = allocate_episodes([end - start for start, end in bounds], total_episodes)
+    max_workers = max_in_flight or get_max_in_flight(provider)
+    semaphore = run_semaphore(provider, max_in_flight)
+
+    def progress(done):
+        if on_progress:
+            on_progress(done, len(bounds))
+
+    chunks = (
+        (novel[start:end], i, episodes)
+        for i, ((start, end), episodes) in enumerate(zip(bounds, shares))
+    )
+    parts = _map_bounded(
+        lambda item: summarize_chunk(item[0], item[1], len(bounds), item[2], genre, api_key, provider),
+        chunks, max_workers, semaphore, on_done=progress
+    )
+
+    # 片段摘要过长时逐层合并相邻片段
+    while len(parts) > 1 and len(_format_parts(parts)) > REDUCE_CHARS:
+        groups = _pack_groups(parts, REDUCE_CHARS)
+        parts = _map_bounded(
+            lambda group: merge_chunk_group(group, genre, api_key, provider),
+            groups, max_workers, semaphore
+        )
+
+    return reduce_summaries(parts, title, genre, total_episodes, api_key, provider, on_delta=on_delta)
+
+
+def _extract_single(novel, genre, total_episodes, api_key, provider, on_delta=None):
+    """短篇小说：一次调用提取全部信息"""
+    prompt = PROMPTS["extract"].render(
+        total_episodes=total_episodes, genre=genre, genre_focus=genre_focus(genre), novel=novel
+    )
+    summary = _call_summary(prompt, api_key, provider, on_delta)
+    return _fit_episode_plan(summary, total_episodes, api_key, provider, context=novel)
@@ -0,0 +1,290 @@
+"""
+多用户公平调度：按 API Key 的并发与 token 配额
+
+共享部署中各用户用自己的 API Key 提交任务，模型调用直接发出时，一个 50 集任务的
+大量批次会占满提供商的并发，其他用户的短任务只能等它跑完。providers.set_call_scheduler
+配置了 FairScheduler 后，每次模型调用（含重试）先在调度器中排队：
+
+- 按（提供商，API Key）分道，每道有自己的最大并发数和每分钟 token 配额；
+  token 按估算的输入预扣，调用结束后按实际用量补扣，透支时该道后续的调用等待令牌补足
+- 同一道内按任务分队列，空出槽位时在有排队调用的任务之间平滑加权轮询，
+  3 集的短任务不会排在 50 集任务的全部批次之后
+- 调用所属的任务由 use_job(job_id, weight) 标记（随 telemetry.bind 传到工作线程），
+  未标记的调用归入同一个默认任务
+- metrics() 返回各道的排队深度、进行中的调用数、token 余额和排队等待时间分位数
+- 空闲超过 LANE_IDLE_TTL 秒（没有排队和进行中的调用）且 token 余额已补满的道被移除，
+  API Key 不断轮换时道的数量不会无限增长；再次调用时重新建立，指标也从零开始
+
+指标中的 API Key 只以哈希前缀出现。
+"""
+
+import contextvars
+import hashlib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# 每个 API Key 同时进行中的调用数（quotas 未指定该提供商时）
+DEFAULT_KEY_MAX_IN_FLIGHT = 4
+
+# 每个 API Key 每分钟的 token 配额，None 为不限
+DEFAULT_TOKENS_PER_MINUTE = None
+
+# 未用 use_job 标记的调用所属的任务
+DEFAULT_JOB = "default"
+DEFAULT_WEIGHT = 1
+
+# 每道保留最近多少次排队等待时间用于计算分位数
+WAIT_SAMPLES = 1000
+
+# 排队时最长多久检查一次取消事件（秒）
+POLL_INTERVAL = 0.5
+
+# 道空闲多久后移除（秒），以及最长多久检查一次
+LANE_IDLE_TTL = 300
+SWEEP_INTERVAL = 30
+
+_current_job = contextvars.ContextVar("fair_job", default=(DEFAULT_JOB, DEFAULT_WEIGHT))
+
+
+@contextmanager
+def use_job(job_id, weight=DEFAULT_WEIGHT):
+    """在 with 块内（及 telemetry.bind 的工作线程中）发出的调用归入任务 job_id，按 weight 分配槽位"""
+    token = _current_job.set((job_id, max(1, int(weight))))
+    try:
+        yield job_id
+    finally:
+        _current_job.reset(token)
+
+
+def key_fingerprint(api_key):
+    """指标中代表 API Key 的哈希前缀"""
+    if not api_key:
+        return "-"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class _Waiter:
+    """排队中的一次调用"""
+
+    __slots__ = ("job", "tokens", "enqueued", "granted")
+
+    def __init__(self, job, tokens):
+        self.job = job
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class _Lane:
+    """一个（提供商，API Key）的配额和各任务的排队调用（由 FairScheduler 的锁保护）"""
+
+    def __init__(self, max_in_flight, tokens_per_minute):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.balance = tokens_per_minute or 0
+        self.updated = time.monotonic()
+        self.last_active = self.updated
+        self.in_flight = 0
+        self.queues = {}      # 任务 → [_Waiter]（按到达顺序）
+        self.weights = {}     # 任务 → 权重
+        self.current = {}     # 任务 → 平滑加权轮询的当前值
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.granted = 0
+        self.tokens_used = 0
+
+    def refill(self, now):
+        if self.tokens_per_minute:
+            self.balance = min(self.tokens_per_minute,
+                               self.balance + (now - self.updated) * self.tokens_per_minute / 60)
+        self.updated = now
+
+    def delay(self):
+        """token 透支时距离余额转正的秒数，未透支或不限 token 时为 None"""
+        if not self.tokens_per_minute or self.balance > 0:
+            return None
+        return (1 - self.balance) * 60 / self.tokens_per_minute
+
+    def expired(self, now):
+        """空闲超过 LANE_IDLE_TTL 秒且 token 余额已补满（移除后重建不会绕过配额）"""
+        return (not self.queues and self.in_flight == 0 and now - self.last_active > LANE_IDLE_TTL
+                and (not self.tokens_per_minute or self.balance >= self.tokens_per_minute))
+
+    def depth(self):
+        return sum(len(waiters) for waiters in self.queues.values())
+
+    def next_job(self):
+        """平滑加权轮询：各任务的当前值加上权重，取最大者，再减去权重总和"""
+        total = 0
+        best = None
+        for job in self.queues:
+            self.current[job] = self.current.get(job, 0) + self.weights[job]
+            total += self.weights[job]
+            if best is None or self.current[job] > self.current[best]:
+                best = job
+        self.current[best] -= total
+        return best
+
+    def dispatch(self, now):
+        """在并发和 token 配额内依次放行排队的调用，返回是否放行了调用"""
+        self.refill(now)
+        granted = False
+        while self.queues and self.in_flight < self.max_in_flight and self.delay() is None:
+            job = self.next_job()
+            waiter = self.queues[job].pop(0)
+            if not self.queues[job]:
+                self._forget(job)
+            waiter.granted = True
+            self.in_flight += 1
+            self.granted += 1
+            self.charge(waiter.tokens)
+            self.waits.append(now - waiter.enqueued)
+            granted = True
+        return granted
+
+    def charge(self, tokens):
+        self.tokens_used += tokens
+        if self.tokens_per_minute:
+            self.balance -= tokens
+
+    def remove(self, waiter):
+        waiters = self.queues.get(waiter.job)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                self._forget(waiter.job)
+
+    def _forget(self, job):
+        """任务在本道没有排队的调用了，下次排队时重新参与轮询"""
+        del self.queues[job]
+        self.weights.pop(job, None)
+        self.current.pop(job, None)
+
+
+class FairScheduler:
+    """按（提供商，API Key）限制并发和每分钟 token，同一道内各任务的调用加权轮流发出（线程安全）"""
+
+    def __init__(self, max_in_flight=DEFAULT_KEY_MAX_IN_FLIGHT, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 quotas=None):
+        """
+        Args:
+            max_in_flight: 每个 API Key 同时进行中的调用数
+            tokens_per_minute: 每个 API Key 每分钟的 token 配额（输入 + 输出），None 为不限
+            quotas: {提供商: {"max_in_flight", "tokens_per_minute"}}，覆盖该提供商的配额
+        """
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.quotas = dict(quotas or {})
+        self._lanes = {}
+        self._swept = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _lane(self, provider, api_key):
+        key = (provider, key_fingerprint(api_key))
+        now = time.monotonic()
+        if now - self._swept > SWEEP_INTERVAL:
+            self._sweep(now)
+        if key not in self._lanes:
+            quota = self.quotas.get(provider, {})
+            self._lanes[key] = _Lane(
+                max(1, quota.get("max_in_flight") or self.max_in_flight),
+                quota.get("tokens_per_minute", self.tokens_per_minute),
+            )
+        return key
+
+    def acquire(self, provider, api_key, tokens=0, cancel_event=None):
+        """
+        排队等待一个调用槽位
+
+        Args:
+            tokens: 预扣的 token 数（估算的输入 token）
+            cancel_event: 排队期间该事件触发时放弃排队
+
+        Returns:
+            交给 release 的凭据；cancel_event 触发时为 None
+        """
+        job, weight = _current_job.get()
+        with self._cond:
+            key = self._lane(provider, api_key)
+            lane = self._lanes[key]
+            lane.last_active = time.monotonic()
+            waiter = _Waiter(job, tokens)
+            lane.queues.setdefault(job, []).append(waiter)
+            lane.weights[job] = weight
+            while True:
+                if lane.dispatch(time.monotonic()):
+                    self._cond.notify_all()
+                # 先看取消：放行与取消同时发生时归还已放行的槽位，否则该槽位永远不会释放
+                if cancel_event is not None and cancel_event.is_set():
+                    if waiter.granted:
+                        lane.in_flight -= 1
+                        lane.charge(-waiter.tokens)
+                        lane.dispatch(time.monotonic())
+                        self._cond.notify_all()
+                    else:
+                        lane.remove(waiter)
+                    return None
+                if waiter.granted:
+                    return key, waiter
+                delay = lane.delay()
+                self._cond.wait(POLL_INTERVAL if delay is None else min(delay, POLL_INTERVAL))
+
+    def release(self, ticket, tokens=0):
+        """调用结束，归还槽位；tokens 为预扣之外补扣的 token（可为负数，退还多扣的部分）"""
+        key, _ = ticket
+        with self._cond:
+            lane = self._lanes[key]
+            lane.in_flight -= 1
+            lane.charge(tokens)
+            lane.last_active = time.monotonic()
+            lane.dispatch(lane.last_active)
+            self._cond.notify_all()
+
+    def _sweep(self, now):
+        """移除空闲过期的道（调用方需持有锁）"""
+        self._swept = now
+        for key, lane in list(self._lanes.items()):
+            lane.refill(now)
+            if lane.expired(now):
+                del self._lanes[key]
+
+    def metrics(self):
+        """
+        各道的排队指标
+
+        Returns:
+            [{"provider", "key": API Key 哈希前缀, "queued", "jobs": 有排队调用的任务数,
+              "in_flight", "max_in_flight", "tokens_per_minute", "token_balance", "granted",
+              "tokens_used", "wait_p50", "wait_p95", "wait_max": 最近 WAIT_SAMPLES 次排队等待（秒）}]
+        """
+        with self._cond:
+            now = time.monotonic()
+            rows = []
+            for (provider, key), lane in self._lanes.items():
+                lane.refill(now)
+                waits = list(lane.waits)
+                rows.append({
+                    "provider": provider,
+                    "key": key,
+                    "queued": lane.depth(),
+                    "jobs": len(lane.queues),
+                    "in_flight": lane.in_flight,
+                    "max_in_flight": lane.max_in_flight,
+                    "tokens_per_minute": lane.tokens_per_minute,
+                    "token_balance": int(lane.balance) if lane.tokens_per_minute else None,
+                    "granted": lane.granted,
+                    "tokens_used": lane.tokens_used,
+                    "wait_p50": _percentile(waits, 50),
+                    "wait_p95": _percentile(waits, 95),
+                    "wait_max": max(waits) if waits else None,
+                })
+        return rows
@@ -0,0 +1,349 @@
+"""
+本地模拟提供商
+
+PROVIDERS["fake"]（sdk 为 SDK_FAKE）不发起网络请求，由本模块按提示词生成格式合规的输出，
+用于离线演示和基准测试（benchmarks/bench_pipeline.py）：
+- 故事概要（extract / reduce）：人物表、恰好 N 条分集大纲和优化要点的 JSON
+- 片段摘要（chunk / merge）、补写分集大纲、跨批交接：对应输出格式的 JSON
+- 单次生成、分批生成：每集 scenes_per_episode 场、符合 lint 各项规则的剧本；
+  分批草稿中按 draft_issue_rate 随机缺少【特写】或【★表演提示】，以便走到优化流程
+- 优化：原样返回剧本内容，补齐缺少的【特写】和【★表演提示】
+
+同一提示词的输出完全相同（随机种子取自提示词内容和配置中的 seed）。PROVIDERS["fake"] 中的
+latency、tokens_per_second、error_rate、truncate_rate 模拟首字延迟、输出速度、
+可重试的 503 错误和随机截断，可用 configure_provider("fake", ...) 调整；
+输出超过 max_tokens 时与真实接口一样截断，结束原因为 length。
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from script_index import EPISODE_TITLE_PATTERN, SCENE_HEADER_PATTERN
+from tokens import estimate_tokens
+
+
+# 流式输出每段的字数
+STREAM_CHUNK_CHARS = 24
+
+# 截断时的结束原因（与 OpenAI 兼容接口一致）
+FINISH_STOP = "stop"
+FINISH_LENGTH = "length"
+
+# 随机截断保留的输出比例范围
+TRUNCATE_RANGE = (0.3, 0.9)
+
+# 模拟错误的 HTTP 状态码（providers 按可重试错误处理）
+ERROR_STATUS = 503
+
+SURNAMES = "苏沈柳王李周吴郑陈林黄赵钱孙冯韩杨朱秦许"
+GIVEN_NAMES = "清晏景珩如烟婉宁承泽若雪子衿明远云舒念安书瑶怀瑾知意"
+IDENTITIES = ["陪嫁丫鬟", "侯府嫡长子", "当家主母", "庶出小姐", "管家", "太医", "表少爷", "大理寺少卿"]
+PERSONALITIES = ["隐忍坚韧", "清冷克制", "笑里藏刀", "胆小心细", "直率莽撞", "老谋深算"]
+PLACES = ["侯府正厅", "祠堂", "西跨院", "后花园", "书房", "府门外长街", "药铺", "佛堂"]
+EMOTIONS = ["冷笑", "压低声音", "慌乱", "平静", "咬牙", "含泪"]
+EVENTS = [
+    "{a}在祠堂当众揭穿{b}的谎言",
+    "{a}深夜潜入书房，发现{b}藏起的旧账",
+    "{b}设局陷害{a}，{a}将计就计",
+    "{a}与{b}联手查出当年旧案的关键证人",
+    "{b}以身世相要挟，{a}被迫让步",
+    "{a}在寿宴上反将{b}一军",
+]
+CATCHPHRASES = ["罢了", "凭什么", "我早就知道", "这可怎么好", "老规矩"]
+GESTURES = ["捻佛珠", "摸袖口", "敲桌面", "整理衣襟", "抚发簪"]
+
+_attempts = {}
+_attempts_lock = threading.Lock()
+
+
+class FakeProviderError(Exception):
+    """模拟的接口错误（status_code 为 ERROR_STATUS，按可重试错误处理）"""
+
+    def __init__(self, message, status_code=ERROR_STATUS):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def reset_fake_provider():
+    """清空按提示词记录的请求次数（模拟错误的随机序列从头开始）"""
+    with _attempts_lock:
+        _attempts.clear()
+
+
+def _digest(config, system_prompt, user_prompt):
+    text = f"{config.get('seed', 0)}\0{system_prompt}\0{user_prompt}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _next_attempt(digest):
+    """同一提示词第几次请求（重试时模拟错误的随机数不同，最终能够成功）"""
+    with _attempts_lock:
+        attempt = _attempts.get(digest, 0)
+        _attempts[digest] = attempt + 1
+        return attempt
+
+
+# ==================== 输出内容 ====================
+
+def _names(rng, count):
+    names = []
+    while len(names) < count:
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES)
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def _character(rng, name):
+    return {
+        "name": name,
+        "age": f"{rng.randint(16, 60)}岁",
+        "identity": rng.choice(IDENTITIES),
+        "personality": rng.choice(PERSONALITIES),
+        "background": "与侯府旧案有牵连，掌握一条关键线索",
+    }
+
+
+def _event(rng, names):
+    a, b = rng.sample(names, 2) if len(names) > 1 else (names[0], names[0])
+    return rng.choice(EVENTS).format(a=a, b=b)
+
+
+def _json(value):
+    return json.dumps(value, ensure_ascii=False, indent=2)
+
+
+def _summary(rng, total_episodes):
+    names = _names(rng, 5)
+    leads = names[:2]
+    return _json({
+        "story_summary": f"{leads[0]}替嫁入侯府，与{leads[1]}步步为营揭开当年旧案。",
+        "characters": [_character(rng, name) for name in names],
+        "episode_plan": [_event(rng, leads + [rng.choice(names[2:])]) for _ in range(total_episodes)],
+        "optimization_points": {
+            "format_notes": "场次编号连续\n场景标注日/夜、内/外",
+            "performance_notes": "情绪转折处给出表演提示",
+            "camera_notes": "关键道具和人物反应给特写",
+            "character_marks": "，".join(
+                f"{name}-口头禅「{rng.choice(CATCHPHRASES)}」+{rng.choice(GESTURES)}" for name in names[2:]
+            ),
+        },
+    })
+
+
+def _chunk(rng, events):
+    names = _names(rng, 3)
+    return _json({
+        "summary": f"{names[0]}与{names[1]}在侯府中明争暗斗，旧案线索逐步浮出水面。",
+        "characters": [_character(rng, name) for name in names],
+        "events": [_event(rng, names) for _ in range(events)],
+    })
+
+
+def _handoffs(rng, episodes):
+    names = _names(rng, 2)
+    return _json({
+        "handoffs": [
+            {
+                "episode": episode,
+                "ending": f"{names[0]}握着证据站在雨中，神色决绝",
+                "characters": [{"name": name, "state": f"留在侯府，对{names[1 - i]}心存戒备"}
+                               for i, name in enumerate(names)],
+                "hooks": ["旧账上缺失的一页下落不明"],
+            }
+            for episode in episodes
+        ]
+    })
+
+
+def _episode(rng, number, event, names, scenes, issue_rate=0.0):
+    """一集剧本；issue_rate 为每场缺少【特写】或【★表演提示】的概率"""
+    names = names or _names(rng, 2)
+    lines = [f"**第{number}集：{event[:8]}**", f"**核心剧情：** {event}", ""]
+    for position in range(1, scenes + 1):
+        cast = rng.sample(names, min(2, len(names)))
+        missing = rng.choice(["closeup", "performance"]) if rng.random() < issue_rate else None
+        lines.append(f"{number}-{position}   {rng.choice(PLACES)}     {rng.choice('日夜')}    {rng.choice('内外')}")
+        lines.append(f"人物：{'、'.join(cast)}")
+        lines.append("")
+        lines.append(f"▲ {cast[0]}推门而入，屋内烛火一晃。")
+        if missing != "closeup":
+            lines.append(f"【特写】{cast[-1]}攥紧的手指")
+        for speaker in cast + cast[:1]:
+            lines.append(f"{speaker}（{rng.choice(EMOTIONS)}）：{rng.choice(CATCHPHRASES)}，这件事没有那么简单。")
+        if missing != "performance":
+            lines.append(f"【★表演提示】{cast[0]}先稳住情绪，话尾才泄出一丝颤抖")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def _single_script(rng, title, genre, total_episodes, scenes):
+    names = _names(rng, 4)
+    characters = [_character(rng, name) for name in names]
+    rows = "\n".join(
+        f"| {char['name']} | {char['age']} | {char['identity']} | {char['personality']} | {char['background']} |"
+        for char in characters
+    )
+    marks = "\n".join(
+        f"| {name} | {rng.choice(PERSONALITIES)} | {rng.choice(CATCHPHRASES)} | {rng.choice(GESTURES)} |"
+        for name in names
+    )
+    parts = [f"""# 短剧剧本：{title}
+
+**题材：** {genre}
+**总集数：** {total_episodes}集
+
+**故事梗概：** {names[0]}替嫁入侯府，与{names[1]}步步为营揭开当年旧案。
+
+**人物小传：**
+
+| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
+|------|------|-----------|---------|----------|
+{rows}
+
+**表演记忆点：**
+
+| 角色 | 性格标签 | 口头禅 | 标志性动作 |
+|------|---------|--------|------------|
+{marks}
+
+---
+"""]
+    for number in range(1, total_episodes + 1):
+        parts.append(_episode(rng, number, _event(rng, names), names, scenes))
+    return "\n".join(parts)
+
+
+def _batch_script(rng, user_prompt, start_ep, end_ep, scenes, issue_rate):
+    cast_text = user_prompt.split("=== 本批人物设定 ===", 1)[-1].split("=== 当前批次分集计划 ===", 1)[0]
+    names = re.findall(r"^- ([^｜\n]+)", cast_text, re.M)
+    plan = {int(number): event for number, event in re.findall(r"^- 第(\d+)集：(.*)$", user_prompt, re.M)}
+    return "\n".join(
+        _episode(rng, number, plan.get(number) or _event(rng, names or _names(rng, 2)), names, scenes, issue_rate)
+        for number in range(start_ep, end_ep + 1)
+    )
+
+
+def _fix_marks(content):
+    """补齐各场缺少的【特写】和【★表演提示】，其余内容原样保留"""
+    out = []
+    scene = None
+
+    def close_scene():
+        if scene is None:
+            return
+        # 补在该场最后一个非空行之后
+        at = len(out)
+        while at > 0 and not out[at - 1].strip():
+            at -= 1
+        additions = []
+        if not scene["closeup"]:
+            additions.append("【特写】人物神情的细微变化")
+        if not scene["performance"]:
+            additions.append("【★表演提示】情绪由压抑转为外露")
+        out[at:at] = additions
+
+    for line in content.split("\n"):
+        stripped = line.strip()
+        if SCENE_HEADER_PATTERN.match(stripped) or EPISODE_TITLE_PATTERN.match(stripped):
+            close_scene()
+            scene = {"closeup": False, "performance": False} if SCENE_HEADER_PATTERN.match(stripped) else None
+        elif scene is not None:
+            scene["closeup"] = scene["closeup"] or "【特写" in line
+            scene["performance"] = scene["performance"] or "【★表演提示" in line
+        out.append(line)
+    close_scene()
+    return "\n".join(out)
+
+
+def respond(config, system_prompt, user_prompt, rng):
+    """按提示词模板生成模拟输出"""
+    scenes = config.get("scenes_per_episode", 4)
+    if "=== 需要优化的剧本内容 ===\n" in user_prompt:
+        return _fix_marks(user_prompt.split("=== 需要优化的剧本内容 ===\n", 1)[1])
+
+    match = re.search(r"请为第 (\d+)-(\d+) 集创作剧本", user_prompt)
+    if match:
+        return _batch_script(rng, user_prompt, int(match.group(1)), int(match.group(2)), scenes,
+                             config.get("draft_issue_rate", 0.0))
+
+    match = re.search(r"=== 交接点 ===\n第 ([\d、]+) 集结束时", user_prompt)
+    if match:
+        return _handoffs(rng, [int(episode) for episode in match.group(1).split("、")])
+
+    match = re.search(r"请按顺序补写第 (\d+)-(\d+) 集.*共 (\d+) 条", user_prompt)
+    if match:
+        names = _names(rng, 3)
+        return _json({"episode_plan": [_event(rng, names) for _ in range(int(match.group(3)))]})
+
+    if "=== 片段说明 ===" in user_prompt:
+        match = re.search(r"至少 (\d+) 条", user_prompt)
+        return _chunk(rng, int(match.group(1)) if match else rng.randint(1, 3))
+
+    match = re.search(r"=== 事件要求 ===\n至少 (\d+) 条", user_prompt)
+    if match:
+        return _chunk(rng, int(match.group(1)))
+
+    match = re.search(r"分集大纲\*\*（共(\d+)集）", user_prompt)
+    if match:
+        return _summary(rng, int(match.group(1)))
+
+    match = re.search(r"总集数：(\d+)", user_prompt)
+    if match:
+        title = re.search(r"标题：(.*)", user_prompt)
+        genre = re.search(r"题材：(.*)", user_prompt)
+        return _single_script(rng, title.group(1) if title else "未命名", genre.group(1) if genre else "其他",
+                              int(match.group(1)), scenes)
+
+    return "（模拟输出）"
+
+
+# ==================== 请求 ====================
+
+def iter_fake(config, system_prompt, user_prompt, stream):
+    """
+    模拟一次请求，接口同 providers._iter_response：逐段产出文本，
+    生成器返回值为结束原因和用量（按本地估算）
+    """
+    digest = _digest(config, system_prompt, user_prompt)
+    attempt = _next_attempt(digest)
+    latency = config.get("latency", 0.0)
+    tokens_per_second = config.get("tokens_per_second", 0)
+
+    if random.Random(f"{digest}:{attempt}").random() < config.get("error_rate", 0.0):
+        time.sleep(latency)
+        raise FakeProviderError(f"模拟错误（第 {attempt + 1} 次请求）")
+
+    rng = random.Random(digest)
+    text = respond(config, system_prompt, user_prompt, rng)
+    finish_reason = FINISH_STOP
+    tokens = estimate_tokens(text)
+    max_tokens = config.get("max_tokens")
+    if max_tokens and tokens > max_tokens:
+        text = text[:len(text) * max_tokens // tokens]
+        finish_reason = FINISH_LENGTH
+    elif rng.random() < config.get("truncate_rate", 0.0):
+        text = text[:int(len(text) * rng.uniform(*TRUNCATE_RANGE))]
+        finish_reason = FINISH_LENGTH
+
+    time.sleep(latency)
+    if stream:
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            chunk = text[start:start + STREAM_CHUNK_CHARS]
+            if tokens_per_second:
+                time.sleep(estimate_tokens(chunk) / tokens_per_second)
+            yield chunk
+    else:
+        if tokens_per_second:
+            time.sleep(estimate_tokens(text) / tokens_per_second)
+        yield text
+    return {
+        "finish_reason": finish_reason,
+        "input_tokens": estimate_tokens(system_prompt) + estimate_tokens(user_prompt),
+        "output_tokens": estimate_tokens(text),
+        "cached_input_tokens": 0,
+    }
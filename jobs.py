@@ -0,0 +1,519 @@
+"""
+后台生成任务队列
+
+生成在进程内的工作线程池中执行，不占用 Streamlit 的脚本线程：
+页面提交任务后立即返回，之后按任务 ID 轮询进度、读取结果。
+页面交互触发重跑、浏览器断开重连都不会中断正在进行的生成，
+同一服务器上的多个用户共用同一个有并发上限的线程池。
+每个任务的模型调用都以任务 ID 标记（fairshare.use_job），配置了公平调度器时
+各任务的调用按 API Key 排队、轮流发出，短任务不会被长任务的大量批次堵住。
+
+任务记录（状态、参数、结果）保存在 JobStore 中：
+- MemoryJobStore：保存在进程内存中（默认）
+- SQLiteJobStore：保存在本地 SQLite 文件中，服务重启后仍可查看已完成任务的结果
+
+API Key 只保存在内存中、不写入任务记录，服务重启时未完成的任务标记为失败；
+分步生成的检查点仍在，重新提交后从失败的批次继续。
+生成的剧本写入 ScriptStore 的文件，任务结果中只保存文件名、分页位置和结构统计。
+按集重做（MODE_REDO）读取已完成任务的剧本文件，只重做选中的几集，结果写入新文件，
+原任务的结果不受影响。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from extraction import extract_story_summary
+from fairshare import use_job
+from pipeline import REDO_REGENERATE, batch_label, call_ai_model, redo_episodes, run_batch_pipeline
+from providers import use_router
+from report import script_metrics
+from routing import make_router
+from scheduler import BATCH_DONE, BATCH_GENERATING, BATCH_OPTIMIZING, BATCH_PENDING
+from script_index import ScriptParser
+from telemetry import Tracer, use_tracer
+
+
+DEFAULT_JOB_DB_PATH = os.path.join(".cache", "jobs.sqlite3")
+
+# 同时执行的生成任务数（模型调用的并发另由公平调度器按 API Key 限制，任务线程多数时间在排队）
+DEFAULT_JOB_WORKERS = 8
+
+# 已结束的任务保留时间（秒），超过后在提交新任务时清理
+DEFAULT_JOB_MAX_AGE = 24 * 3600
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_STATE_LABELS = {
+    JOB_QUEUED: "⏳ 排队中",
+    JOB_RUNNING: "✍️ 生成中",
+    JOB_DONE: "✅ 已完成",
+    JOB_FAILED: "❌ 失败",
+}
+
+FINISHED_STATES = {JOB_DONE, JOB_FAILED}
+
+# 生成模式
+MODE_SINGLE = "single"
+MODE_BATCH = "batch"
+MODE_REDO = "redo"      # 按集重做已完成任务的剧本
+
+
+# ==================== 任务存储 ====================
+
+class MemoryJobStore:
+    """进程内存中的任务记录（线程安全）"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, updated=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def unfinished(self):
+        """未结束的任务 ID"""
+        with self._lock:
+            return [job_id for job_id, job in self._jobs.items() if job["status"] not in FINISHED_STATES]
+
+    def prune(self, max_age):
+        """删除结束超过 max_age 秒的任务"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in FINISHED_STATES and job["updated"] < cutoff
+            ]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """保存在本地 SQLite 文件中的任务记录，参数和结果以 JSON 保存"""
+
+    COLUMNS = ("id", "status", "params", "progress", "message", "result", "error", "created", "updated")
+    JSON_COLUMNS = ("params", "result")
+
+    def __init__(self, path=DEFAULT_JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if path != ":memory:" and directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                progress INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+        self._conn.commit()
+
+    def _encode(self, fields):
+        return {
+            name: json.dumps(value, ensure_ascii=False) if name in self.JSON_COLUMNS and value is not None else value
+            for name, value in fields.items()
+        }
+
+    def create(self, job):
+        row = self._encode(job)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [row.get(name) for name in self.COLUMNS],
+            )
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        row = self._encode(dict(fields, updated=time.time()))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in row)} WHERE id = ?",
+                [*row.values(), job_id],
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        for name in self.JSON_COLUMNS:
+            if job[name] is not None:
+                job[name] = json.loads(job[name])
+        return job
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self, max_age):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (JOB_DONE, JOB_FAILED, time.time() - max_age),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ==================== 运行中进度 ====================
+
+class JobProgress:
+    """
+    运行中任务的实时进度（只保存在内存中）
+
+    生成线程通过回调更新，页面轮询时读取 snapshot()。
+    """
+
+    def __init__(self):
+        self.progress = 0
+        self.message = ""
+        self.summary = None
+        self.summary_chars = 0
+        self.plan = None
+        self.batch_states = []
+        self._parts = []
+        self._parser = ScriptParser()
+        self._batch_parts = []
+        self._lock = threading.Lock()
+
+    def on_status(self, text, progress):
+        with self._lock:
+            self.message = text
+            self.progress = progress
+
+    def on_summary_delta(self, text):
+        """故事概要的流式输出，只统计已接收的字数"""
+        with self._lock:
+            self.summary_chars += len(text)
+            self.message = f"正在提取故事概要（已接收 {self.summary_chars} 字）..."
+
+    def on_summary(self, summary_data):
+        with self._lock:
+            self.summary = summary_data
+
+    def on_update(self, batch_idx, state, states):
+        # 生成、优化各占一半进度
+        steps = sum({BATCH_OPTIMIZING: 1, BATCH_DONE: 2}.get(s, 0) for s in states)
+        with self._lock:
+            self.batch_states = states
+            self.progress = 15 + int(80 * steps / (2 * len(states)))
+            self.message = f"正在分批生成剧本（{states.count(BATCH_DONE)}/{len(states)}批已完成）..."
+
+    def on_text(self, text):
+        """单次生成的流式输出，边输出边解析剧本结构"""
+        with self._lock:
+            self._parts.append(text)
+            self._parser.feed(text)
+
+    def on_batch_delta(self, batch_idx, state, text):
+        """分步生成各批的流式输出：优化结果开始输出后替换生成草稿"""
+        with self._lock:
+            drafts, optimized = self._batch_parts[batch_idx]
+            (drafts if state == BATCH_GENERATING else optimized).append(text)
+
+    def start_batches(self, plan):
+        with self._lock:
+            self.plan = plan
+            self.batch_states = [BATCH_PENDING] * len(plan)
+            self._batch_parts = [([], []) for _ in plan]
+
+    def partial_text(self):
+        """已生成的部分剧本"""
+        with self._lock:
+            if not self._batch_parts:
+                return "".join(self._parts)
+            sections = []
+            for (start_ep, end_ep), (drafts, optimized) in zip(self.plan, self._batch_parts):
+                content = "".join(optimized or drafts)
+                if content:
+                    sections.append(f"# {batch_label(start_ep, end_ep)}\n{content}")
+            return f"\n{'='*50}\n".join(sections)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "progress": self.progress,
+                "message": self.message,
+                "summary": self.summary,
+                "plan": self.plan,
+                "batch_states": list(self.batch_states),
+                "structure": self._parser.index.stats() if self._parts else None,
+            }
+
+
+# ==================== 任务队列 ====================
+
+class JobQueue:
+    """进程内的后台任务队列：提交 → 线程池执行 → 结果写入 JobStore"""
+
+    def __init__(self, runner, store=None, max_workers=DEFAULT_JOB_WORKERS, max_age=DEFAULT_JOB_MAX_AGE):
+        """
+        Args:
+            runner: runner(params, secrets, progress) -> 结果（可 JSON 序列化的 dict）
+            store: 任务记录存储，默认 MemoryJobStore
+            max_workers: 同时执行的任务数，超出的任务排队
+            max_age: 已结束任务的保留时间（秒）
+        """
+        self.runner = runner
+        self.store = store or MemoryJobStore()
+        self.max_age = max_age
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+        # 上次进程退出时未完成的任务已经丢失了 API Key，无法继续执行
+        for job_id in self.store.unfinished():
+            self.store.update(job_id, status=JOB_FAILED, error="服务已重启，任务中断，请重新提交")
+
+    def submit(self, params, secrets=None):
+        """
+        提交任务，返回任务 ID
+
+        Args:
+            params: 任务参数（写入任务记录）
+            secrets: 只在内存中传给 runner 的参数（例如 API Key）
+        """
+        self._prune()
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self.store.create({
+            "id": job_id,
+            "status": JOB_QUEUED,
+            "params": params,
+            "progress": 0,
+            "message": "排队中...",
+            "result": None,
+            "error": None,
+            "created": now,
+            "updated": now,
+        })
+        progress = JobProgress()
+        with self._lock:
+            self._progress[job_id] = progress
+        self._executor.submit(self._run, job_id, params, dict(secrets or {}), progress)
+        return job_id
+
+    def _prune(self):
+        """删除过期的任务记录，以及记录已删除的任务保留的进度（失败任务的部分剧本）"""
+        self.store.prune(self.max_age)
+        with self._lock:
+            job_ids = list(self._progress)
+        for job_id in job_ids:
+            if self.store.get(job_id) is None:
+                with self._lock:
+                    self._progress.pop(job_id, None)
+
+    def _run(self, job_id, params, secrets, progress):
+        failed = True
+        try:
+            self.store.update(job_id, status=JOB_RUNNING, message="开始生成...")
+            with use_job(job_id):
+                result = self.runner(params, secrets, progress)
+            self.store.update(job_id, status=JOB_DONE, progress=100, message="生成完成！", result=result)
+            failed = False
+        except Exception as e:
+            self.store.update(job_id, status=JOB_FAILED, progress=progress.progress,
+                              message=progress.message, error=f"{type(e).__name__}: {e}")
+        finally:
+            # 结果已保存，释放流式输出占用的内存；失败的任务保留部分剧本，随任务记录在 _prune 中清理
+            if not failed:
+                with self._lock:
+                    self._progress.pop(job_id, None)
+
+    def get(self, job_id):
+        """
+        读取任务，不存在时返回 None
+
+        Returns:
+            任务记录，运行中（或失败）的任务另有 "live"（JobProgress.snapshot()）和
+            "partial"（已生成的部分剧本）
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            progress = self._progress.get(job_id)
+        if progress is not None:
+            live = progress.snapshot()
+            job["live"] = live
+            job["partial"] = progress.partial_text()
+            if job["status"] == JOB_RUNNING:
+                job["progress"] = live["progress"]
+                job["message"] = live["message"] or job["message"]
+        return job
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# ==================== 剧本生成任务 ====================
+
+def script_result(scripts, name):
+    """扫描写好的剧本文件，返回任务结果中的剧本部分 {"script_file", "script_size", "pages", "structure"}"""
+    pages, index = scripts.scan(name)
+    return {
+        "script_file": name,
+        "script_size": scripts.size(name),
+        "pages": pages,
+        "structure": {"stats": index.stats(), "characters": index.character_stats()},
+    }
+
+
+def generation_runner(checkpoints, scripts):
+    """
+    返回执行剧本生成的 runner，供 JobQueue 使用
+
+    params: {"mode", "novel", "title", "genre", "episodes", "opt_level", "provider",
+             "max_in_flight", "optimize_mode", "continuity", "plan", "run_id", "resume",
+             "fallback_provider", "hedge"}
+            按集重做（mode 为 MODE_REDO）时另有 {"script_file": 要重做的剧本文件,
+             "redo_episodes": 集数列表, "redo_action": pipeline.REDO_REGENERATE / REDO_OPTIMIZE}
+    secrets: {"api_key", "fallback_api_key"}
+
+    给出 fallback_provider 时，发往 provider 的调用经过 routing.Router 对冲和故障转移。
+    按集重做使用检查点中 run_id 的故事概要；没有时（例如单次生成的剧本）先提取一次并保存。
+
+    Returns:
+        runner 的结果 {"mode", "script_file", "script_size", "pages", "structure",
+        "plan", "report", "context", "quality", "trace"}：剧本保存在 scripts 的 script_file 中，
+        pages 为按集分页的位置（见 ScriptStore.scan），structure 为结构统计；
+        report 为分步生成的优化报告（按集重做时为重做前后的对比，作为一批），
+        context 为按批裁剪人物设定的汇总，quality 为单次生成的剧本指标，
+        trace 为 Tracer.to_records()；按集重做另有 redone（实际替换的集数）
+    """
+    def run(params, secrets, progress):
+        tracer = Tracer(params.get("run_id"))
+        name = scripts.new_name()
+        router = make_router(params["provider"], secrets["api_key"], params.get("fallback_provider"),
+                             secrets.get("fallback_api_key"), hedge=params.get("hedge", True))
+        with use_tracer(tracer), use_router(router):
+            if params["mode"] == MODE_REDO:
+                return redo(params, secrets, progress, tracer, name)
+
+            if params["mode"] == MODE_SINGLE:
+                progress.on_status("正在生成剧本...", 5)
+                script_content = call_ai_model(
+                    novel=params["novel"],
+                    title=params["title"],
+                    genre=params["genre"],
+                    episodes=params["episodes"],
+                    opt_level=params["opt_level"],
+                    api_key=secrets["api_key"],
+                    provider=params["provider"],
+                    on_delta=progress.on_text
+                )
+                scripts.write(name, script_content)
+                return dict(script_result(scripts, name), mode=MODE_SINGLE, plan=None, report=None, context=None,
+                            quality=script_metrics(script_content), trace=tracer.to_records())
+
+            plan = [tuple(batch) for batch in params["plan"]]
+            run_id = params["run_id"]
+            # 重新生成时丢弃旧检查点；继续生成时保留已完成的阶段
+            if not params.get("resume"):
+                checkpoints.discard(run_id)
+            checkpoints.save(run_id, "meta", {
+                "title": params["title"],
+                "genre": params["genre"],
+                "episodes": params["episodes"],
+                "total_batches": len(plan),
+                "complete": False
+            })
+            progress.start_batches(plan)
+            with scripts.writer(name) as output:
+                result = run_batch_pipeline(
+                    novel=params["novel"],
+                    title=params["title"],
+                    genre=params["genre"],
+                    episodes=params["episodes"],
+                    api_key=secrets["api_key"],
+                    provider=params["provider"],
+                    max_in_flight=params.get("max_in_flight"),
+                    checkpoints=checkpoints,
+                    run_id=run_id,
+                    plan=plan,
+                    optimize_mode=params["optimize_mode"],
+                    continuity=params.get("continuity", True),
+                    output=output,
+                    on_status=progress.on_status,
+                    on_summary=progress.on_summary,
+                    on_update=progress.on_update,
+                    on_delta=progress.on_batch_delta,
+                    on_summary_delta=progress.on_summary_delta
+                )
+            checkpoints.save(run_id, "meta", dict(checkpoints.load(run_id, "meta"), complete=True))
+        return dict(script_result(scripts, name), mode=MODE_BATCH, plan=result["plan"], report=result["report"],
+                    context=result["context"], quality=None, trace=tracer.to_records())
+
+    def redo(params, secrets, progress, tracer, name):
+        if not scripts.exists(params["script_file"]):
+            raise FileNotFoundError("剧本文件已过期清理，请重新生成")
+        progress.on_status("正在读取故事概要...", 5)
+        summary_data = checkpoints.stage(params["run_id"], "summary", lambda: extract_story_summary(
+            novel=params["novel"],
+            title=params["title"],
+            genre=params["genre"],
+            total_episodes=params["episodes"],
+            api_key=secrets["api_key"],
+            provider=params["provider"],
+            max_in_flight=params.get("max_in_flight")
+        ))
+        progress.on_summary(summary_data)
+        result = redo_episodes(
+            script=scripts.read(params["script_file"]),
+            summary_data=summary_data,
+            title=params["title"],
+            genre=params["genre"],
+            numbers=params["redo_episodes"],
+            api_key=secrets["api_key"],
+            provider=params["provider"],
+            action=params.get("redo_action", REDO_REGENERATE),
+            optimize_mode=params["optimize_mode"],
+            on_status=progress.on_status
+        )
+        scripts.write(name, result["script"])
+        return dict(script_result(scripts, name), mode=MODE_REDO, plan=None, report=result["report"],
+                    context=None, quality=None, redone=result["episodes"], trace=tracer.to_records())
+
+    return run
+
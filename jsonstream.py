@@ -0,0 +1,210 @@
+"""
+容错的增量 JSON 提取
+
+模型输出的 JSON 常见问题：包在 markdown 代码块中、前后夹杂说明文字、尾随逗号、
+输出被截断（字符串、数组、对象没有闭合）。JSONExtractor 边接收流式输出边扫描，
+每个字符只处理一次，随时可以取出修复后的对象：
+
+    extractor = JSONExtractor()
+    for text in stream:
+        extractor.feed(text)
+    extractor.value()
+
+- 第一个 { 之前的内容（代码块标记、说明文字）跳过，顶层对象闭合之后的内容忽略
+- 去掉 } 和 ] 之前的尾随逗号
+- 截断时闭合未结束的字符串（去掉不完整的转义），去掉不完整的键和字面量，补全缺少的值和括号；
+  数组中未写完的元素（字符串、对象、数组）整个去掉，不当作完整的一项
+"""
+
+import json
+
+
+# 对象内的解析位置
+EXPECT_KEY = "key"
+EXPECT_COLON = "colon"
+EXPECT_VALUE = "value"
+EXPECT_COMMA = "comma"
+
+CLOSERS = {"{": "}", "[": "]"}
+WHITESPACE = " \t\r\n"
+DELIMITERS = '{}[]:,"' + WHITESPACE
+
+
+class JSONExtractor:
+    """增量扫描模型输出中的第一个 JSON 对象，feed() 追加文本，value() 取出修复后的对象"""
+
+    def __init__(self):
+        self._out = []
+        self._stack = []          # [[容器类型, 解析位置, 当前键在 _out 中的起点, 容器在 _out 中的起点]]
+        self._last = -1           # 最后一个非空白字符在 _out 中的位置（字符串外）
+        self._in_string = False
+        self._escape = False
+        self._escape_start = None   # 未完成的转义序列（\ 或 \uXXXX）在 _out 中的起点
+        self._hex_left = 0          # \u 转义还差的十六进制位数
+        self._string_start = None
+        self._string_is_key = False
+        self._literal_start = None
+        self.started = False
+        self.complete = False
+
+    @property
+    def truncated(self):
+        """已经开始但顶层对象没有闭合"""
+        return self.started and not self.complete
+
+    def feed(self, text):
+        for char in text:
+            if self.complete:
+                return
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self._open(char)
+                continue
+            self._scan(char)
+
+    # ---------- 扫描 ----------
+
+    def _emit(self, char):
+        self._out.append(char)
+        if char not in WHITESPACE:
+            self._last = len(self._out) - 1
+
+    def _open(self, char):
+        self._stack.append([char, EXPECT_KEY if char == "{" else EXPECT_VALUE, None, len(self._out)])
+        self._emit(char)
+
+    def _value_done(self):
+        if self._stack:
+            self._stack[-1][1] = EXPECT_COMMA
+
+    def _end_literal(self):
+        if self._literal_start is not None:
+            self._literal_start = None
+            self._value_done()
+
+    def _scan(self, char):
+        if self._in_string:
+            self._out.append(char)
+            if self._escape:
+                self._escape = False
+                if char == "u":
+                    self._hex_left = 4
+            elif self._hex_left:
+                self._hex_left -= 1
+            elif char == "\\":
+                self._escape = True
+                self._escape_start = len(self._out) - 1
+            elif char == '"':
+                self._in_string = False
+                self._last = len(self._out) - 1
+                if self._string_is_key:
+                    self._stack[-1][1] = EXPECT_COLON
+                else:
+                    self._value_done()
+            return
+
+        if char not in DELIMITERS:
+            if self._literal_start is None:
+                self._literal_start = len(self._out)
+            self._emit(char)
+            return
+        self._end_literal()
+
+        frame = self._stack[-1]
+        if char == '"':
+            self._string_is_key = frame[0] == "{" and frame[1] == EXPECT_KEY
+            if self._string_is_key:
+                frame[2] = len(self._out)
+            self._string_start = len(self._out)
+            self._in_string = True
+            self._emit(char)
+        elif char in "{[":
+            self._open(char)
+        elif char in "}]":
+            # 尾随逗号
+            if self._last >= 0 and self._out[self._last] == ",":
+                self._out[self._last] = ""
+            self._stack.pop()
+            self._emit(CLOSERS[frame[0]])
+            if self._stack:
+                self._value_done()
+            else:
+                self.complete = True
+        elif char == ":":
+            frame[1] = EXPECT_VALUE
+            self._emit(char)
+        elif char == ",":
+            frame[1] = EXPECT_KEY if frame[0] == "{" else EXPECT_VALUE
+            self._emit(char)
+        else:
+            self._out.append(char)
+
+    # ---------- 修复与解析 ----------
+
+    def text(self):
+        """修复后的 JSON 文本，没有找到 JSON 对象时为空字符串"""
+        if not self.started:
+            return ""
+        if self.complete:
+            return "".join(self._out)
+
+        # 位置都是 _out 中的下标（去掉的尾随逗号在 _out 中留空串，join 之后下标会错位）
+        stack = [list(frame) for frame in self._stack]
+        end = len(self._out)
+        quote = ""
+        # 数组中未写完的元素：从最外层的一个起整个去掉
+        element = next((i for i in range(1, len(stack)) if stack[i - 1][0] == "["), None)
+        if element is not None:
+            end = stack[element][3]
+            stack = stack[:element]
+            stack[-1][1] = EXPECT_COMMA
+        elif self._in_string and stack[-1][0] == "[":
+            end = self._string_start
+            stack[-1][1] = EXPECT_COMMA
+        elif self._in_string:
+            if self._string_is_key:
+                end = stack[-1][2]
+                stack[-1][1] = EXPECT_KEY
+            else:
+                if self._escape or self._hex_left:
+                    end = self._escape_start
+                quote = '"'
+                stack[-1][1] = EXPECT_COMMA
+        elif self._literal_start is not None:
+            try:
+                json.loads("".join(self._out[self._literal_start:]))
+            except ValueError:
+                end = self._literal_start
+            else:
+                stack[-1][1] = EXPECT_COMMA
+
+        top = stack[-1]
+        if top[0] == "{" and top[1] == EXPECT_COLON:
+            end = top[2]
+        text = "".join(self._out[:end]) + quote
+        if top[1] == EXPECT_VALUE and not text.rstrip(WHITESPACE).endswith(("[", ",")):
+            text += "null"
+        text = text.rstrip(WHITESPACE)
+        if text.endswith(","):
+            text = text[:-1]
+        return text + "".join(CLOSERS[frame[0]] for frame in reversed(stack))
+
+    def value(self):
+        """
+        解析修复后的对象
+
+        Raises:
+            json.JSONDecodeError: 没有找到 JSON 对象，或修复后仍无法解析
+        """
+        text = self.text()
+        if not text:
+            raise json.JSONDecodeError("未找到 JSON 对象", "".join(self._out), 0)
+        return json.loads(text, strict=False)
+
+
+def extract_json(text):
+    """从完整的模型输出中提取并修复第一个 JSON 对象，失败时抛出 json.JSONDecodeError"""
+    extractor = JSONExtractor()
+    extractor.feed(text)
+    return extractor.value()
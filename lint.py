@@ -0,0 +1,174 @@
+"""
+剧本格式检查
+
+按提示词中的格式要求在本地检查剧本，不调用模型：
+- 场景标注：日/夜 + 内/外
+- 每场有「人物：」行
+- 场次编号与集数一致且连续（3-1, 3-2, ...）
+- 每场至少一处【★表演提示】和【特写】
+- 每集有「核心剧情」
+
+分步生成时用于只把不合格的集（或场）交给 optimize_batch 优化，
+再把优化结果按集数、场次编号拼回原剧本。
+"""
+
+from script_index import parse_script
+
+
+# 场景级规则
+RULE_SCENE_TIME = "scene_time"          # 场景标注缺少日/夜
+RULE_SCENE_PLACE = "scene_place"        # 场景标注缺少内/外
+RULE_MISSING_CAST = "missing_cast"      # 场景缺少「人物：」行
+RULE_SCENE_NUMBER = "scene_number"      # 场次编号与集数不符或不连续
+RULE_NO_PERFORMANCE = "no_performance"  # 场景没有【★表演提示】
+RULE_NO_CLOSEUP = "no_closeup"          # 场景没有【特写】
+
+# 集级规则
+RULE_NO_SUMMARY = "no_summary"          # 缺少「核心剧情」
+
+RULE_LABELS = {
+    RULE_SCENE_TIME: "缺少日/夜标注",
+    RULE_SCENE_PLACE: "缺少内/外标注",
+    RULE_MISSING_CAST: "缺少人物行",
+    RULE_SCENE_NUMBER: "场次编号错误",
+    RULE_NO_PERFORMANCE: "缺少表演提示",
+    RULE_NO_CLOSEUP: "缺少特写镜头",
+    RULE_NO_SUMMARY: "缺少核心剧情",
+}
+
+# 属于格式规范的规则（优化报告中的「格式问题」）
+FORMAT_RULES = {RULE_SCENE_TIME, RULE_SCENE_PLACE, RULE_MISSING_CAST, RULE_SCENE_NUMBER}
+
+# 出现这些问题时整集重新优化（按场次编号无法可靠地拼回）
+EPISODE_LEVEL_RULES = {RULE_SCENE_NUMBER, RULE_NO_SUMMARY}
+
+PERFORMANCE_MARK = "【★表演提示"
+CLOSEUP_MARK = "【特写"
+
+
+def lint_index(index):
+    """
+    检查剧本索引
+
+    Returns:
+        [{"rule", "episode": 集数, "scene": 场次编号（集级问题为 None）}]
+    """
+    issues = []
+    for episode in index.episodes:
+        number = episode["number"]
+        if not episode["summary"]:
+            issues.append({"rule": RULE_NO_SUMMARY, "episode": number, "scene": None})
+        for position, scene in enumerate(episode["scenes"], 1):
+            def issue(rule):
+                issues.append({"rule": rule, "episode": number, "scene": scene["id"]})
+
+            if not scene["time"]:
+                issue(RULE_SCENE_TIME)
+            if not scene["place"]:
+                issue(RULE_SCENE_PLACE)
+            if not scene["cast"]:
+                issue(RULE_MISSING_CAST)
+            if scene["id"] != f"{number}-{position}":
+                issue(RULE_SCENE_NUMBER)
+            texts = [line[4] for line in scene["lines"]]
+            if not any(PERFORMANCE_MARK in text for text in texts):
+                issue(RULE_NO_PERFORMANCE)
+            if not any(CLOSEUP_MARK in text for text in texts):
+                issue(RULE_NO_CLOSEUP)
+    return issues
+
+
+def lint_script(text):
+    """解析并检查剧本，返回 (ScriptIndex, 问题列表)"""
+    index = parse_script(text)
+    return index, lint_index(index)
+
+
+# ==================== 按集 / 按场选取与拼接 ====================
+
+def select_units(issues, scene_level):
+    """
+    选出需要优化的部分
+
+    Returns:
+        {集数: 场次编号集合}，集合为 None 表示整集
+    """
+    selection = {}
+    for issue in issues:
+        number = issue["episode"]
+        if not scene_level or issue["scene"] is None or issue["rule"] in EPISODE_LEVEL_RULES:
+            selection[number] = None
+        elif number not in selection:
+            selection[number] = {issue["scene"]}
+        elif selection[number] is not None:
+            selection[number].add(issue["scene"])
+    return selection
+
+
+def _spans(index, text):
+    """各集、各场在 text 中的位置 ({集数: (起, 止)}, {(集数, 场次编号): (起, 止)}, {集数: 标题行止})"""
+    episode_spans = {}
+    scene_spans = {}
+    header_ends = {}
+    episodes = index.episodes
+    for i, episode in enumerate(episodes):
+        end = episodes[i + 1]["offset"] if i + 1 < len(episodes) else len(text)
+        episode_spans.setdefault(episode["number"], (episode["offset"], end))
+        header_end = text.find("\n", episode["offset"], end)
+        header_ends.setdefault(episode["number"], end if header_end < 0 else header_end + 1)
+        scenes = episode["scenes"]
+        for j, scene in enumerate(scenes):
+            scene_end = scenes[j + 1]["offset"] if j + 1 < len(scenes) else end
+            scene_spans.setdefault((episode["number"], scene["id"]), (scene["offset"], scene_end))
+    return episode_spans, scene_spans, header_ends
+
+
+def build_fragment(text, index, selection):
+    """按 select_units 的结果截取需要优化的片段：整集原样截取，按场截取时保留该集标题行"""
+    episode_spans, scene_spans, header_ends = _spans(index, text)
+    parts = []
+    for number in sorted(selection):
+        start, end = episode_spans[number]
+        if selection[number] is None:
+            parts.append(text[start:end])
+            continue
+        parts.append(text[start:header_ends[number]])
+        for scene in index.episode(number)["scenes"]:
+            if scene["id"] in selection[number]:
+                scene_start, scene_end = scene_spans[(number, scene["id"])]
+                parts.append(text[scene_start:scene_end])
+    return "".join(part if part.endswith("\n") else part + "\n" for part in parts)
+
+
+def splice(text, index, optimized, selection):
+    """
+    把优化后的片段按集数、场次编号拼回原剧本
+
+    优化结果中缺少的集或场保留原文。
+    """
+    episode_spans, scene_spans, _ = _spans(index, text)
+    new_index = parse_script(optimized)
+    new_episode_spans, new_scene_spans, _ = _spans(new_index, optimized)
+
+    replacements = []
+    for number, scenes in selection.items():
+        if scenes is None:
+            if number in new_episode_spans:
+                start, end = new_episode_spans[number]
+                replacements.append((episode_spans[number], optimized[start:end]))
+            continue
+        for scene_id in scenes:
+            key = (number, scene_id)
+            if key in new_scene_spans:
+                start, end = new_scene_spans[key]
+                replacements.append((scene_spans[key], optimized[start:end]))
+
+    # 从后往前替换，前面的位置不受影响
+    result = text
+    for (start, end), content in sorted(replacements, key=lambda item: item[0][0], reverse=True):
+        if not content.endswith("\n"):
+            content += "\n"
+        # 保留原文段落之间的空行
+        trailing = result[start:end][len(result[start:end].rstrip("\n")):]
+        result = result[:start] + content.rstrip("\n") + (trailing or "\n") + result[end:]
+    return result
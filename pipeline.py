@@ -0,0 +1,736 @@
+"""
+剧本生成流水线
+
+与界面无关的生成逻辑，Streamlit 页面（app.py）和命令行批处理（cli.py）共用：
+- 单次生成：call_ai_model 一次调用输出完整剧本
+- 分步生成：extract_story_summary → plan_handoffs → generate_batch_with_summary → optimize_selected
+  → assemble_script，由 run_batch_pipeline 串联，支持断点续跑
+- 按集重做：redo_episodes 只重新生成或重新优化选中的几集，按集数拼回完整剧本
+
+optimize_selected 先用 lint 在本地检查草稿，只把不合格的集（或场）交给 optimize_batch，
+格式已合格的批次不再调用模型。
+
+分步生成的每批集数由 plan_batches 按提供商输出上限和本地 token 估算决定，
+单批输出仍被截断时按集续写，保证每一集都是完整的。
+"""
+
+import io
+import json
+import math
+import re
+import time
+
+from cast_index import CastIndex
+from checkpoint import STAGE_DRAFT, STAGE_OPTIMIZED, batch_stage
+from extraction import extract_story_summary, parse_json_response
+from lint import build_fragment, lint_script, select_units, splice
+from prompts import build_batch_prompt, build_handoff_prompt, build_optimize_prompt, build_single_prompt
+from providers import call_provider, call_provider_result, get_provider_config
+from report import main_characters_of, optimization_report
+from scheduler import run_batches
+from telemetry import span
+from script_index import EPISODE_HEADER_PATTERN
+from tokens import tokens_per_cjk_char
+
+
+# 每集剧本的估算字数（至少 4 场，含场景描述、台词和表演提示）
+EPISODE_CHARS = 1500
+
+# 优化后剧本相对草稿的增长比例（补充表演提示、特写镜头）
+OPTIMIZE_GROWTH = 1.2
+
+# 每批只用到输出上限的这一比例，给估算误差留余量
+OUTPUT_BUDGET_RATIO = 0.8
+
+# 提供商未配置 max_tokens 时按此输出上限规划
+DEFAULT_MAX_TOKENS = 4096
+
+# 单批最多集数（限制单次请求的时长）
+MAX_BATCH_EPISODES = 30
+
+# 单批输出被截断或缺集时最多续写的次数
+MAX_CONTINUATIONS = 3
+
+# 续写次数用完仍不完整的集末尾加上的标记
+INCOMPLETE_EPISODE_NOTE = "【第{number}集生成不完整：输出被截断，续写 {attempts} 次后仍未写完】"
+
+# 优化范围
+OPTIMIZE_FULL = "full"            # 整批优化
+OPTIMIZE_EPISODES = "episodes"    # 只优化格式检查不合格的集
+OPTIMIZE_FRAGMENTS = "fragments"  # 只优化不合格的场，结果按场次编号拼回
+
+OPTIMIZE_MODE_LABELS = {
+    OPTIMIZE_FULL: "整批优化",
+    OPTIMIZE_EPISODES: "只优化不合格的集",
+    OPTIMIZE_FRAGMENTS: "只优化不合格的场",
+}
+
+DEFAULT_OPTIMIZE_MODE = OPTIMIZE_EPISODES
+
+# 按集重做的方式
+REDO_REGENERATE = "regenerate"    # 按故事概要重新生成，再按优化范围优化
+REDO_OPTIMIZE = "optimize"        # 保留剧情，只重新优化
+
+REDO_LABELS = {
+    REDO_REGENERATE: "重新生成",
+    REDO_OPTIMIZE: "重新优化",
+}
+
+# 重新生成时附带的相邻集剧本字数（上一集结尾、下一集开头）
+NEIGHBOR_CHARS = 800
+
+# 组合剧本中各批之前的分隔（见 write_script）
+BATCH_SEPARATOR_PATTERN = re.compile(r"^={50}\n# 第 \d+-\d+ 集$", re.M)
+
+# 各阶段的 telemetry span 名称
+SPAN_PIPELINE = "pipeline"
+SPAN_SINGLE = "single"
+SPAN_SUMMARY = "summary"
+SPAN_HANDOFF = "handoff"
+SPAN_GENERATE = "generate"
+SPAN_OPTIMIZE = "optimize"
+SPAN_ASSEMBLY = "assembly"
+SPAN_REPORT = "report"
+SPAN_REDO = "redo"
+
+SPAN_LABELS = {
+    SPAN_PIPELINE: "完整流程",
+    SPAN_SINGLE: "单次生成",
+    SPAN_SUMMARY: "提取概要",
+    SPAN_HANDOFF: "跨批衔接",
+    SPAN_GENERATE: "分批生成",
+    SPAN_OPTIMIZE: "分批优化",
+    SPAN_ASSEMBLY: "组合剧本",
+    SPAN_REPORT: "优化报告",
+    SPAN_REDO: "按集重做",
+}
+
+
+# ==================== 分批规划 ====================
+
+def max_batch_episodes(provider):
+    """按提供商输出上限估算单批最多能完整输出的集数"""
+    config = get_provider_config(provider)
+    budget = (config["max_tokens"] or DEFAULT_MAX_TOKENS) * OUTPUT_BUDGET_RATIO
+    episode_tokens = EPISODE_CHARS * tokens_per_cjk_char(provider) * OPTIMIZE_GROWTH
+    return max(1, min(MAX_BATCH_EPISODES, int(budget // episode_tokens)))
+
+
+def plan_batches(total_episodes, provider, batch_size=None):
+    """
+    规划分批生成的起止集数
+
+    批次数取满足输出上限的最小值，各批集数尽量均匀（30 集、每批最多 13 集
+    时分为 10 + 10 + 10，而不是 13 + 13 + 4）。
+
+    Args:
+        batch_size: 指定每批最多集数，默认按 max_batch_episodes(provider) 计算
+
+    Returns:
+        [(start_ep, end_ep), ...]
+    """
+    size = batch_size or max_batch_episodes(provider)
+    count = max(1, math.ceil(total_episodes / size))
+    base, extra = divmod(total_episodes, count)
+    batches = []
+    start_ep = 1
+    for i in range(count):
+        end_ep = start_ep + base + (1 if i < extra else 0) - 1
+        batches.append((start_ep, end_ep))
+        start_ep = end_ep + 1
+    return batches
+
+
+def batch_label(start_ep, end_ep):
+    """批次标题，例如「第 1-15 集」"""
+    return f"第 {start_ep}-{end_ep} 集"
+
+
+def split_episodes(text):
+    """按分集标题切分剧本，返回 [(集数, 该集文本)]，标题之前的内容丢弃"""
+    matches = list(EPISODE_HEADER_PATTERN.finditer(text))
+    return [
+        (int(m.group(1)), text[m.start():matches[i + 1].start() if i + 1 < len(matches) else len(text)])
+        for i, m in enumerate(matches)
+    ]
+
+
+def complete_episodes(request, numbers, fallback=None):
+    """
+    请求 numbers 中的各集，输出不完整时自动续写
+
+    request(numbers) 返回 call_provider_result 的结果。输出被截断时丢弃最后一集
+    （可能只写了一半），从第一个缺少的集起重新请求，直到各集齐全或达到
+    MAX_CONTINUATIONS 次。首次输出中没有分集标题时原样返回。
+
+    续写次数用完仍缺的集：fallback（{集数: 文本}）中有的用它代替，
+    否则保留写了一半的内容（或只留分集标题），并在末尾加上 INCOMPLETE_EPISODE_NOTE。
+    """
+    result = request(numbers)
+    parts = []
+    remaining = list(numbers)
+    partial = None
+    for attempt in range(MAX_CONTINUATIONS + 1):
+        # 只保留按 remaining 顺序依次出现的各集
+        episodes = []
+        for number, content in split_episodes(result["text"]):
+            if len(episodes) < len(remaining) and number == remaining[len(episodes)]:
+                episodes.append(content)
+        if attempt == 0 and not episodes:
+            return result["text"]
+        finished = episodes[:-1] if result["truncated"] else episodes
+
+        if not parts and len(finished) == len(numbers):
+            return result["text"]
+
+        parts.extend(content.rstrip() + "\n\n" for content in finished)
+        remaining = remaining[len(finished):]
+        if not remaining:
+            return "".join(parts)
+        # 写了一半的 remaining[0]，续写失败时兜底
+        if len(episodes) > len(finished):
+            partial = episodes[len(finished)]
+        elif finished:
+            partial = None
+        if attempt < MAX_CONTINUATIONS:
+            result = request(remaining)
+
+    for number in remaining:
+        if fallback and number in fallback:
+            parts.append(fallback[number].rstrip() + "\n\n")
+            continue
+        content = partial if number == remaining[0] and partial else f"## 第{number}集\n"
+        parts.append(content.rstrip() + "\n\n" + INCOMPLETE_EPISODE_NOTE.format(
+            number=number, attempts=MAX_CONTINUATIONS) + "\n\n")
+    return "".join(parts)
+
+
+# ==================== 单次生成 ====================
+
+def call_ai_model(novel, title, genre, episodes, opt_level, api_key, provider, on_delta=None):
+    """
+    调用 AI 模型生成剧本
+
+    Args:
+        novel: 小说原文
+        title: 剧本标题
+        genre: 题材类型
+        episodes: 总集数
+        opt_level: 优化级别
+        api_key: API Key
+        provider: claude / openai / gemini / deepseek / qwen / ernie / chatglm / kimi
+        on_delta: 流式输出回调 on_delta(text)，为 None 时一次性返回
+
+    Returns:
+        生成的剧本内容
+    """
+    prompt = build_single_prompt(novel, title, genre, episodes)
+
+    with span(SPAN_SINGLE, provider=provider, episodes=episodes):
+        return call_provider(prompt.system, prompt.user, api_key, provider, on_delta=on_delta,
+                             prefix=prompt.prefix)
+
+
+def generate_mock_script(title, genre, episodes):
+    """模拟生成脚本（无 API Key 时使用）"""
+    return f'''# 短剧剧本：{title}
+
+**题材：** {genre}
+**总集数：** {episodes}集
+
+**故事梗概：** 丫鬟苏清晏被逼替小姐与姑爷同床三年，求解放时被迫与侯府病弱大公子沈景珩结阴亲。
+
+**人物小传：**
+
+| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
+|------|------|-----------|---------|----------|
+| 苏清晏 | 18岁 | 陪嫁丫鬟 | 隐忍坚韧 | 家生子 |
+| 沈景珩 | 27岁 | 侯府嫡长子 | 清冷才子 | 注定早逝 |
+
+**表演记忆点：**
+
+| 角色 | 性格标签 | 口头禅 | 标志性动作 |
+|------|---------|--------|------------|
+| 苏清晏 | 隐忍坚韧 | "奴婢不敢" | 低眉顺眼 |
+
+---
+
+（共{episodes}集，请配置 API Key 生成完整剧本）
+'''
+
+
+# ==================== 跨批衔接 ====================
+
+def plan_handoffs(summary_data, plan, api_key, provider):
+    """
+    一次调用规划各批分界处的剧情状态（人物处境、未解决的悬念）
+
+    各批并行生成时看不到上一批的剧本，把上一批结尾的预期状态注入下一批的提示词，
+    兼顾并行速度和剧情衔接。
+
+    Returns:
+        与 plan 等长的列表，第 i 项为第 i 批开头要承接的状态；
+        第一批、以及模型没有给出的交接点为 None
+    """
+    handoffs = [None] * len(plan)
+    boundaries = {start_ep - 1: i for i, (start_ep, _) in enumerate(plan) if i > 0}
+    if not boundaries:
+        return handoffs
+
+    prompt = build_handoff_prompt(summary_data, sorted(boundaries))
+    result = call_provider(prompt.system, prompt.user, api_key, provider, prefix=prompt.prefix)
+    try:
+        parsed = parse_json_response(result)
+    except json.JSONDecodeError:
+        return handoffs
+
+    for item in parsed.get("handoffs", []) if isinstance(parsed, dict) else []:
+        try:
+            episode = int(item.get("episode"))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if episode in boundaries:
+            handoffs[boundaries[episode]] = item
+    return handoffs
+
+
+# ==================== 第二步：分集生成 ====================
+
+def generate_batch_with_summary(summary_data, title, genre, start_ep, end_ep, api_key, provider,
+                                on_delta=None, handoff=None, cast=None, neighbors=None):
+    """
+    使用故事概要生成第 start_ep-end_ep 集剧本（不传完整小说，解决 token 限制）
+
+    handoff 为 plan_handoffs 规划的上一批结尾状态，用于并行生成时衔接上一批。
+    neighbors 为按集重做时相邻集的剧本片段（见 neighbor_context）。
+    cast 为 CastIndex 时只发送本批相关的人物设定和配角记忆点，否则发送完整人物表。
+    输出达到 token 上限被截断时自动续写缺少的集数。
+    """
+    episode_plan = summary_data.get("episode_plan", [])
+
+    def request(numbers):
+        batch_plan_text = ""
+        for ep in numbers:
+            if ep <= len(episode_plan):
+                batch_plan_text += f"- 第{ep}集：{episode_plan[ep-1]}\n"
+
+        batch_handoff = handoff if numbers[0] == start_ep else None
+        characters = character_marks = None
+        if cast is not None:
+            characters, character_marks = cast.batch_context(numbers[0], numbers[-1], batch_handoff)
+        prompt = build_batch_prompt(
+            summary_data, genre, numbers[0], numbers[-1], batch_plan_text,
+            handoff=batch_handoff, characters=characters, character_marks=character_marks, neighbors=neighbors
+        )
+        return call_provider_result(prompt.system, prompt.user, api_key, provider, on_delta=on_delta,
+                                    prefix=prompt.prefix)
+
+    return complete_episodes(request, list(range(start_ep, end_ep + 1)))
+
+
+# ==================== 第三步：分批优化 ====================
+
+def optimize_batch(batch_content, optimization_points, api_key, provider, on_delta=None, cast=None):
+    """
+    基于全局优化要点优化单批剧本内容
+
+    Args:
+        batch_content: 当前批次的剧本内容
+        optimization_points: extract_story_summary 返回的优化要点
+        api_key: API Key
+        provider: API 提供商
+        on_delta: 流式输出回调 on_delta(text)，为 None 时一次性返回
+        cast: CastIndex，提供时配角记忆点只保留剧本中出场的人物
+
+    Returns:
+        优化后的剧本内容；输出被截断时只把缺少的各集再优化，续写不完的集保留草稿
+    """
+    drafts = dict(split_episodes(batch_content))
+    numbers = list(drafts)
+
+    def request(remaining):
+        content = batch_content
+        if remaining != numbers:
+            content = "".join(drafts[ep] for ep in remaining)
+        character_marks = cast.optimize_marks(content) if cast is not None else None
+        prompt = build_optimize_prompt(content, optimization_points, character_marks)
+        return call_provider_result(prompt.system, prompt.user, api_key, provider, on_delta=on_delta,
+                                    prefix=prompt.prefix)
+
+    if not drafts:
+        return request(numbers)["text"]
+    return complete_episodes(request, numbers, fallback=drafts)
+
+
+def select_for_optimize(batch_content, mode=DEFAULT_OPTIMIZE_MODE):
+    """
+    按优化范围选出需要优化的部分
+
+    Returns:
+        (ScriptIndex, lint.select_units 的结果)；需要整批优化时选取结果为 None，
+        为空字典时表示格式已合格、不需要优化
+    """
+    if mode == OPTIMIZE_FULL:
+        return None, None
+    index, issues = lint_script(batch_content)
+    # 解析不出分集时无法按集拼接，整批优化
+    if not index.episodes:
+        return index, None
+    selection = select_units(issues, scene_level=mode == OPTIMIZE_FRAGMENTS)
+    numbers = {episode["number"] for episode in index.episodes}
+    if set(selection) == numbers and all(scenes is None for scenes in selection.values()):
+        return index, None
+    return index, selection
+
+
+def optimize_selected(batch_content, optimization_points, api_key, provider, on_delta=None,
+                      mode=DEFAULT_OPTIMIZE_MODE, cast=None):
+    """
+    只优化格式检查不合格的部分
+
+    整批都需要优化时等同于 optimize_batch；只优化部分集或场时，
+    优化结果拼回草稿后一次性回调 on_delta（片段的流式输出不是完整的一批）。
+
+    Args:
+        mode: 优化范围 OPTIMIZE_FULL / OPTIMIZE_EPISODES / OPTIMIZE_FRAGMENTS
+
+    Returns:
+        优化后的剧本内容
+    """
+    index, selection = select_for_optimize(batch_content, mode)
+    if selection is None:
+        return optimize_batch(batch_content, optimization_points, api_key, provider, on_delta=on_delta,
+                              cast=cast)
+
+    if selection:
+        fragment = build_fragment(batch_content, index, selection)
+        optimized = optimize_batch(fragment, optimization_points, api_key, provider, cast=cast)
+        batch_content = splice(batch_content, index, optimized, selection)
+    if on_delta:
+        on_delta(batch_content)
+    return batch_content
+
+
+# ==================== 第四步：组合剧本 ====================
+
+def write_script(out, title, genre, episodes, summary_data, plan, optimized_batches):
+    """把故事概要、人物表和各批剧本逐段写入文本文件对象 out，plan 为 plan_batches 的结果"""
+    out.write(f"""# 短剧剧本：{title}
+
+**题材：** {genre}
+**总集数：** {episodes}集
+
+---
+
+## 故事梗概
+{summary_data.get('story_summary', '')}
+
+---
+
+## 人物小传
+| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
+|------|------|-----------|---------|----------|
+""")
+
+    for char in summary_data.get('characters', []):
+        out.write(f"| {char.get('name', '')} | {char.get('age', '')} | {char.get('identity', '')} | {char.get('personality', '')} | {char.get('background', '')} |\n")
+
+    out.write("""
+---
+
+## 表演记忆点
+| 角色 | 性格标签 | 口头禅 | 标志性动作 |
+|------|---------|--------|------------|
+""")
+    for char in summary_data.get('characters', []):
+        name = char.get('name', '')
+        out.write(f"| {name} | {char.get('personality', '')} | 待补充 | 待补充 |\n")
+
+    # 添加各集内容
+    out.write("\n")
+    for (start_ep, end_ep), optimized_batch in zip(plan, optimized_batches):
+        out.write(f"\n{'='*50}\n")
+        out.write(f"# {batch_label(start_ep, end_ep)}\n")
+        out.write(optimized_batch)
+
+
+def assemble_script(title, genre, episodes, summary_data, plan, optimized_batches):
+    """同 write_script，返回完整剧本文本"""
+    buffer = io.StringIO()
+    write_script(buffer, title, genre, episodes, summary_data, plan, optimized_batches)
+    return buffer.getvalue()
+
+
+# ==================== 分步生成流水线 ====================
+
+def run_batch_pipeline(novel, title, genre, episodes, api_key, provider, max_in_flight=None,
+                       checkpoints=None, run_id=None, plan=None, optimize_mode=DEFAULT_OPTIMIZE_MODE,
+                       continuity=True, output=None, on_status=None, on_summary=None, on_update=None,
+                       on_delta=None, on_summary_delta=None):
+    """
+    分步生成完整剧本：提取概要 → 并发分批生成与优化 → 组合
+
+    Args:
+        checkpoints / run_id: 提供时每个阶段完成后写入检查点，已完成的阶段直接读取
+        plan: 分批规划 [(start_ep, end_ep)]，默认 plan_batches(episodes, provider)；
+            使用检查点时应把 plan 计入 run_id，规划变化后不会读到错位的批次
+        optimize_mode: 优化范围，见 optimize_selected；使用检查点时也应计入 run_id
+        continuity: 先用 plan_handoffs 规划各批分界处的剧情状态，再注入各批的生成提示词
+            （多一次小调用，各批仍并行生成）；使用检查点时也应计入 run_id
+        output: 文本文件对象，提供时完整剧本逐段写入其中（见 write_script），
+            不在内存中拼出整部剧本，返回结果的 script 为 None
+        on_status: on_status(text, progress)，阶段变化时回调，progress 为 0-100
+        on_summary: on_summary(summary_data)，故事概要就绪时回调
+        on_summary_delta: on_summary_delta(text)，提供时概要的最终一次调用流式输出（边接收边解析 JSON）
+        on_update / on_delta: 透传给 scheduler.run_batches 的批次状态和流式输出回调
+
+    以上回调都在调用线程中执行。在 telemetry.use_tracer() 内调用时，
+    整个流程记为 SPAN_PIPELINE，各阶段、各批次记为其下的子 span。
+
+    Returns:
+        {"script": 完整剧本（提供 output 时为 None）, "summary": 故事概要, "plan": 分批规划,
+         "batches": 各批优化后的剧本,
+         "report": report.optimization_report 的结果，每批另有 episodes_optimized（交给模型优化的集数）,
+         "context": CastIndex.report() 的结果（按批裁剪人物设定节省的输入 token）,
+         "timings": 各阶段耗时（秒）}
+    """
+    def status(text, progress):
+        if on_status:
+            on_status(text, progress)
+
+    def stage(name, compute, on_hit=None):
+        if checkpoints is None:
+            return compute()
+        return checkpoints.stage(run_id, name, compute, on_hit=on_hit)
+
+    plan = plan or plan_batches(episodes, provider)
+    with span(SPAN_PIPELINE, provider=provider, episodes=episodes, batches=len(plan),
+              optimize_mode=optimize_mode):
+        total_batches = len(plan)
+        timings = {}
+
+        # 第一步：提取故事概要（只做一次）
+        status("正在提取故事概要...", 5)
+        started = time.perf_counter()
+        with span(SPAN_SUMMARY):
+            summary_data = stage("summary", lambda: extract_story_summary(
+                novel=novel,
+                title=title,
+                genre=genre,
+                total_episodes=episodes,
+                api_key=api_key,
+                provider=provider,
+                on_delta=on_summary_delta,
+                on_progress=lambda done, total: status(f"正在提取故事概要（已完成 {done}/{total} 段）...", 5),
+                max_in_flight=max_in_flight
+            ))
+        timings["summary"] = time.perf_counter() - started
+        status("故事概要提取完成", 15)
+        if on_summary:
+            on_summary(summary_data)
+        # 按分集大纲为各批挑选相关人物，只发送本批用到的人物设定和配角记忆点
+        cast = CastIndex(summary_data, provider)
+
+        # 跨批衔接：一次调用规划各批分界处的状态，之后各批仍并行生成
+        handoffs = [None] * total_batches
+        if continuity and total_batches > 1:
+            status("正在规划跨批衔接...", 15)
+            started = time.perf_counter()
+            with span(SPAN_HANDOFF, boundaries=total_batches - 1):
+                handoffs = stage("handoffs", lambda: plan_handoffs(summary_data, plan, api_key, provider))
+            timings["handoff"] = time.perf_counter() - started
+
+        # 第二、三步：分批生成并立即优化，每个阶段完成后写入检查点
+        def generate_one(batch_idx, batch_delta):
+            with span(SPAN_GENERATE, batch=batch_idx):
+                return stage(
+                    batch_stage(batch_idx, STAGE_DRAFT),
+                    lambda: generate_batch_with_summary(
+                        summary_data=summary_data,
+                        title=title,
+                        genre=genre,
+                        start_ep=plan[batch_idx][0],
+                        end_ep=plan[batch_idx][1],
+                        api_key=api_key,
+                        provider=provider,
+                        on_delta=batch_delta,
+                        handoff=handoffs[batch_idx],
+                        cast=cast
+                    ),
+                    on_hit=batch_delta
+                )
+
+        drafts = [None] * total_batches
+
+        def optimize_one(batch_idx, batch_content, batch_delta):
+            drafts[batch_idx] = batch_content
+            with span(SPAN_OPTIMIZE, batch=batch_idx):
+                return stage(
+                    batch_stage(batch_idx, STAGE_OPTIMIZED),
+                    lambda: optimize_selected(
+                        batch_content=batch_content,
+                        optimization_points=summary_data.get("optimization_points", {}),
+                        api_key=api_key,
+                        provider=provider,
+                        on_delta=batch_delta,
+                        mode=optimize_mode,
+                        cast=cast
+                    ),
+                    on_hit=batch_delta
+                )
+
+        status(f"正在分批生成剧本（共{total_batches}批）...", 15)
+        started = time.perf_counter()
+        optimized_batches = run_batches(
+            total_batches=total_batches,
+            generate_fn=generate_one,
+            optimize_fn=optimize_one,
+            provider=provider,
+            max_in_flight=max_in_flight,
+            on_update=on_update,
+            on_delta=on_delta
+        )
+        timings["batches"] = time.perf_counter() - started
+
+        # 第四步：组合完整剧本
+        started = time.perf_counter()
+        with span(SPAN_ASSEMBLY):
+            if output is None:
+                script_content = assemble_script(title, genre, episodes, summary_data, plan, optimized_batches)
+            else:
+                write_script(output, title, genre, episodes, summary_data, plan, optimized_batches)
+                script_content = None
+        timings["assembly"] = time.perf_counter() - started
+
+        # 对比各批优化前后的内容，生成优化报告
+        started = time.perf_counter()
+        with span(SPAN_REPORT):
+            report = optimization_report(drafts, optimized_batches, main_characters_of(summary_data))
+            for batch, draft in zip(report["batches"], drafts):
+                index, selection = select_for_optimize(draft, optimize_mode)
+                episode_count = len(index.episodes) if index else len(split_episodes(draft))
+                batch["episodes_optimized"] = episode_count if selection is None else len(selection)
+        timings["report"] = time.perf_counter() - started
+        status("生成完成！", 100)
+
+        return {
+            "script": script_content,
+            "summary": summary_data,
+            "plan": plan,
+            "batches": optimized_batches,
+            "report": report,
+            "context": cast.report(),
+            "timings": timings,
+        }
+
+
+# ==================== 按集重做 ====================
+
+def episode_spans(text):
+    """各集在组合剧本中的位置 {集数: (起, 止)}，不含集后的批次分隔"""
+    matches = list(EPISODE_HEADER_PATTERN.finditer(text))
+    spans = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        separator = BATCH_SEPARATOR_PATTERN.search(text, match.start(), end)
+        spans.setdefault(int(match.group(1)), (match.start(), separator.start() if separator else end))
+    return spans
+
+
+def splice_episodes(text, episodes):
+    """把 {集数: 新的该集文本} 按集替换回 text，保留原文各集之后的空行和批次分隔"""
+    spans = episode_spans(text)
+    replacements = sorted(
+        ((spans[number], content) for number, content in episodes.items() if number in spans),
+        key=lambda item: item[0][0], reverse=True
+    )
+    for (start, end), content in replacements:
+        original = text[start:end]
+        trailing = original[len(original.rstrip()):]
+        text = text[:start] + content.rstrip() + (trailing or "\n\n") + text[end:]
+    return text
+
+
+def _runs(numbers):
+    """把升序的集数分成连续的段 [(起, 止)]"""
+    runs = []
+    for number in numbers:
+        if runs and number == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], number)
+        else:
+            runs.append((number, number))
+    return runs
+
+
+def neighbor_context(episodes, start_ep, end_ep):
+    """重新生成第 start_ep-end_ep 集时的衔接参考：上一集的结尾和下一集的开头"""
+    parts = []
+    if start_ep - 1 in episodes:
+        parts.append(f"第{start_ep - 1}集结尾：\n{episodes[start_ep - 1].rstrip()[-NEIGHBOR_CHARS:]}")
+    if end_ep + 1 in episodes:
+        parts.append(f"第{end_ep + 1}集开头：\n{episodes[end_ep + 1][:NEIGHBOR_CHARS].rstrip()}")
+    return "\n\n".join(parts)
+
+
+def redo_episodes(script, summary_data, title, genre, numbers, api_key, provider, action=REDO_REGENERATE,
+                  optimize_mode=DEFAULT_OPTIMIZE_MODE, on_status=None):
+    """
+    只重做剧本中选中的几集，结果按集数拼回原处，其余各集和故事概要原样保留
+
+    重新生成时按故事概要（通常读取自检查点）逐段生成连续的几集，附带相邻集的结尾和开头
+    用于衔接，再按 optimize_mode 优化；重新优化时把选中的各集一次交给 optimize_batch。
+    模型没有给出的集保留原文。
+
+    Args:
+        script: 完整剧本（assemble_script 或单次生成的结果）
+        numbers: 要重做的集数
+        action: REDO_REGENERATE / REDO_OPTIMIZE
+
+    Returns:
+        {"script": 拼回后的完整剧本, "episodes": 实际替换的集数,
+         "report": 重做前后的对比（report.optimization_report，作为一批）}
+
+    Raises:
+        ValueError: 剧本中没有选中的某一集
+    """
+    spans = episode_spans(script)
+    missing = sorted(set(numbers) - set(spans))
+    if missing:
+        raise ValueError(f"剧本中没有第 {'、'.join(str(number) for number in missing)} 集")
+    numbers = sorted(set(numbers))
+    episodes = {number: script[start:end] for number, (start, end) in spans.items()}
+    before = "".join(episodes[number] for number in numbers)
+    optimization_points = summary_data.get("optimization_points", {})
+    cast = CastIndex(summary_data, provider)
+
+    with span(SPAN_REDO, action=action, episodes=len(numbers)):
+        if action == REDO_OPTIMIZE:
+            if on_status:
+                on_status(f"正在重新优化第 {'、'.join(str(number) for number in numbers)} 集...", 10)
+            draft = before
+            redone = optimize_batch(before, optimization_points, api_key, provider, cast=cast)
+        else:
+            drafts = []
+            # 连续的几集一起生成，过长时按输出上限再分批
+            batches = [
+                (start_ep + offset_start - 1, start_ep + offset_end - 1)
+                for start_ep, end_ep in _runs(numbers)
+                for offset_start, offset_end in plan_batches(end_ep - start_ep + 1, provider)
+            ]
+            for i, (start_ep, end_ep) in enumerate(batches):
+                if on_status:
+                    on_status(f"正在重新生成{batch_label(start_ep, end_ep)}...", 10 + 80 * i // len(batches))
+                drafts.append(generate_batch_with_summary(
+                    summary_data, title, genre, start_ep, end_ep, api_key, provider, cast=cast,
+                    neighbors=neighbor_context(episodes, start_ep, end_ep)
+                ))
+            draft = "".join(drafts)
+            redone = optimize_selected(draft, optimization_points, api_key, provider, mode=optimize_mode,
+                                       cast=cast)
+
+    replacements = {number: content for number, content in split_episodes(redone) if number in numbers}
+    return {
+        "script": splice_episodes(script, replacements),
+        "episodes": sorted(replacements),
+        "report": optimization_report([draft], [redone], main_characters_of(summary_data)),
+    }
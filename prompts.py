@@ -0,0 +1,563 @@
+"""
+提示词模板
+
+与调用流程无关的提示词常量和模板注册表 PROMPTS。单独成模块后，Streamlit 每次重跑
+只执行 app.py，这些模板随模块导入只编译一次。
+
+每个模板的用户提示词分为静态前缀和可变后缀：前缀只包含同一次运行中不变的内容
+（格式模板、任务说明、故事概要、优化要点），同一次运行的各次调用前缀
+逐字相同；集数范围、分集计划、按批裁剪的人物设定和配角记忆点、剧本内容等
+每次调用都不同的部分放在后缀。
+OpenAI / DeepSeek / Gemini 按请求开头自动缓存，Anthropic 由 providers 在前缀末尾
+标记 cache_control，重复的前缀按缓存价格计费。
+"""
+
+import json
+import string
+from collections import namedtuple
+
+
+GENRE_FOCUS = {
+    "都市": "职场、生活、现实情感",
+    "古装宅斗": "心机算计、身份地位、主仆关系",
+    "仙侠玄幻": "修炼升级、法宝灵器、门派恩怨",
+    "甜宠": "感情互动、身份差距、浪漫桥段",
+    "重生复仇": "信息差、预知未来、改变命运",
+    "穿越": "身份错位、古代与现代碰撞",
+    "豪门": "财产争夺、家族恩怨、身份差距",
+    "其他": "情感纠葛、人物成长"
+}
+
+SUMMARY_SYSTEM_PROMPT = """你是一个专业的短剧编剧。请从小说中提取关键信息，用于后续分集剧本生成。"""
+
+SUMMARY_OUTPUT_FORMAT = """=== 输出格式 ===
+请直接输出JSON对象（不要用markdown代码块）：
+
+{
+  "story_summary": "一句话核心冲突概括",
+  "characters": [
+    {
+      "name": "角色名",
+      "age": "年龄",
+      "identity": "身份/职业",
+      "personality": "性格特点",
+      "background": "核心背景"
+    }
+  ],
+  "episode_plan": [
+    "第1集核心事件",
+    "第2集核心事件",
+    ...
+  ],
+  "optimization_points": {
+    "format_notes": "格式规范要点列表（每条换行）",
+    "performance_notes": "表演提示要点列表",
+    "camera_notes": "特写镜头要点列表",
+    "character_marks": "配角记忆点：角色A-口头禅+动作，角色B-口头禅+动作"
+  }
+}"""
+
+CHUNK_OUTPUT_FORMAT = """=== 输出格式 ===
+请直接输出JSON对象（不要用markdown代码块）：
+
+{
+  "summary": "本段剧情摘要（150字内）",
+  "characters": [
+    {
+      "name": "角色名",
+      "age": "年龄",
+      "identity": "身份/职业",
+      "personality": "性格特点",
+      "background": "核心背景"
+    }
+  ],
+  "events": [
+    "关键事件1",
+    "关键事件2"
+  ]
+}"""
+
+EPISODE_PLAN_OUTPUT_FORMAT = """=== 输出格式 ===
+请直接输出JSON对象（不要用markdown代码块）：
+
+{
+  "episode_plan": [
+    "第N集核心事件",
+    "第N+1集核心事件"
+  ]
+}"""
+
+SCREENWRITER_SYSTEM_PROMPT = """你是一个专业的短剧编剧，擅长将小说改编成专业格式的短剧剧本。请务必使用简体中文，不要使用繁体中文。"""
+
+OPTIMIZER_SYSTEM_PROMPT = """你是一个专业的短剧剧本优化专家，负责优化剧本的格式规范、表演提示、特写镜头和配角记忆点。"""
+
+HANDOFF_SYSTEM_PROMPT = """你是一个专业的短剧编剧，负责在分批并行创作时保证各批剧本之间的剧情衔接。"""
+
+HANDOFF_OUTPUT_FORMAT = """=== 输出格式 ===
+请直接输出JSON对象（不要用markdown代码块），每个交接点一项：
+
+{
+  "handoffs": [
+    {
+      "episode": 5,
+      "ending": "该集结尾的画面和情绪（50字内）",
+      "characters": [
+        {"name": "角色名", "state": "所在位置、处境、与他人的关系和情绪（30字内）"}
+      ],
+      "hooks": ["尚未解决的悬念或伏笔"]
+    }
+  ]
+}"""
+
+
+# ==================== 模板编译 ====================
+
+_formatter = string.Formatter()
+
+
+class Prompt(namedtuple("Prompt", ["system", "prefix", "suffix"])):
+    """渲染后的提示词：system 为系统提示词，用户提示词 = prefix + suffix"""
+
+    __slots__ = ()
+
+    @property
+    def user(self):
+        return self.prefix + self.suffix
+
+
+class PromptTemplate:
+    """
+    预编译的提示词模板
+
+    prefix / suffix 为 str.format 语法的模板，导入时解析一次；constants 中的字段
+    在编译时直接并入文本，render() 只做拼接。
+    """
+
+    def __init__(self, name, system_prompt, prefix, suffix, **constants):
+        self.name = name
+        self.system_prompt = system_prompt
+        self._prefix = _compile(prefix, constants)
+        self._suffix = _compile(suffix, constants)
+
+    @property
+    def fields(self):
+        """渲染时需要提供的字段"""
+        return {field for _, field in self._prefix + self._suffix if field}
+
+    def render(self, **values):
+        return Prompt(self.system_prompt, _render(self._prefix, values), _render(self._suffix, values))
+
+
+def _compile(source, constants):
+    """把模板解析为 ((文本, 字段名), ...)，最后一项的字段名为 None"""
+    parts = []
+    text = ""
+    for literal, field, _, _ in _formatter.parse(source):
+        text += literal
+        if field is None:
+            continue
+        if field in constants:
+            text += str(constants[field])
+            continue
+        parts.append((text, field))
+        text = ""
+    parts.append((text, None))
+    return tuple(parts)
+
+
+def _render(parts, values):
+    return "".join(text + str(values[field]) if field else text for text, field in parts)
+
+
+def genre_focus(genre):
+    """题材侧重点"""
+    return GENRE_FOCUS.get(genre, '情感纠葛')
+
+
+# ==================== 模板注册表 ====================
+
+# reduce / extract 共用的任务说明（{characters_source} 和 {plan_note} 在注册模板时替换）
+SUMMARY_TASKS = """1. **故事梗概**（200字内）：一句话概括核心冲突
+2. **人物小传**（主要角色 3-5 人）：{characters_source}包含姓名、年龄、身份、性格特点、核心背景
+3. **分集大纲**（共{total_episodes}集）：每集一句话核心事件{plan_note}
+4. **全局优化要点**：
+   - 格式规范：该题材的特殊格式要求
+   - 表演提示：该题材的表演风格要点
+   - 特写镜头：该题材常需要的镜头类型
+   - 配角记忆点：主要配角需要具备的标志性特征"""
+
+PROMPTS = {
+    "single": PromptTemplate(
+        "single", SCREENWRITER_SYSTEM_PROMPT,
+        """请将以下小说转换成专业格式的短剧剧本。
+
+=== 基础配置 ===
+标题：{title}
+题材：{genre}
+总集数：{episodes}
+
+=== 格式模板 ===
+# 短剧剧本：{title}
+
+**题材：** {genre}
+**总集数：** {episodes}集
+
+**故事梗概：** 1-2句话概括核心冲突
+
+**人物小传：**
+
+| 角色 | 年龄 | 身份/职业 | 性格特点 | 核心背景 |
+|------|------|-----------|---------|----------|
+| 主角 | xx岁 | xxx | xxx | xxx |
+| 配角1 | xx岁 | xxx | xxx | xxx |
+
+**表演记忆点：**
+
+| 角色 | 性格标签 | 口头禅 | 标志性动作 |
+|------|---------|--------|------------|
+| 主角 | xxx | xxx | xxx |
+| 配角1 | xxx | xxx | xxx |
+
+---
+
+**第1集：标题**
+**核心剧情：** ...
+
+1-1   场景名称     日/夜    内/外
+人物：xxx
+
+▲ 场景描述
+【特写】关键镜头
+人物（情绪）：台词
+【★表演提示】
+
+▲ 切镜
+
+1-2   场景名称     日/夜    内/外
+人物：xxx
+
+...
+
+=== 格式要求 ===
+1. 场次编号：1-1, 1-2, 2-1...（连续递增）
+2. 场景标注：日/夜 + 内/外（必填）
+3. 关键镜头：【特写】+ 描述
+4. 表演提示：【★表演提示】+ 情绪/动作
+5. 转场：【切镜】【黑屏】【字幕：X年后】【闪回】【蒙太奇】
+6. 内心独白：【画外音·人物名】
+7. 配角必须有口头禅和标志性动作
+
+=== 题材侧重点 ===
+{genre}题材关注：{genre_focus}
+
+请直接输出完整剧本。
+
+小说原文：
+""",
+        "{novel}",
+    ),
+    "batch": PromptTemplate(
+        "batch", SCREENWRITER_SYSTEM_PROMPT,
+        """请根据以下故事概要分批创作短剧剧本，每次只创作指定的连续几集。
+
+=== 故事概要 ===
+{story_summary}
+
+=== 格式模板 ===
+**第X集：标题**
+**核心剧情：** ...
+
+X-1   场景名称     日/夜    内/外
+人物：xxx
+
+▲ 场景描述
+【特写】关键镜头
+人物（情绪）：台词
+【★表演提示】
+
+=== 格式要求 ===
+1. 场次编号：集数-场次，每集从 1 开始（例如第3集为 3-1, 3-2, ...）
+2. 场景标注：日/夜 + 内/外（必填）
+3. 关键镜头：【特写】+ 描述
+4. 表演提示：【★表演提示】+ 情绪/动作
+5. 转场：【切镜】【字幕：X年后】【蒙太奇】
+6. 配角必须有口头禅和标志性动作
+7. 每集至少 4 场
+
+=== 题材侧重点 ===
+{genre}题材关注：{genre_focus}
+
+""",
+        """=== 本批人物设定 ===
+{characters}
+{marks_text}
+=== 当前批次分集计划 ===
+{batch_plan_text}{handoff_text}{neighbor_text}
+
+请为第 {start_ep}-{end_ep} 集创作剧本，场次编号从 {start_ep}-1 开始，直接输出完整剧本内容。""",
+    ),
+    "optimize": PromptTemplate(
+        "optimize", OPTIMIZER_SYSTEM_PROMPT,
+        """请优化剧本内容，根据全局优化要点进行修正和补充。
+
+=== 全局优化要点 ===
+**格式规范：**
+{format_notes}
+
+**表演提示：**
+{performance_notes}
+
+**特写镜头：**
+{camera_notes}
+
+=== 优化要求 ===
+1. 检查并修复格式问题
+2. 补充缺失的表演提示
+3. 补充必要的特写镜头
+4. 确保配角有口头禅和标志性动作
+5. 保持原有剧情不变
+
+请直接输出优化后的剧本内容，不需要说明。
+
+""",
+        """=== 本批配角记忆点 ===
+{character_marks}
+
+=== 需要优化的剧本内容 ===
+{batch_content}""",
+    ),
+    "handoff": PromptTemplate(
+        "handoff", HANDOFF_SYSTEM_PROMPT,
+        """以下短剧将分批并行创作，各批编剧看不到其他批次的剧本。
+请根据故事概要和分集计划推演指定集结束时的剧情状态，作为下一批编剧的交接说明。
+
+=== 故事概要 ===
+{story_summary}
+
+=== 人物设定 ===
+{characters}
+
+=== 分集计划 ===
+{plan_text}
+
+{output_format}
+
+要求：只写与后续剧情有关的人物，每个交接点的状态必须与分集计划中该集及之前的事件一致。
+
+""",
+        "=== 交接点 ===\n第 {episodes} 集结束时",
+        output_format=HANDOFF_OUTPUT_FORMAT,
+    ),
+    "chunk": PromptTemplate(
+        "chunk", SUMMARY_SYSTEM_PROMPT,
+        """以下是一部小说中的一段，请提取本段的关键信息，用于后续合并成全书概要。
+
+=== 任务说明 ===
+1. **剧情摘要**（150字内）：本段发生了什么
+2. **出场人物**：本段出场的重要角色，包含姓名、年龄、身份、性格特点、核心背景（未知的字段留空）
+3. **关键事件**：按片段说明中的数量要求给出
+
+{output_format}
+
+=== 题材 ===
+{genre}
+
+""",
+        """=== 片段说明 ===
+第 {index}/{total_chunks} 段；{events_note}
+
+=== 小说片段 ===
+{chunk}""",
+        output_format=CHUNK_OUTPUT_FORMAT,
+    ),
+    "merge": PromptTemplate(
+        "merge", SUMMARY_SYSTEM_PROMPT,
+        """以下是一部小说中连续若干段的摘要，请按时间顺序合并为一段摘要。
+
+=== 任务说明 ===
+1. **剧情摘要**（300字内）：合并后的剧情
+2. **出场人物**：合并同名角色，保留最完整的信息
+3. **关键事件**：按时间顺序给出，数量见事件要求
+
+{output_format}
+
+=== 题材 ===
+{genre}
+
+""",
+        """=== 事件要求 ===
+至少 {min_events} 条关键事件
+
+=== 各段摘要 ===
+{parts}""",
+        output_format=CHUNK_OUTPUT_FORMAT,
+    ),
+    "reduce": PromptTemplate(
+        "reduce", SUMMARY_SYSTEM_PROMPT,
+        """以下是一部小说按顺序切分后各片段的摘要，请据此提取全书关键信息，用于后续生成分集剧本和优化。
+
+=== 任务说明 ===
+请提取以下信息（JSON格式输出）：
+
+""" + SUMMARY_TASKS.replace("{characters_source}", "从候选人物中选出，").replace(
+            "{plan_note}", "，必须恰好 {total_episodes} 条，\n   并按各片段标注的集数范围安排对应片段的事件"
+        ) + """
+
+{output_format}
+
+=== 题材侧重点 ===
+{genre}题材关注：{genre_focus}
+
+""",
+        """=== 候选人物 ===
+{characters}
+
+=== 各片段摘要 ===
+{parts}""",
+        output_format=SUMMARY_OUTPUT_FORMAT,
+    ),
+    "extract": PromptTemplate(
+        "extract", SUMMARY_SYSTEM_PROMPT,
+        """请从以下小说中提取关键信息，用于后续生成分集剧本和优化。
+
+=== 任务说明 ===
+请提取以下信息（JSON格式输出）：
+
+""" + SUMMARY_TASKS.replace("{characters_source}", "").replace("{plan_note}", "") + """
+
+{output_format}
+
+=== 题材侧重点 ===
+{genre}题材关注：{genre_focus}
+
+""",
+        """=== 小说原文 ===
+{novel}""",
+        output_format=SUMMARY_OUTPUT_FORMAT,
+    ),
+    "episode_plan": PromptTemplate(
+        "episode_plan", SUMMARY_SYSTEM_PROMPT,
+        """以下短剧的分集大纲缺少部分集数，请只补写缺少的各集，并与已有各集衔接。
+
+{output_format}
+
+=== 故事概要 ===
+{story_summary}
+
+=== 人物设定 ===
+{characters}
+
+""",
+        """=== 已有分集大纲 ===
+{plan_text}
+{context_text}
+请按顺序补写第 {start_ep}-{end_ep} 集，每集一句话核心事件，共 {count} 条。""",
+        output_format=EPISODE_PLAN_OUTPUT_FORMAT,
+    ),
+}
+
+
+# ==================== 拼装函数 ====================
+
+def _characters_json(summary_data):
+    return json.dumps(summary_data.get('characters', []), ensure_ascii=False, indent=2)
+
+
+def format_characters(characters):
+    """紧凑的人物设定：每人一行，省略空字段"""
+    lines = []
+    for char in characters:
+        fields = [char.get('name', ''), char.get('age', ''), char.get('identity', '')]
+        if char.get('personality'):
+            fields.append(f"性格：{char['personality']}")
+        if char.get('background'):
+            fields.append(f"背景：{char['background']}")
+        lines.append("- " + "｜".join(field for field in fields if field))
+    return "\n".join(lines) or "（无）"
+
+
+def build_single_prompt(novel, title, genre, episodes):
+    """单次生成完整剧本的提示词，返回 Prompt"""
+    return PROMPTS["single"].render(
+        novel=novel, title=title, genre=genre, episodes=episodes, genre_focus=genre_focus(genre)
+    )
+
+
+def format_handoff(handoff):
+    """把一个交接点格式化为提示词中的「上一批结尾状态」"""
+    lines = [f"=== 上一批结尾状态（第{handoff.get('episode', '')}集结束时）==="]
+    if handoff.get("ending"):
+        lines.append(f"结尾：{handoff['ending']}")
+    characters = [char for char in handoff.get("characters", []) if isinstance(char, dict)]
+    if characters:
+        lines.append("人物状态：")
+        lines += [f"- {char.get('name', '')}：{char.get('state', '')}" for char in characters]
+    hooks = [hook for hook in handoff.get("hooks", []) if hook]
+    if hooks:
+        lines.append("未解决的悬念：")
+        lines += [f"- {hook}" for hook in hooks]
+    lines.append("请从上述状态自然承接，不要重复上一批已经发生的情节。")
+    return "\n".join(lines)
+
+
+def build_handoff_prompt(summary_data, episodes):
+    """
+    为分批并行生成规划各批分界处的状态交接，返回 Prompt
+
+    Args:
+        episodes: 交接点，即除最后一批外各批的最后一集
+    """
+    episode_plan = summary_data.get('episode_plan', [])
+    return PROMPTS["handoff"].render(
+        story_summary=summary_data.get('story_summary', ''),
+        characters=_characters_json(summary_data),
+        plan_text="\n".join(f"- 第{i}集：{event}" for i, event in enumerate(episode_plan, 1)),
+        episodes='、'.join(str(ep) for ep in episodes),
+    )
+
+
+def build_batch_prompt(summary_data, genre, start_ep, end_ep, batch_plan_text, handoff=None,
+                       characters=None, character_marks=None, neighbors=None):
+    """
+    按故事概要生成第 start_ep-end_ep 集的提示词，返回 Prompt
+
+    handoff 为 build_handoff_prompt 规划的上一批结尾状态，提供时插在分集计划之后。
+    neighbors 为按集重做时前后相邻集的剧本片段（pipeline.neighbor_context），只用于衔接。
+    characters / character_marks 为按批裁剪后的人物设定和配角记忆点文本
+    （cast_index.CastIndex.batch_context），为 None 时使用完整人物表和全部记忆点。
+    同一次运行的各批提示词前缀相同，人物、集数范围和分集计划在后缀中。
+    """
+    if characters is None:
+        characters = format_characters(summary_data.get('characters', []))
+    if character_marks is None:
+        character_marks = summary_data.get('optimization_points', {}).get('character_marks', '')
+    return PROMPTS["batch"].render(
+        story_summary=summary_data.get('story_summary', ''),
+        characters=characters,
+        marks_text=f"\n=== 配角记忆点 ===\n{character_marks}\n" if character_marks else "",
+        genre=genre,
+        genre_focus=genre_focus(genre),
+        batch_plan_text=batch_plan_text,
+        handoff_text=f"\n{format_handoff(handoff)}" if handoff else "",
+        neighbor_text=f"\n=== 相邻集剧本（只用于衔接，不要重写或输出）===\n{neighbors}" if neighbors else "",
+        start_ep=start_ep,
+        end_ep=end_ep,
+    )
+
+
+def build_optimize_prompt(batch_content, optimization_points, character_marks=None):
+    """
+    按全局优化要点优化单批剧本的提示词，返回 Prompt（剧本内容在后缀中）
+
+    character_marks 为只含本批出场人物的配角记忆点（cast_index.CastIndex.optimize_marks），
+    为 None 时使用全部记忆点。
+    """
+    if character_marks is None:
+        character_marks = optimization_points.get('character_marks')
+    return PROMPTS["optimize"].render(
+        format_notes=optimization_points.get('format_notes', '按标准格式规范执行'),
+        performance_notes=optimization_points.get('performance_notes', '无特殊要求'),
+        camera_notes=optimization_points.get('camera_notes', '无特殊要求'),
+        character_marks=character_marks or '配角需有口头禅和标志性动作',
+        batch_content=batch_content,
+    )
@@ -0,0 +1,664 @@
+"""
+AI API 调用层
+
+所有 API 提供商的调用都经过这里：
+- PROVIDERS 统一描述各提供商的 SDK、接口地址、模型、输出上限、超时和请求频率
+- 通过 ClientRegistry 复用客户端，同一 API Key 的多次调用共享 keep-alive 连接池
+- 每个提供商一个令牌桶限流，并发批次不会超过请求频率配额
+- 429 / 5xx / 超时 / 连接错误按指数退避 + 随机抖动重试，优先遵循 Retry-After
+- 配置了 ResponseCache 时，call_provider 先查缓存，重复请求不再调用模型
+- 每次调用记录一个 telemetry span：耗时、首字延迟、输入/输出 token、重试次数和估算费用
+- 提示词的静态前缀（prefix）可命中提供商的前缀缓存：Anthropic 在前缀末尾标记 cache_control，
+  OpenAI 兼容接口自动缓存请求开头；命中缓存的输入 token 按缓存价格计费并记入 span
+- 在 use_router(router) 块内，发往路由主提供商的调用交给 routing.Router 对冲和故障转移
+- 配置了 fairshare.FairScheduler（set_call_scheduler）时，每次请求先按（提供商，API Key）排队，
+  受每个 Key 的并发和每分钟 token 配额限制，各任务的请求轮流发出
+- 在 use_cancel_event(event) 块内（含 telemetry.bind 的工作线程），event 触发后尚未发出的调用
+  和重试等待立即以 CallCancelled 结束，进行中的流式响应在下一段输出到达时中断
+- fake 提供商由 fake_provider 在本地生成格式合规的输出，不联网，用于演示和基准测试
+
+流式输出一旦开始产出文本就不再重试（已输出的内容无法撤回），直接抛出异常。
+"""
+
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from cache import make_cache_key
+from clients import SDK_ANTHROPIC, SDK_FAKE, SDK_OPENAI, ClientRegistry
+from fake_provider import iter_fake
+from ratelimit import TokenBucket
+from telemetry import LLM_SPAN, span
+from tokens import estimate_tokens
+
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+
+# 各 API 提供商的调用配置
+#   max_tokens: 最大输出 token 数（不超过模型的输出上限），也用于规划分步生成的每批集数
+#   timeout: 单次请求超时（秒，流式输出时为相邻两段输出的最大间隔）
+#   requests_per_minute: 令牌桶限流的请求频率
+#   price: (输入, 输出, 缓存命中的输入) 每百万 token 的价格（美元），用于估算费用
+PROVIDERS = {
+    "claude": {
+        "sdk": SDK_ANTHROPIC,
+        "base_url": None,
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": 64000,
+        "timeout": 600,
+        "requests_per_minute": 50,
+        "price": (3.0, 15.0, 0.3),
+    },
+    "openai": {
+        "sdk": SDK_OPENAI,
+        "base_url": None,
+        "model": "gpt-4o",
+        "max_tokens": 16384,
+        "timeout": 600,
+        "requests_per_minute": 60,
+        "price": (2.5, 10.0, 1.25),
+    },
+    "deepseek": {
+        "sdk": SDK_OPENAI,
+        "base_url": DEEPSEEK_BASE_URL,
+        "model": "deepseek-chat",
+        "max_tokens": 8192,
+        "timeout": 600,
+        "requests_per_minute": 120,
+        "price": (0.27, 1.1, 0.07),
+    },
+    "gemini_flash": {
+        "sdk": SDK_OPENAI,
+        "base_url": GEMINI_BASE_URL,
+        "model": "gemini-2.5-flash",
+        "max_tokens": 65536,
+        "timeout": 600,
+        "requests_per_minute": 60,
+        "price": (0.3, 2.5, 0.075),
+    },
+    "gemini_pro": {
+        "sdk": SDK_OPENAI,
+        "base_url": GEMINI_BASE_URL,
+        "model": "gemini-2.5-pro",
+        "max_tokens": 65536,
+        "timeout": 600,
+        "requests_per_minute": 30,
+        "price": (1.25, 10.0, 0.31),
+    },
+    # 本地模拟（fake_provider），不发起网络请求，用于离线演示和基准测试
+    #   latency: 首字延迟（秒），tokens_per_second: 输出速度（0 为不限速）
+    #   error_rate: 返回可重试 503 错误的概率，truncate_rate: 输出被随机截断的概率
+    #   draft_issue_rate: 分批草稿每场缺少特写或表演提示的概率，seed: 随机种子
+    "fake": {
+        "sdk": SDK_FAKE,
+        "base_url": None,
+        "model": "fake-screenwriter",
+        "max_tokens": 16384,
+        "timeout": 600,
+        "requests_per_minute": 60000,
+        "price": (0.0, 0.0, 0.0),
+        "latency": 0.0,
+        "tokens_per_second": 0,
+        "error_rate": 0.0,
+        "truncate_rate": 0.0,
+        "draft_issue_rate": 0.2,
+        "scenes_per_episode": 4,
+        "seed": 0,
+    },
+}
+
+# 重试策略
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRY_EXCEPTION_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+# 表示输出达到 token 上限被截断的结束原因（OpenAI 兼容接口 / Anthropic）
+TRUNCATED_FINISH_REASONS = {"length", "max_tokens"}
+
+_client_registry = ClientRegistry()
+_response_cache = None
+_call_scheduler = None
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_current_router = contextvars.ContextVar("router", default=None)
+_current_cancel = contextvars.ContextVar("cancel_event", default=None)
+
+
+class CallCancelled(Exception):
+    """调用方已取消请求（例如 HTTP 客户端断开），不重试也不故障转移"""
+
+
+def set_client_registry(registry):
+    """替换全局客户端注册表（Streamlit 中通过 st.cache_resource 跨重跑共享）"""
+    global _client_registry
+    _client_registry = registry
+
+
+def get_client_registry():
+    """返回全局客户端注册表"""
+    return _client_registry
+
+
+def set_response_cache(cache):
+    """设置全局响应缓存（ResponseCache），为 None 时不使用缓存"""
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache():
+    """返回全局响应缓存"""
+    return _response_cache
+
+
+def set_call_scheduler(scheduler):
+    """设置全局公平调度器（fairshare.FairScheduler），为 None 时请求直接发出"""
+    global _call_scheduler
+    _call_scheduler = scheduler
+
+
+def get_call_scheduler():
+    """返回全局公平调度器"""
+    return _call_scheduler
+
+
+def get_provider_config(provider):
+    """返回 API 提供商的调用配置"""
+    if provider not in PROVIDERS:
+        raise ValueError(f"不支持的 API 提供商: {provider}")
+    return PROVIDERS[provider]
+
+
+def configure_provider(provider, **overrides):
+    """
+    修改 API 提供商的调用配置，例如指向本地桩服务器:
+        configure_provider("deepseek", base_url="http://127.0.0.1:8000/v1")
+    """
+    get_provider_config(provider).update(overrides)
+    with _rate_limiters_lock:
+        _rate_limiters.pop(provider, None)
+
+
+def get_rate_limiter(provider):
+    """返回 API 提供商的令牌桶（进程内共享）"""
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            rpm = get_provider_config(provider)["requests_per_minute"]
+            _rate_limiters[provider] = TokenBucket(rate=rpm / 60, capacity=max(1, rpm // 6))
+        return _rate_limiters[provider]
+
+
+# ==================== 重试 ====================
+
+def _retry_after_seconds(exc):
+    """从异常携带的响应头中读取 Retry-After（秒），没有时返回 None"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(exc):
+    """判断异常是否值得重试：429、5xx、超时、连接错误"""
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUS_CODES
+    return (
+        type(exc).__name__ in RETRY_EXCEPTION_NAMES
+        or isinstance(exc, (ConnectionError, TimeoutError))
+    )
+
+
+def retry_delay(exc, attempt):
+    """
+    计算第 attempt 次重试前的等待时间
+
+    有 Retry-After 时遵循服务端要求，否则指数退避 + 全随机抖动。
+    """
+    retry_after = _retry_after_seconds(exc)
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def check_cancelled():
+    """当前上下文的取消事件已触发时抛出 CallCancelled"""
+    event = _current_cancel.get()
+    if event is not None and event.is_set():
+        raise CallCancelled("请求已取消")
+
+
+def _wait(seconds):
+    """重试前等待，等待期间取消事件触发时立即抛出 CallCancelled"""
+    event = _current_cancel.get()
+    if event is None:
+        time.sleep(seconds)
+        return
+    event.wait(seconds)
+    check_cancelled()
+
+
+# ==================== 单次请求 ====================
+
+def _anthropic_content(user_prompt, prefix):
+    """用户提示词以 prefix 开头时拆成两段，在前缀末尾标记 cache_control"""
+    if not prefix or not user_prompt.startswith(prefix):
+        return user_prompt
+    blocks = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    if len(user_prompt) > len(prefix):
+        blocks.append({"type": "text", "text": user_prompt[len(prefix):]})
+    return blocks
+
+
+def _iter_anthropic(client, config, system_prompt, user_prompt, prefix=None):
+    # 输出上限较大时 SDK 要求流式请求，因此始终使用流式接口
+    with client.messages.stream(
+        model=config["model"],
+        max_tokens=config["max_tokens"],
+        system=system_prompt,
+        messages=[
+            {"role": "user", "content": _anthropic_content(user_prompt, prefix)}
+        ],
+        timeout=config["timeout"]
+    ) as stream:
+        for text in stream.text_stream:
+            yield text
+        message = stream.get_final_message()
+    # input_tokens 不含缓存读写的部分，统一为总输入 token 数
+    usage = message.usage
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return {
+        "finish_reason": message.stop_reason,
+        "input_tokens": usage.input_tokens + cache_read + cache_write,
+        "output_tokens": usage.output_tokens,
+        "cached_input_tokens": cache_read,
+    }
+
+
+def _iter_openai(client, config, system_prompt, user_prompt, stream):
+    kwargs = {"max_tokens": config["max_tokens"]} if config["max_tokens"] else {}
+    if stream:
+        # 流式输出默认不返回用量，要求在最后一段附带
+        kwargs["stream_options"] = {"include_usage": True}
+    response = client.chat.completions.create(
+        model=config["model"],
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        stream=stream,
+        timeout=config["timeout"],
+        **kwargs
+    )
+
+    if not stream:
+        choice = response.choices[0]
+        yield choice.message.content or ""
+        return _usage_info(choice.finish_reason, response.usage)
+
+    finish_reason = None
+    usage = None
+    for chunk in response:
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                yield choice.delta.content
+            finish_reason = choice.finish_reason or finish_reason
+        usage = getattr(chunk, "usage", None) or usage
+    return _usage_info(finish_reason, usage)
+
+
+def _usage_info(finish_reason, usage):
+    # 命中前缀缓存的输入 token：OpenAI / Gemini 为 prompt_tokens_details.cached_tokens，
+    # DeepSeek 为 prompt_cache_hit_tokens
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or getattr(usage, "prompt_cache_hit_tokens", None)
+    return {
+        "finish_reason": finish_reason,
+        "input_tokens": getattr(usage, "prompt_tokens", None),
+        "output_tokens": getattr(usage, "completion_tokens", None),
+        "cached_input_tokens": cached or 0,
+    }
+
+
+def _iter_response(provider, system_prompt, user_prompt, api_key, stream, prefix=None):
+    """发起一次请求，逐段产出文本，生成器返回值为结束原因和用量"""
+    config = get_provider_config(provider)
+    if config["sdk"] == SDK_FAKE:
+        return (yield from iter_fake(config, system_prompt, user_prompt, stream))
+    # 整个流式响应期间借用客户端，期间被淘汰也不会关闭
+    with _client_registry.client(config["sdk"], api_key, config["base_url"]) as client:
+        if config["sdk"] == SDK_ANTHROPIC:
+            return (yield from _iter_anthropic(client, config, system_prompt, user_prompt, prefix))
+        # OpenAI 兼容接口自动缓存请求开头，前缀排在最前即可命中
+        return (yield from _iter_openai(client, config, system_prompt, user_prompt, stream))
+
+
+def stream_provider(provider, system_prompt, user_prompt, api_key, stream=True, prefix=None):
+    """
+    调用 AI 模型并逐段产出文本（带限流和重试）
+
+    prefix 为 user_prompt 中可缓存的静态前缀。生成器返回值为
+    {"finish_reason", "input_tokens", "output_tokens", "cached_input_tokens", "retries", "rate_limit_wait",
+     "queue_wait": 在公平调度器中排队的秒数}。
+    配置了公平调度器时每次尝试占用一个槽位，重试等待期间归还。
+    """
+    limiter = get_rate_limiter(provider)
+    scheduler = _call_scheduler
+    estimated_input = 0
+    if scheduler is not None:
+        estimated_input = estimate_tokens(system_prompt, provider) + estimate_tokens(user_prompt, provider)
+    attempt = 0
+    waited = 0.0
+    queued = 0.0
+    while True:
+        check_cancelled()
+        ticket = None
+        if scheduler is not None:
+            started = time.perf_counter()
+            ticket = scheduler.acquire(provider, api_key, estimated_input, _current_cancel.get())
+            queued += time.perf_counter() - started
+        emitted = False
+        info = {}
+        output_tokens = 0
+        try:
+            try:
+                # 排队期间被取消时 acquire 返回 None；放行后才取消的在这里抛出，由 finally 归还槽位
+                check_cancelled()
+                waited += limiter.acquire()
+                response = _iter_response(provider, system_prompt, user_prompt, api_key, stream, prefix)
+                while True:
+                    try:
+                        text = next(response)
+                    except StopIteration as stop:
+                        info = stop.value or {}
+                        break
+                    check_cancelled()
+                    emitted = True
+                    if ticket is not None:
+                        output_tokens += estimate_tokens(text, provider)
+                    yield text
+                return dict(info, retries=attempt, rate_limit_wait=waited, queue_wait=queued)
+            finally:
+                if ticket is not None:
+                    # 按接口返回的实际用量补扣（没有用量时按本地估算的输出）
+                    extra = info.get("output_tokens")
+                    if extra is None:
+                        extra = output_tokens
+                    if info.get("input_tokens") is not None:
+                        extra += info["input_tokens"] - estimated_input
+                    scheduler.release(ticket, extra)
+        except Exception as e:
+            if emitted or attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt)
+            if getattr(e, "status_code", None) == 429:
+                limiter.pause(delay)
+            _wait(delay)
+            attempt += 1
+
+
+def complete(provider, system_prompt, user_prompt, api_key, on_delta=None, prefix=None):
+    """
+    调用 AI 模型并返回完整结果（带限流和重试）
+
+    Args:
+        on_delta: 流式输出回调 on_delta(text)，为 None 时使用非流式请求
+        prefix: user_prompt 中可缓存的静态前缀
+
+    Returns:
+        {"text", "finish_reason", "input_tokens", "output_tokens", "cached_input_tokens",
+         "retries", "rate_limit_wait", "queue_wait",
+         "first_token": 首段输出的延迟（秒，非流式请求为完整响应的延迟）}
+    """
+    parts = []
+    first_token = None
+    started = time.perf_counter()
+    response = stream_provider(provider, system_prompt, user_prompt, api_key,
+                               stream=on_delta is not None, prefix=prefix)
+    # on_delta 抛出异常（例如对冲请求被取消）时关闭生成器，中断流式响应
+    try:
+        while True:
+            try:
+                text = next(response)
+            except StopIteration as stop:
+                return dict(stop.value, text="".join(parts), first_token=first_token)
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(text)
+            if on_delta:
+                on_delta(text)
+    finally:
+        response.close()
+
+
+def estimate_cost(provider, input_tokens, output_tokens, cached_input_tokens=0):
+    """
+    按 PROVIDERS 中的价格估算费用（美元），未配置价格时为 0
+
+    input_tokens 为总输入 token 数，其中 cached_input_tokens 按缓存价格计费。
+    """
+    input_price, output_price, cached_price = get_provider_config(provider).get("price") or (0.0, 0.0, 0.0)
+    cached_input_tokens = cached_input_tokens or 0
+    return (
+        ((input_tokens or 0) - cached_input_tokens) * input_price
+        + cached_input_tokens * cached_price
+        + (output_tokens or 0) * output_price
+    ) / 1e6
+
+
+def estimate_cache_savings(provider, cached_input_tokens):
+    """命中前缀缓存节省的费用（美元）"""
+    input_price, _, cached_price = get_provider_config(provider).get("price") or (0.0, 0.0, 0.0)
+    return (cached_input_tokens or 0) * (input_price - cached_price) / 1e6
+
+
+# ==================== AI API 调用函数 ====================
+
+def call_claude_api(system_prompt, user_prompt, api_key):
+    """调用 Claude API"""
+    return complete("claude", system_prompt, user_prompt, api_key)["text"]
+
+
+def call_openai_api(system_prompt, user_prompt, api_key):
+    """调用 OpenAI API"""
+    return complete("openai", system_prompt, user_prompt, api_key)["text"]
+
+
+def call_deepseek_api(system_prompt, user_prompt, api_key):
+    """调用 DeepSeek API"""
+    return complete("deepseek", system_prompt, user_prompt, api_key)["text"]
+
+
+def call_gemini_api(system_prompt, user_prompt, api_key):
+    """调用 Google Gemini API (Flash) - OpenAI 兼容格式"""
+    return complete("gemini_flash", system_prompt, user_prompt, api_key)["text"]
+
+
+def call_gemini_pro_api(system_prompt, user_prompt, api_key):
+    """调用 Google Gemini API (Pro) - OpenAI 兼容格式"""
+    return complete("gemini_pro", system_prompt, user_prompt, api_key)["text"]
+
+
+def call_fake_api(system_prompt, user_prompt, api_key=None):
+    """调用本地模拟提供商（不联网，api_key 不使用）"""
+    return complete("fake", system_prompt, user_prompt, api_key)["text"]
+
+
+# ==================== AI API 流式调用函数 ====================
+
+def stream_claude_api(system_prompt, user_prompt, api_key):
+    """流式调用 Claude API，逐段返回文本"""
+    return stream_provider("claude", system_prompt, user_prompt, api_key)
+
+
+def stream_openai_api(system_prompt, user_prompt, api_key):
+    """流式调用 OpenAI API"""
+    return stream_provider("openai", system_prompt, user_prompt, api_key)
+
+
+def stream_deepseek_api(system_prompt, user_prompt, api_key):
+    """流式调用 DeepSeek API"""
+    return stream_provider("deepseek", system_prompt, user_prompt, api_key)
+
+
+def stream_gemini_api(system_prompt, user_prompt, api_key):
+    """流式调用 Google Gemini API (Flash) - OpenAI 兼容格式"""
+    return stream_provider("gemini_flash", system_prompt, user_prompt, api_key)
+
+
+def stream_gemini_pro_api(system_prompt, user_prompt, api_key):
+    """流式调用 Google Gemini API (Pro) - OpenAI 兼容格式"""
+    return stream_provider("gemini_pro", system_prompt, user_prompt, api_key)
+
+
+def stream_fake_api(system_prompt, user_prompt, api_key=None):
+    """流式调用本地模拟提供商"""
+    return stream_provider("fake", system_prompt, user_prompt, api_key)
+
+
+def stream_ai_response(system_prompt, user_prompt, api_key, provider):
+    """按 API 提供商流式调用，返回文本片段生成器"""
+    get_provider_config(provider)
+    return stream_provider(provider, system_prompt, user_prompt, api_key)
+
+
+def collect_stream(chunks, on_delta):
+    """汇总流式输出为完整文本，每收到一段文本回调 on_delta(text)"""
+    parts = []
+    for text in chunks:
+        parts.append(text)
+        on_delta(text)
+    return "".join(parts)
+
+
+# ==================== 统一调用入口 ====================
+
+@contextmanager
+def use_router(router):
+    """在 with 块内把发往 router 主提供商的调用交给 router（router 为 None 时直接调用）"""
+    token = _current_router.set(router)
+    try:
+        yield router
+    finally:
+        _current_router.reset(token)
+
+
+@contextmanager
+def use_cancel_event(event):
+    """在 with 块内（及 telemetry.bind 的工作线程中）event 触发后取消模型调用（event 为 None 时不取消）"""
+    token = _current_cancel.set(event)
+    try:
+        yield event
+    finally:
+        _current_cancel.reset(token)
+
+
+def call_provider(system_prompt, user_prompt, api_key, provider, on_delta=None, prefix=None):
+    """
+    调用 AI 模型（带响应缓存）
+
+    Args:
+        system_prompt: 系统提示词
+        user_prompt: 用户提示词
+        api_key: API Key
+        provider: API 提供商
+        on_delta: 流式输出回调 on_delta(text)，为 None 时一次性返回；
+            命中缓存时以完整文本回调一次
+        prefix: user_prompt 中可缓存的静态前缀（prompts.Prompt.prefix），
+            同一次运行的多次调用共用时可命中提供商的前缀缓存
+
+    Returns:
+        模型输出的完整文本
+    """
+    return call_provider_result(system_prompt, user_prompt, api_key, provider, on_delta, prefix)["text"]
+
+
+def call_provider_result(system_prompt, user_prompt, api_key, provider, on_delta=None, prefix=None):
+    """
+    同 call_provider，返回 {"text", "truncated", "cached"}
+
+    truncated 表示输出达到 token 上限被截断。截断的响应不写入缓存，
+    因此命中缓存的结果总是完整的。每次调用记录一个 LLM_SPAN。
+    当前上下文启用了路由时由 Router.call 选择提供商，结果另有 provider。
+    """
+    check_cancelled()
+    router = _current_router.get()
+    if router is not None and router.routes(provider):
+        return router.call(system_prompt, user_prompt, api_key, provider, on_delta, prefix)
+    return call_provider_direct(system_prompt, user_prompt, api_key, provider, on_delta, prefix)
+
+
+def call_provider_direct(system_prompt, user_prompt, api_key, provider, on_delta=None, prefix=None):
+    """同 call_provider_result，不经过路由，只调用 provider"""
+    config = get_provider_config(provider)
+    with span(LLM_SPAN, provider=provider, model=config["model"], streaming=on_delta is not None) as attributes:
+        return _call_provider_result(config, system_prompt, user_prompt, api_key, provider, on_delta, prefix,
+                                     attributes)
+
+
+def _call_provider_result(config, system_prompt, user_prompt, api_key, provider, on_delta, prefix, attributes):
+    cache = _response_cache
+    key = None
+    if cache is not None:
+        key = make_cache_key(provider, config["model"], system_prompt, user_prompt, config["max_tokens"])
+        cached = cache.get(key)
+        if cached is not None:
+            if on_delta:
+                on_delta(cached)
+            attributes.update(cached=True, output_chars=len(cached))
+            return {"text": cached, "truncated": False, "cached": True}
+
+    result = complete(provider, system_prompt, user_prompt, api_key, on_delta=on_delta, prefix=prefix)
+    truncated = result.get("finish_reason") in TRUNCATED_FINISH_REASONS
+
+    # 接口没有返回用量时按本地估算（estimated_usage 标记）
+    input_tokens = result.get("input_tokens")
+    output_tokens = result.get("output_tokens")
+    if input_tokens is None or output_tokens is None:
+        attributes["estimated_usage"] = True
+        if input_tokens is None:
+            input_tokens = estimate_tokens(system_prompt, provider) + estimate_tokens(user_prompt, provider)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(result["text"], provider)
+    cached_input_tokens = result.get("cached_input_tokens") or 0
+    attributes.update(
+        cached=False,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cached_input_tokens=cached_input_tokens,
+        cache_savings=estimate_cache_savings(provider, cached_input_tokens),
+        output_chars=len(result["text"]),
+        first_token=result["first_token"],
+        retries=result["retries"],
+        rate_limit_wait=result["rate_limit_wait"],
+        queue_wait=result["queue_wait"],
+        finish_reason=result.get("finish_reason") or "",
+        cost=estimate_cost(provider, input_tokens, output_tokens, cached_input_tokens),
+    )
+
+    if cache is not None and result["text"] and not truncated:
+        cache.set(key, result["text"])
+    return {"text": result["text"], "truncated": truncated, "cached": False}
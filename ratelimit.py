@@ -0,0 +1,54 @@
+"""
+令牌桶限流
+
+每个 API 提供商一个令牌桶，所有会话、所有批次共用，
+并发批次一起发起请求时也不会超过提供商的请求频率配额。
+收到 429 时可暂停整个令牌桶，让其他请求一起等待 Retry-After。
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数），默认等于 max(1, rate)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """取出令牌，令牌不足或限流暂停期间阻塞等待；返回等待的秒数"""
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = max(
+                    self._paused_until - now,
+                    (tokens - self._tokens) / self.rate if self.rate else 1.0
+                )
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """暂停发放令牌 seconds 秒（收到 429 / Retry-After 时调用）"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
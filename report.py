@@ -0,0 +1,182 @@
+"""
+优化报告
+
+对比每批剧本优化前（生成草稿）和优化后的内容，统计优化实际做了什么：
+- 表演提示补充：新增的【★表演提示】
+- 特写镜头补充：新增的【特写】
+- 格式问题修复：优化前存在、优化后消失的格式问题（场景标注缺失、缺少人物行、场次编号错误）
+- 配角记忆点补充：优化后新具备口头禅（在两个以上场次重复出现的台词短语）的配角数
+
+对比按场次进行：两份剧本先用 script_index 解析，按 (集数, 场次编号) 对齐场景，
+每个场景内按行做多重集合差，总耗时与剧本长度成线性关系，几十万字的剧本也很快。
+"""
+
+import re
+from collections import Counter
+
+from lint import CLOSEUP_MARK, FORMAT_RULES, PERFORMANCE_MARK, RULE_LABELS, lint_index
+from script_index import LINE_DIALOGUE, parse_script
+
+
+# 格式问题类型与 lint 的格式规则一致
+ISSUE_LABELS = {rule: RULE_LABELS[rule] for rule in FORMAT_RULES}
+
+# 人物表中排在最前的几位视为主角（男女主），其余有台词的人物为配角
+MAIN_CHARACTER_COUNT = 2
+
+# 口头禅候选短语的长度范围
+CATCHPHRASE_MIN_CHARS = 2
+CATCHPHRASE_MAX_CHARS = 12
+PHRASE_SEPARATOR = re.compile(r"[，。！？!?、；;…～~\s“”\"「」]+")
+
+
+def format_issues(index):
+    """统计剧本索引中的格式问题，返回 Counter({问题类型: 数量})"""
+    return Counter(issue["rule"] for issue in lint_index(index) if issue["rule"] in FORMAT_RULES)
+
+
+def _scene_lines(index):
+    """{(集数, 场次编号): Counter(行文本)}"""
+    scenes = {}
+    for number, scene in index.scenes():
+        lines = scenes.setdefault((number, scene["id"]), Counter())
+        for _, _, speaker, emotion, text in scene["lines"]:
+            lines[(speaker, emotion, text)] += 1
+    return scenes
+
+
+def _count_marks(lines, mark):
+    return sum(text.count(mark) * count for (_, _, text), count in lines.items())
+
+
+def diff_batch(before, after):
+    """
+    对比一批剧本优化前后的内容
+
+    Returns:
+        {"performance_added", "closeup_added", "format_fixed", "format_remaining",
+         "lines_added", "lines_removed", "scenes_added", "scenes_removed"}
+    """
+    before_index = parse_script(before)
+    after_index = parse_script(after)
+    before_scenes = _scene_lines(before_index)
+    after_scenes = _scene_lines(after_index)
+
+    performance_added = 0
+    closeup_added = 0
+    lines_added = 0
+    lines_removed = 0
+    for key in before_scenes.keys() | after_scenes.keys():
+        old = before_scenes.get(key, Counter())
+        new = after_scenes.get(key, Counter())
+        added = new - old
+        removed = old - new
+        lines_added += sum(added.values())
+        lines_removed += sum(removed.values())
+        # 行内改写（例如台词后补上表演提示）记为删除旧行、新增新行，按标记数量之差计算
+        performance_added += max(0, _count_marks(added, PERFORMANCE_MARK) - _count_marks(removed, PERFORMANCE_MARK))
+        closeup_added += max(0, _count_marks(added, CLOSEUP_MARK) - _count_marks(removed, CLOSEUP_MARK))
+
+    before_issues = format_issues(before_index)
+    after_issues = format_issues(after_index)
+    return {
+        "performance_added": performance_added,
+        "closeup_added": closeup_added,
+        "format_fixed": sum((before_issues - after_issues).values()),
+        "format_remaining": sum(after_issues.values()),
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+        "scenes_added": len(after_scenes.keys() - before_scenes.keys()),
+        "scenes_removed": len(before_scenes.keys() - after_scenes.keys()),
+    }
+
+
+def catchphrase_characters(index, main_characters=()):
+    """
+    返回有口头禅的配角和全部配角 (有口头禅的配角集合, 配角集合)
+
+    配角为有台词、且不在 main_characters 中的人物；未指定主角时，
+    台词最多的 MAIN_CHARACTER_COUNT 个人物视为主角。
+    口头禅为同一人物在两个以上场次的台词中重复出现的短语。
+    """
+    phrase_scenes = {}
+    dialogue_count = Counter()
+    for number, scene in index.scenes():
+        for _, kind, speaker, _, text in scene["lines"]:
+            if kind != LINE_DIALOGUE:
+                continue
+            dialogue_count[speaker] += 1
+            phrases = phrase_scenes.setdefault(speaker, {})
+            for phrase in PHRASE_SEPARATOR.split(text):
+                if CATCHPHRASE_MIN_CHARS <= len(phrase) <= CATCHPHRASE_MAX_CHARS:
+                    phrases.setdefault(phrase, set()).add((number, scene["id"]))
+
+    main = set(main_characters)
+    if not main:
+        main = {name for name, _ in dialogue_count.most_common(MAIN_CHARACTER_COUNT)}
+    supporting = set(dialogue_count) - main
+    covered = {
+        name for name in supporting
+        if any(len(scenes) >= 2 for scenes in phrase_scenes[name].values())
+    }
+    return covered, supporting
+
+
+def optimization_report(drafts, optimized, main_characters=()):
+    """
+    汇总各批优化前后的对比结果
+
+    Args:
+        drafts / optimized: 各批优化前、优化后的剧本
+        main_characters: 主角名（不计入配角）
+
+    Returns:
+        {"batches": [diff_batch 结果], "total": 各项合计,
+         "catchphrase": {"supporting", "before", "after"}}
+    """
+    batches = [diff_batch(before, after) for before, after in zip(drafts, optimized)]
+    total = Counter()
+    for batch in batches:
+        total.update(batch)
+
+    before_covered, _ = catchphrase_characters(parse_script("\n".join(drafts)), main_characters)
+    after_covered, supporting = catchphrase_characters(parse_script("\n".join(optimized)), main_characters)
+    return {
+        "batches": batches,
+        "total": dict(total),
+        "catchphrase": {
+            "supporting": len(supporting),
+            "before": len(before_covered & supporting),
+            "after": len(after_covered),
+        },
+    }
+
+
+def report_metrics(report):
+    """优化报告面板显示的指标 {名称: 数值}"""
+    total = report["total"]
+    catchphrase = report["catchphrase"]
+    return {
+        "格式问题修复": total.get("format_fixed", 0),
+        "表演提示补充": total.get("performance_added", 0),
+        "特写镜头补充": total.get("closeup_added", 0),
+        "配角记忆点补充": max(0, catchphrase["after"] - catchphrase["before"]),
+    }
+
+
+def script_metrics(text, main_characters=()):
+    """单次生成没有优化前后对比，统计剧本本身的指标 {名称: 数值}"""
+    index = parse_script(text)
+    covered, supporting = catchphrase_characters(index, main_characters)
+    return {
+        "格式问题": sum(format_issues(index).values()),
+        "表演提示": text.count(PERFORMANCE_MARK),
+        "特写镜头": text.count(CLOSEUP_MARK),
+        "配角口头禅覆盖": f"{len(covered)}/{len(supporting)}",
+    }
+
+
+def main_characters_of(summary_data):
+    """故事概要人物表中的主角名"""
+    characters = summary_data.get("characters", [])[:MAIN_CHARACTER_COUNT]
+    return [char.get("name", "") for char in characters if char.get("name")]
@@ -0,0 +1,336 @@
+"""
+多提供商路由：对冲请求与故障转移
+
+Router 按优先级配置两个以上的提供商（各自的 API Key）。在 providers.use_router(router)
+块内，发往主提供商的 call_provider 调用都经过路由：
+
+    router = Router(["deepseek", "gemini_flash"], {"deepseek": key1, "gemini_flash": key2})
+    with use_router(router):
+        run_batch_pipeline(..., api_key=key1, provider="deepseek")
+
+- 对冲：首选提供商超过等待阈值仍没有输出时，向下一个提供商发出同样的请求，
+  先开始输出的一方胜出，另一方立即取消
+- 故障转移：某个提供商重试后仍然失败时换下一个提供商，批次不会因为单个提供商故障而失败
+- 每个提供商的首字延迟直方图和连续失败次数在进程内共享：对冲阈值取首选提供商的 P95，
+  中位延迟明显更低的提供商排到前面，连续失败的提供商冷却期内排到最后
+
+路由的每次尝试都使用流式请求，以便测量首字延迟、随时取消。调用方需要流式输出时，
+只有胜出一方的文本转发给 on_delta；已经开始转发后失败不再转移（与 providers 的
+重试策略一致，已输出的内容无法撤回）。调用方取消（providers.CallCancelled）时立即结束，不转移。
+"""
+
+import bisect
+import queue
+import threading
+import time
+
+from providers import CallCancelled, call_provider_direct, get_provider_config
+from telemetry import bind
+
+
+# 首字延迟直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+# 延迟样本少于此数时不参与排序，对冲阈值使用 DEFAULT_HEDGE_DELAY
+MIN_SAMPLES = 5
+DEFAULT_HEDGE_DELAY = 10.0
+HEDGE_QUANTILE = 0.95
+MIN_HEDGE_DELAY = 0.5
+
+# 中位延迟低于首选提供商的 1 / LATENCY_SWITCH_RATIO 时改为首选
+LATENCY_SWITCH_RATIO = 2.0
+
+# 连续失败达到次数后冷却一段时间（秒），冷却期内排到最后
+UNHEALTHY_FAILURES = 3
+UNHEALTHY_COOLDOWN = 60.0
+
+# 尝试线程发给路由的事件
+EVENT_TEXT = "text"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class HedgeCancelled(Exception):
+    """对冲请求中落败的一方被取消"""
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图（线程安全），quantile 返回分桶上界"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+
+    def quantile(self, q):
+        """第 q 分位所在分桶的上界，没有样本时为 None（超过最大分桶时为最大分桶的两倍）"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.buckets[i] if i < len(self.buckets) else self.buckets[-1] * 2
+        return self.buckets[-1] * 2
+
+
+class ProviderStats:
+    """单个提供商的首字延迟直方图和健康状态"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = None
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_failure = time.monotonic()
+
+    def healthy(self):
+        """连续失败未达到 UNHEALTHY_FAILURES，或已过冷却期"""
+        with self._lock:
+            return (
+                self.consecutive_failures < UNHEALTHY_FAILURES
+                or time.monotonic() - self.last_failure >= UNHEALTHY_COOLDOWN
+            )
+
+    def median(self):
+        """样本足够时的中位首字延迟，否则为 None"""
+        if self.latency.count < MIN_SAMPLES:
+            return None
+        return self.latency.quantile(0.5)
+
+    def snapshot(self):
+        return {
+            "samples": self.latency.count,
+            "p50": self.latency.quantile(0.5),
+            "p95": self.latency.quantile(HEDGE_QUANTILE),
+            "successes": self.successes,
+            "failures": self.failures,
+            "healthy": self.healthy(),
+        }
+
+
+def get_provider_stats(provider):
+    """返回提供商的延迟与健康统计（进程内共享）"""
+    with _stats_lock:
+        if provider not in _stats:
+            _stats[provider] = ProviderStats()
+        return _stats[provider]
+
+
+def provider_stats():
+    """已有统计的各提供商 {provider: snapshot}"""
+    with _stats_lock:
+        stats = dict(_stats)
+    return {provider: stat.snapshot() for provider, stat in stats.items()}
+
+
+def reset_provider_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class _Attempt:
+    """路由中向单个提供商发出的一次请求（在独立线程中运行）"""
+
+    def __init__(self, provider, events):
+        self.provider = provider
+        self.events = events
+        self.started = time.perf_counter()
+        self.first_text = None
+        self.cancelled = False
+
+    def on_delta(self, text):
+        if self.cancelled:
+            raise HedgeCancelled(f"{self.provider} 的请求已被取消")
+        if self.first_text is None:
+            self.first_text = time.perf_counter() - self.started
+        self.events.put((self, EVENT_TEXT, text))
+
+    def run(self, system_prompt, user_prompt, api_key, prefix):
+        result = None
+        try:
+            result = call_provider_direct(system_prompt, user_prompt, api_key, self.provider,
+                                          on_delta=self.on_delta, prefix=prefix)
+        except Exception as e:
+            self.events.put((self, EVENT_ERROR, e))
+        else:
+            self.events.put((self, EVENT_DONE, result))
+        # 命中本地响应缓存的调用不计入延迟
+        if self.first_text is not None and not (result and result["cached"]):
+            get_provider_stats(self.provider).latency.record(self.first_text)
+
+    def cancel(self):
+        """
+        取消请求：流式响应在下一段输出到达时中断
+
+        尚未输出时已等待的时间计入延迟直方图（低估实际延迟，但能让慢的提供商排到后面）。
+        """
+        self.cancelled = True
+        if self.first_text is None:
+            get_provider_stats(self.provider).latency.record(time.perf_counter() - self.started)
+
+
+class Router:
+    """按优先级在多个提供商之间对冲和故障转移"""
+
+    def __init__(self, providers, api_keys=None, hedge=True, hedge_delay=None, failover=True):
+        """
+        Args:
+            providers: 按优先级排列的提供商，第一个为主提供商（分批规划、并发限制以它为准）
+            api_keys: {提供商: API Key}，未给出的提供商使用调用时传入的 api_key
+            hedge: 是否发出对冲请求
+            hedge_delay: 对冲等待阈值（秒），默认按首选提供商首字延迟的 P95
+            failover: 提供商失败时是否换下一个提供商
+        """
+        for provider in providers:
+            get_provider_config(provider)
+        self.providers = list(dict.fromkeys(providers))
+        self.api_keys = dict(api_keys or {})
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.failover = failover
+
+    def routes(self, provider):
+        """是否接管发往 provider 的调用"""
+        return len(self.providers) > 1 and provider == self.providers[0]
+
+    def ranked(self):
+        """按健康状态和中位首字延迟排列本次调用尝试的顺序"""
+        healthy = [provider for provider in self.providers if get_provider_stats(provider).healthy()]
+        order = healthy + [provider for provider in self.providers if provider not in healthy]
+        best = order[0]
+        for provider in healthy[1:]:
+            median, best_median = get_provider_stats(provider).median(), get_provider_stats(best).median()
+            if median is not None and best_median is not None and median * LATENCY_SWITCH_RATIO < best_median:
+                best = provider
+        return [best] + [provider for provider in order if provider != best]
+
+    def delay_for(self, provider):
+        """向下一个提供商发出对冲请求前的等待时间（秒）"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        stats = get_provider_stats(provider)
+        if stats.latency.count < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, stats.latency.quantile(HEDGE_QUANTILE))
+
+    def call(self, system_prompt, user_prompt, api_key, provider, on_delta=None, prefix=None):
+        """
+        路由一次调用，参数同 providers.call_provider_result
+
+        Returns:
+            {"text", "truncated", "cached", "provider": 给出结果的提供商}
+
+        Raises:
+            所有提供商都失败时抛出最后一个异常
+        """
+        events = queue.Queue()
+        pending = self.ranked()
+        running = []
+        owner = None
+        hedged = False
+
+        def launch():
+            attempt = _Attempt(pending.pop(0), events)
+            key = self.api_keys.get(attempt.provider, api_key)
+            threading.Thread(
+                target=bind(attempt.run),
+                args=(system_prompt, user_prompt, key, prefix),
+                name=f"route-{attempt.provider}",
+                daemon=True,
+            ).start()
+            running.append(attempt)
+
+        def fail_over(error):
+            """没有仍在进行的请求时换下一个提供商，无可换时抛出 error"""
+            if any(not other.cancelled for other in running):
+                return
+            if not (self.failover and pending):
+                for other in running:
+                    other.cancel()
+                raise error
+            launch()
+
+        launch()
+        while True:
+            timeout = None
+            if self.hedge and not hedged and pending and owner is None and len(running) == 1:
+                timeout = max(0.0, running[0].started + self.delay_for(running[0].provider) - time.perf_counter())
+            try:
+                attempt, event, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                launch()
+                continue
+            if attempt.cancelled:
+                if event != EVENT_TEXT:
+                    running.remove(attempt)
+                continue
+
+            if event == EVENT_TEXT:
+                # 先开始输出的一方胜出，取消其他请求（未输出的提供商放回待尝试列表）
+                if owner is None:
+                    owner = attempt
+                    for other in running:
+                        if other is not attempt:
+                            other.cancel()
+                            pending.insert(0, other.provider)
+                if on_delta:
+                    on_delta(payload)
+                continue
+
+            running.remove(attempt)
+            # 调用方取消时所有尝试都会以 CallCancelled 结束，不计为提供商失败
+            if isinstance(payload, CallCancelled):
+                for other in running:
+                    other.cancel()
+                raise payload
+            stats = get_provider_stats(attempt.provider)
+            if event == EVENT_DONE:
+                stats.record_success()
+                for other in running:
+                    other.cancel()
+                return dict(payload, provider=attempt.provider)
+
+            stats.record_failure()
+            if attempt is owner:
+                if on_delta:
+                    raise payload
+                owner = None
+            # 已取消的对冲请求不再等待（它们只在下一段输出到达时才结束）
+            fail_over(payload)
+
+
+def make_router(provider, api_key, fallback_provider=None, fallback_api_key=None, hedge=True, hedge_delay=None):
+    """由主提供商和备用提供商构造 Router，没有备用提供商时返回 None（不路由）"""
+    if not fallback_provider or fallback_provider == provider:
+        return None
+    return Router(
+        [provider, fallback_provider],
+        {provider: api_key, fallback_provider: fallback_api_key or api_key},
+        hedge=hedge,
+        hedge_delay=hedge_delay,
+    )
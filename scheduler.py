@@ -0,0 +1,202 @@
+"""
+分批生成调度器
+
+并发执行分步生成模式中各批次的「生成 → 优化」流水线：
+- 各批次的生成调用并发发起，受每个 API 提供商的最大并发数限制
+  （配置了公平调度器时只限制本次运行，跨任务按 API Key 在 fairshare 中排队）
+- 每批生成完成后立即开始该批的优化，不等待其他批次
+- 结果按批次顺序返回，保证拼接后的剧集顺序不变
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from providers import get_call_scheduler
+from telemetry import bind
+
+
+# 每个 API 提供商同时进行中的请求上限（可在侧边栏覆盖）
+PROVIDER_MAX_IN_FLIGHT = {
+    "claude": 4,
+    "openai": 4,
+    "deepseek": 8,
+    "gemini_pro": 2,
+    "gemini_flash": 4,
+}
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+# 批次状态
+BATCH_PENDING = "pending"
+BATCH_GENERATING = "generating"
+BATCH_OPTIMIZING = "optimizing"
+BATCH_DONE = "done"
+BATCH_FAILED = "failed"
+
+# 流式输出事件（仅在调度器内部使用）
+_DELTA = "delta"
+
+BATCH_STATE_LABELS = {
+    BATCH_PENDING: "⏳ 等待中",
+    BATCH_GENERATING: "✍️ 生成中",
+    BATCH_OPTIMIZING: "🔧 优化中",
+    BATCH_DONE: "✅ 已完成",
+    BATCH_FAILED: "❌ 失败",
+}
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+class ProviderSemaphore:
+    """可调整上限的信号量：上限调低时进行中的请求不受影响，新请求等到低于新上限才开始"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def resize(self, limit):
+        with self._cond:
+            if limit != self.limit:
+                self.limit = limit
+                self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def get_max_in_flight(provider):
+    """返回 API 提供商的默认最大并发数"""
+    return PROVIDER_MAX_IN_FLIGHT.get(provider, DEFAULT_MAX_IN_FLIGHT)
+
+
+def get_provider_semaphore(provider, max_in_flight=None):
+    """
+    获取 API 提供商的并发信号量
+
+    同一进程内对同一提供商的所有批次共用一个信号量，
+    多个会话同时生成时也不会超过并发上限。
+    传入的 max_in_flight 与当前上限不同时调整该信号量的上限（以最后一次设置为准）。
+    """
+    limit = max_in_flight or get_max_in_flight(provider)
+    with _semaphores_lock:
+        if provider not in _semaphores:
+            _semaphores[provider] = ProviderSemaphore(limit)
+        semaphore = _semaphores[provider]
+    semaphore.resize(limit)
+    return semaphore
+
+
+def run_semaphore(provider, max_in_flight=None):
+    """
+    一次运行内各批次（或各片段）共用的并发信号量
+
+    配置了公平调度器（providers.set_call_scheduler）时，跨任务的并发由调度器按 API Key 控制，
+    每次运行只用自己的信号量限制并行数，一个任务的批次不会占满进程内共享的信号量；
+    否则为 get_provider_semaphore 的共享信号量。
+    """
+    if get_call_scheduler() is not None:
+        return threading.BoundedSemaphore(max_in_flight or get_max_in_flight(provider))
+    return get_provider_semaphore(provider, max_in_flight)
+
+
+def run_batches(total_batches, generate_fn, optimize_fn, provider,
+                max_in_flight=None, on_update=None, on_delta=None):
+    """
+    并发执行所有批次的生成与优化
+
+    Args:
+        total_batches: 批次总数
+        generate_fn: generate_fn(batch_idx, on_delta) -> 该批剧本内容
+        optimize_fn: optimize_fn(batch_idx, batch_content, on_delta) -> 优化后的剧本内容
+            on_delta 为流式输出回调，未启用流式输出时为 None
+        provider: API 提供商（用于并发限制）
+        max_in_flight: 最大并发请求数，默认取 PROVIDER_MAX_IN_FLIGHT（见 run_semaphore）
+        on_update: on_update(batch_idx, state, states)，批次状态变化时
+            在调用线程中回调（可安全地更新 Streamlit 组件）
+        on_delta: on_delta(batch_idx, state, text)，批次流式输出新文本时
+            在调用线程中回调，state 为 BATCH_GENERATING 或 BATCH_OPTIMIZING
+
+    Returns:
+        按批次顺序排列的优化后剧本内容列表
+
+    Raises:
+        任一批次失败时，取消尚未开始的批次并抛出该批次的异常
+        （每个批次占用一个线程，在信号量上排队的批次拿到槽位后发现已失败即放弃，不再发出请求）
+    """
+    semaphore = run_semaphore(provider, max_in_flight)
+    stopped = threading.Event()
+    events = queue.Queue()
+    states = [BATCH_PENDING] * total_batches
+    results = [None] * total_batches
+
+    def emitter(batch_idx, state):
+        if not on_delta:
+            return None
+        return lambda text: events.put((batch_idx, _DELTA, (state, text)))
+
+    def run_one(batch_idx):
+        try:
+            with semaphore:
+                if stopped.is_set():
+                    return
+                events.put((batch_idx, BATCH_GENERATING, None))
+                batch_content = generate_fn(batch_idx, emitter(batch_idx, BATCH_GENERATING))
+            with semaphore:
+                if stopped.is_set():
+                    return
+                events.put((batch_idx, BATCH_OPTIMIZING, None))
+                optimized = optimize_fn(
+                    batch_idx, batch_content, emitter(batch_idx, BATCH_OPTIMIZING)
+                )
+            events.put((batch_idx, BATCH_DONE, optimized))
+        except Exception as e:
+            events.put((batch_idx, BATCH_FAILED, e))
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, total_batches),
+        thread_name_prefix=f"batch-{provider}"
+    )
+    try:
+        for batch_idx in range(total_batches):
+            executor.submit(bind(run_one), batch_idx)
+
+        finished = 0
+        while finished < total_batches:
+            batch_idx, state, payload = events.get()
+            if state == _DELTA:
+                on_delta(batch_idx, *payload)
+                continue
+            states[batch_idx] = state
+
+            if state == BATCH_DONE:
+                results[batch_idx] = payload
+                finished += 1
+
+            if on_update:
+                on_update(batch_idx, state, list(states))
+
+            if state == BATCH_FAILED:
+                raise payload
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
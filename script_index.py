@@ -0,0 +1,258 @@
+"""
+剧本结构索引
+
+按提示词规定的剧本格式增量解析剧本文本，建立 集 → 场 → 行 的索引，
+并为每个角色记录出场位置（倒排表）：
+
+    **第1集：标题**
+    **核心剧情：** ...
+    1-1   场景名称     日/夜    内/外
+    人物：甲、乙
+    ▲ 场景描述
+    【特写】关键镜头
+    甲（情绪）：台词
+    【★表演提示】...
+    【画外音·甲】独白
+    【切镜】
+
+ScriptParser 可以边接收流式输出边 feed()，每行只处理一次，整部剧本一遍扫描完成；
+不符合格式的行按普通文本记录，不会中断解析。
+"""
+
+import re
+
+
+# 行类型
+LINE_ACTION = "action"            # ▲ 场景描述
+LINE_DIALOGUE = "dialogue"        # 人物（情绪）：台词
+LINE_VOICEOVER = "voiceover"      # 【画外音·人物名】
+LINE_CLOSEUP = "closeup"          # 【特写】
+LINE_PERFORMANCE = "performance"  # 【★表演提示】
+LINE_TRANSITION = "transition"    # 【切镜】【黑屏】【字幕：X年后】【闪回】【蒙太奇】
+LINE_TEXT = "text"                # 其他文本
+
+EPISODE_HEADER_PATTERN = re.compile(r"^[ \t#*]*第\s*(\d+)\s*集", re.M)
+EPISODE_TITLE_PATTERN = re.compile(r"^[ \t#*]*第\s*(\d+)\s*集[：:\s]*(.*?)[*\s]*$")
+CORE_PLOT_PATTERN = re.compile(r"^[*\s]*核心剧情[：:][*\s]*(.*)$")
+SCENE_HEADER_PATTERN = re.compile(
+    r"^[ \t#*]*(\d+)-(\d+)\s+(.+?)"
+    r"(?:\s+(日|夜|晨|昏|黄昏|清晨|傍晚|白天|深夜))?"
+    r"(?:\s+(内|外|内外|内/外))?[*\s]*$"
+)
+CAST_PATTERN = re.compile(r"^[*\s]*人物[：:][*\s]*(.*)$")
+CAST_SEPARATOR = re.compile(r"[、，,/\s]+")
+DIALOGUE_PATTERN = re.compile(r"^([^\s：:（(【▲*#]{1,12})(?:[（(]([^）)]*)[）)])?[：:]\s*(.*)$")
+VOICEOVER_PATTERN = re.compile(r"^【画外音[·・:：]?([^】]*)】\s*(.*)$")
+TRANSITION_MARKS = ("【切镜", "【黑屏", "【字幕", "【闪回", "【蒙太奇", "▲ 切镜")
+
+# 形似台词但不是人物的行首
+NON_SPEAKERS = {"人物", "核心剧情", "故事梗概", "题材", "总集数", "标题", "场景", "备注", "注"}
+
+
+class ScriptIndex:
+    """
+    剧本索引
+
+    episodes: [{"number", "title", "summary", "offset", "scenes": [scene]}]
+    scene:    {"id": "1-1", "name", "time", "place", "cast": [人物], "offset",
+               "lines": [(offset, 行类型, 人物, 情绪, 文本)]}
+    characters: {人物: [(集数, 场次 ID, 行号)]}，行号为 -1 表示出现在「人物：」行
+    """
+
+    def __init__(self):
+        self.episodes = []
+        self.characters = {}
+        self.length = 0
+        self._by_number = {}
+
+    def add_episode(self, episode):
+        self.episodes.append(episode)
+        self._by_number.setdefault(episode["number"], episode)
+
+    def episode(self, number):
+        """按集数取一集，不存在时返回 None（集数重复时取第一次出现的）"""
+        return self._by_number.get(number)
+
+    def scenes(self):
+        """按顺序遍历 (集数, 场景)"""
+        for episode in self.episodes:
+            for scene in episode["scenes"]:
+                yield episode["number"], scene
+
+    def lines_of(self, name):
+        """某个角色的全部台词 [(集数, 场次 ID, 文本)]"""
+        result = []
+        for episode_number, scene_id, line_no in self.characters.get(name, []):
+            if line_no < 0:
+                continue
+            episode = self.episode(episode_number)
+            for scene in episode["scenes"]:
+                if scene["id"] == scene_id:
+                    _, kind, _, _, text = scene["lines"][line_no]
+                    if kind in (LINE_DIALOGUE, LINE_VOICEOVER):
+                        result.append((episode_number, scene_id, text))
+                    break
+        return result
+
+    def character_stats(self):
+        """各角色的出场场次数和台词数，按出场位置数降序 [{"name", "scenes", "lines"}]"""
+        return [
+            {
+                "name": name,
+                "scenes": len({(episode_number, scene_id) for episode_number, scene_id, _ in postings}),
+                "lines": len(self.lines_of(name)),
+            }
+            for name, postings in sorted(self.characters.items(), key=lambda item: -len(item[1]))
+        ]
+
+    def stats(self):
+        """统计信息"""
+        scenes = 0
+        lines = 0
+        dialogue = 0
+        for _, scene in self.scenes():
+            scenes += 1
+            lines += len(scene["lines"])
+            dialogue += sum(1 for line in scene["lines"] if line[1] in (LINE_DIALOGUE, LINE_VOICEOVER))
+        return {
+            "episodes": len(self.episodes),
+            "scenes": scenes,
+            "lines": lines,
+            "dialogue": dialogue,
+            "characters": len(self.characters),
+        }
+
+
+class ScriptParser:
+    """增量剧本解析器：feed() 追加文本，close() 处理最后一行并返回索引"""
+
+    def __init__(self, known_characters=None):
+        """
+        Args:
+            known_characters: 已知人物名（例如故事概要中的人物表），提供时
+                场景描述、特写等行中提到的人物也计入出场位置
+        """
+        self.index = ScriptIndex()
+        self.known_characters = [name for name in (known_characters or []) if name]
+        self._pending = []
+        self._offset = 0
+        self._episode = None
+        self._scene = None
+
+    def feed(self, text):
+        """追加一段文本，解析其中完整的行（最后不完整的一行留到下次）"""
+        if "\n" not in text:
+            self._pending.append(text)
+            return self.index
+        lines = text.split("\n")
+        lines[0] = "".join(self._pending) + lines[0]
+        last = lines.pop()
+        self._pending = [last] if last else []
+        for line in lines:
+            self._parse_line(line)
+            self._offset += len(line) + 1
+        self.index.length = self._offset
+        return self.index
+
+    def close(self):
+        """处理剩余文本，返回完整索引"""
+        if self._pending:
+            line = "".join(self._pending)
+            self._pending = []
+            self._parse_line(line)
+            self._offset += len(line)
+            self.index.length = self._offset
+        return self.index
+
+    # ---------- 单行解析 ----------
+
+    def _parse_line(self, raw):
+        line = raw.strip()
+        if not line:
+            return
+
+        match = EPISODE_TITLE_PATTERN.match(line)
+        if match:
+            self._episode = {
+                "number": int(match.group(1)),
+                "title": match.group(2),
+                "summary": "",
+                "offset": self._offset,
+                "scenes": [],
+            }
+            self._scene = None
+            self.index.add_episode(self._episode)
+            return
+
+        if self._episode is None:
+            return
+
+        match = CORE_PLOT_PATTERN.match(line)
+        if match and self._scene is None:
+            self._episode["summary"] = match.group(1).strip()
+            return
+
+        # 缺少日/夜、内/外标注的场景标题也记为场景，由报告统计格式问题
+        match = SCENE_HEADER_PATTERN.match(line)
+        if match:
+            self._scene = {
+                "id": f"{match.group(1)}-{match.group(2)}",
+                "name": match.group(3).strip(),
+                "time": match.group(4) or "",
+                "place": match.group(5) or "",
+                "cast": [],
+                "offset": self._offset,
+                "lines": [],
+            }
+            self._episode["scenes"].append(self._scene)
+            return
+
+        if self._scene is None:
+            return
+
+        match = CAST_PATTERN.match(line)
+        if match:
+            cast = [name for name in CAST_SEPARATOR.split(match.group(1)) if name]
+            self._scene["cast"].extend(cast)
+            for name in cast:
+                self._post(name, -1)
+            return
+
+        kind, speaker, emotion, text = self._classify(line)
+        self._scene["lines"].append((self._offset, kind, speaker, emotion, text))
+        line_no = len(self._scene["lines"]) - 1
+        if speaker:
+            self._post(speaker, line_no)
+        for name in self.known_characters:
+            if name != speaker and name in text:
+                self._post(name, line_no)
+
+    def _classify(self, line):
+        """返回 (行类型, 人物, 情绪, 文本)"""
+        if line.startswith(TRANSITION_MARKS):
+            return LINE_TRANSITION, "", "", line
+        if line.startswith("▲"):
+            return LINE_ACTION, "", "", line[1:].strip()
+        if line.startswith("【特写"):
+            return LINE_CLOSEUP, "", "", line
+        if line.startswith("【★表演提示") or line.startswith("【表演提示"):
+            return LINE_PERFORMANCE, "", "", line
+        match = VOICEOVER_PATTERN.match(line)
+        if match:
+            return LINE_VOICEOVER, match.group(1).strip(), "", match.group(2)
+        match = DIALOGUE_PATTERN.match(line)
+        if match and match.group(1) not in NON_SPEAKERS:
+            return LINE_DIALOGUE, match.group(1), match.group(2) or "", match.group(3)
+        return LINE_TEXT, "", "", line
+
+    def _post(self, name, line_no):
+        self.index.characters.setdefault(name, []).append(
+            (self._episode["number"], self._scene["id"], line_no)
+        )
+
+
+def parse_script(text, known_characters=None):
+    """一次性解析完整剧本，返回 ScriptIndex"""
+    parser = ScriptParser(known_characters)
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,132 @@
+"""
+剧本文件存储
+
+生成完成的剧本直接写入本地目录（每个任务一个 Markdown 文件），任务记录中只保存
+文件名和分页位置。页面按集分页读取、下载时再读取文件，不在任务记录和每个会话中
+保存整部剧本的文本：
+
+    with store.writer(name) as f:
+        run_batch_pipeline(..., output=f)
+    pages, index = store.scan(name)
+    store.read(name, pages[1]["start"], pages[1]["end"])
+"""
+
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from script_index import EPISODE_TITLE_PATTERN, ScriptParser
+
+
+DEFAULT_SCRIPT_DIR = os.path.join(".cache", "scripts")
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+SCRIPT_SUFFIX = ".md"
+
+# 写入缓冲区大小（字节）
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+class ScriptStore:
+    """基于本地目录的剧本文件存储（原子写入）"""
+
+    def __init__(self, root=DEFAULT_SCRIPT_DIR, max_age=DEFAULT_MAX_AGE):
+        """
+        Args:
+            root: 剧本文件目录
+            max_age: 剧本文件保留时间（秒），超过后在 prune() 时删除
+        """
+        self.root = root
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+
+    def new_name(self):
+        """生成新的剧本文件名（不含扩展名）"""
+        return uuid.uuid4().hex[:16]
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}{SCRIPT_SUFFIX}")
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def size(self, name):
+        """文件大小（字节）"""
+        return os.path.getsize(self.path(name))
+
+    @contextmanager
+    def writer(self, name):
+        """
+        以文本文件对象逐段写入剧本
+
+        先写临时文件，with 块正常结束后再替换为正式文件，中途出错不会留下半个剧本。
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as f:
+                yield f
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write(self, name, text):
+        """一次写入完整剧本"""
+        with self.writer(name) as f:
+            f.write(text)
+
+    def read_bytes(self, name):
+        """读取整个剧本文件的字节内容（用于下载）"""
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def read(self, name, start=0, end=None):
+        """读取 [start, end) 字节范围内的剧本文本"""
+        with open(self.path(name), "rb") as f:
+            f.seek(start)
+            data = f.read() if end is None else f.read(end - start)
+        return data.decode("utf-8")
+
+    def scan(self, name, known_characters=None):
+        """
+        逐行扫描剧本文件，建立按集分页的位置和剧本结构索引
+
+        Returns:
+            (pages, ScriptIndex)
+            pages: [{"title", "episode": 集数（剧本信息页为 None）, "start", "end"}]，
+                位置为文件中的字节偏移；第一集之前的标题、人物表等作为第一页
+        """
+        parser = ScriptParser(known_characters)
+        pages = []
+        position = 0
+        with open(self.path(name), "rb") as f:
+            for raw in f:
+                line = raw.decode("utf-8")
+                match = EPISODE_TITLE_PATTERN.match(line.strip())
+                if match:
+                    if not pages and position:
+                        pages.append({"title": "剧本信息", "episode": None, "start": 0})
+                    number = int(match.group(1))
+                    title = f"第{number}集：{match.group(2)}" if match.group(2) else f"第{number}集"
+                    pages.append({"title": title, "episode": number, "start": position})
+                parser.feed(line)
+                position += len(raw)
+        if not pages:
+            pages.append({"title": "完整剧本", "episode": None, "start": 0})
+        for page, following in zip(pages, pages[1:] + [None]):
+            page["end"] = following["start"] if following else position
+        return pages, parser.close()
+
+    def delete(self, name):
+        if self.exists(name):
+            os.remove(self.path(name))
+
+    def prune(self):
+        """删除超过保留时间的剧本文件和残留的临时文件"""
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
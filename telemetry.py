@@ -0,0 +1,264 @@
+"""
+运行追踪
+
+记录每次运行中各流水线阶段和每次模型调用的耗时、首字延迟、输入/输出 token、
+命中前缀缓存的输入 token、重试次数和估算费用，用于在页面上按阶段展示，或导出为 JSONL / OpenTelemetry
+（OTLP JSON）格式离线分析：
+
+    tracer = Tracer(run_id)
+    with use_tracer(tracer):
+        with span("summary"):
+            ...
+    tracer.summary()
+    tracer.to_jsonl()
+
+当前 Tracer 和父 span 保存在 contextvars 中，并发任务需要用 bind() 包装后
+再提交到线程池，才能挂到正确的父 span 下。没有启用 Tracer 时 span() 不做任何记录。
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+SERVICE_NAME = "screenplay-generator"
+
+# 模型调用的 span 名称，summary() 按它统计 token 和费用
+LLM_SPAN = "llm.call"
+
+# 汇总到父 span 的数值属性
+USAGE_ATTRIBUTES = ("input_tokens", "output_tokens", "cached_input_tokens", "cost", "cache_savings", "retries")
+
+# OTLP 状态码
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_tracer = contextvars.ContextVar("tracer", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Tracer:
+    """
+    一次运行的 span 集合（线程安全）
+
+    span: {"trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns",
+           "duration", "status", "attributes": {...}}
+    """
+
+    def __init__(self, run_id=None):
+        self.trace_id = _new_id(16)
+        self.run_id = run_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records):
+        """由 to_records() 导出的 span 列表恢复 Tracer（例如从任务结果中读取）"""
+        tracer = cls(records[0]["run_id"] if records else None)
+        if records:
+            tracer.trace_id = records[0]["trace_id"]
+        tracer.spans = [{key: value for key, value in record.items() if key != "run_id"} for record in records]
+        return tracer
+
+    def start(self, name, parent=None, attributes=None):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": _new_id(8),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start_ns": time.time_ns(),
+            "end_ns": None,
+            "duration": None,
+            "status": STATUS_UNSET,
+            "attributes": dict(attributes or {}),
+            "_started": time.perf_counter(),
+        }
+
+    def finish(self, record, error=None):
+        record["duration"] = time.perf_counter() - record.pop("_started")
+        record["end_ns"] = record["start_ns"] + int(record["duration"] * 1e9)
+        if error is not None:
+            record["status"] = STATUS_ERROR
+            record["attributes"]["error"] = f"{type(error).__name__}: {error}"
+        else:
+            record["status"] = STATUS_OK
+        with self._lock:
+            self.spans.append(record)
+
+    # ---------- 汇总 ----------
+
+    def summary(self):
+        """
+        按 span 名称汇总
+
+        Returns:
+            {"stages": [{"name", "count", "duration", "first_token", "input_tokens", "output_tokens",
+                         "cached_input_tokens", "cost", "cache_savings", "retries", "cached", "errors"}],
+             "total": {"duration", "calls", "cached", "input_tokens", "output_tokens",
+                       "cached_input_tokens", "cost", "cache_savings", "retries"}}
+
+        cached 为命中本地响应缓存的调用数，cached_input_tokens 为命中提供商前缀缓存的
+        输入 token 数，cache_savings 为前缀缓存节省的费用。
+
+        模型调用的用量计入它的每一层父 span（因此外层阶段包含内层阶段的用量），
+        first_token 为直接发起调用的阶段中模型调用的平均首字延迟。
+        """
+        with self._lock:
+            spans = list(self.spans)
+        by_id = {record["span_id"]: record for record in spans}
+
+        stages = {}
+        for record in spans:
+            if record["name"] == LLM_SPAN:
+                continue
+            stages.setdefault(record["name"], _empty_stage(record["name"]))
+            stage = stages[record["name"]]
+            stage["count"] += 1
+            stage["duration"] += record["duration"]
+            stage["errors"] += record["status"] == STATUS_ERROR
+
+        total = {"duration": 0.0, "calls": 0, "cached": 0, "input_tokens": 0, "output_tokens": 0,
+                 "cached_input_tokens": 0, "cost": 0.0, "cache_savings": 0.0, "retries": 0}
+        first_tokens = {}
+        for record in spans:
+            if record["name"] != LLM_SPAN:
+                if record["parent_id"] is None:
+                    total["duration"] += record["duration"]
+                continue
+            attributes = record["attributes"]
+            targets = [total]
+            parent = by_id.get(record["parent_id"])
+            while parent is not None:
+                if parent["name"] != LLM_SPAN:
+                    targets.append(stages[parent["name"]])
+                parent = by_id.get(parent["parent_id"])
+            for target in targets:
+                for name in USAGE_ATTRIBUTES:
+                    target[name] += attributes.get(name) or 0
+                target["cached"] += bool(attributes.get("cached"))
+            total["calls"] += 1
+            if len(targets) > 1 and attributes.get("first_token") is not None:
+                first_tokens.setdefault(targets[1]["name"], []).append(attributes["first_token"])
+
+        for name, values in first_tokens.items():
+            stages[name]["first_token"] = sum(values) / len(values)
+        return {"stages": list(stages.values()), "total": total}
+
+    # ---------- 导出 ----------
+
+    def to_records(self):
+        """导出用的 span 列表（按开始时间排序）"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda record: record["start_ns"])
+        return [dict(record, run_id=self.run_id) for record in spans]
+
+    def to_jsonl(self):
+        """每行一个 span 的 JSONL"""
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self.to_records())
+
+    def to_otlp(self):
+        """OpenTelemetry OTLP/JSON 格式（ExportTraceServiceRequest）"""
+        spans = []
+        for record in self.to_records():
+            attributes = dict(record["attributes"])
+            if self.run_id:
+                attributes["run_id"] = self.run_id
+            span = {
+                "traceId": record["trace_id"],
+                "spanId": record["span_id"],
+                "name": record["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(record["start_ns"]),
+                "endTimeUnixNano": str(record["end_ns"]),
+                "attributes": [_otlp_attribute(key, value) for key, value in attributes.items()],
+                "status": {"code": record["status"]},
+            }
+            if record["parent_id"]:
+                span["parentSpanId"] = record["parent_id"]
+            spans.append(span)
+        return json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }, ensure_ascii=False)
+
+
+def _empty_stage(name):
+    return {"name": name, "count": 0, "duration": 0.0, "first_token": None, "input_tokens": 0,
+            "output_tokens": 0, "cached_input_tokens": 0, "cost": 0.0, "cache_savings": 0.0,
+            "retries": 0, "cached": 0, "errors": 0}
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+# ==================== 当前上下文 ====================
+
+def current_tracer():
+    """返回当前上下文的 Tracer，未启用时为 None"""
+    return _current_tracer.get()
+
+
+@contextmanager
+def use_tracer(tracer):
+    """在 with 块内启用 tracer（tracer 为 None 时不记录）"""
+    token = _current_tracer.set(tracer)
+    span_token = _current_span.set(None)
+    try:
+        yield tracer
+    finally:
+        _current_span.reset(span_token)
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    记录一个 span，with 块内产生的 span 以它为父
+
+    yield 的字典是该 span 的属性，可在块内补充；未启用 Tracer 时 yield 的
+    字典不会被保存。块内抛出的异常记入 span 后继续抛出。
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield dict(attributes)
+        return
+    record = tracer.start(name, _current_span.get(), attributes)
+    token = _current_span.set(record)
+    try:
+        yield record["attributes"]
+    except BaseException as e:
+        tracer.finish(record, error=e)
+        raise
+    else:
+        tracer.finish(record)
+    finally:
+        _current_span.reset(token)
+
+
+def bind(fn):
+    """
+    把 fn 绑定到当前上下文（Tracer 和父 span），用于提交到线程池
+
+    每次提交任务都应重新调用 bind()，同一个上下文副本不能在多个线程中同时运行。
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
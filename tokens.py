@@ -0,0 +1,41 @@
+"""
+本地 token 估算
+
+不依赖各家分词器，按字符类别估算 token 数：汉字（含全角标点）按各提供商
+分词器实测的「每字 token 数」计算，其余字符（ASCII、空白、Markdown 标记）
+统一按约 3.5 字符一个 token 计算。估算偏保守，用于规划每批集数，不用于计费。
+"""
+
+import re
+
+
+# 各提供商分词器每个汉字约合的 token 数（以剧本样稿实测，取偏大值）
+TOKENS_PER_CJK_CHAR = {
+    "claude": 1.25,
+    "openai": 0.8,
+    "deepseek": 0.65,
+    "gemini_flash": 0.8,
+    "gemini_pro": 0.8,
+}
+DEFAULT_TOKENS_PER_CJK_CHAR = 1.25
+
+# 非汉字字符每个约合的 token 数
+TOKENS_PER_OTHER_CHAR = 0.3
+
+# 汉字、全角标点和 CJK 符号
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def count_cjk(text):
+    """统计汉字和全角标点的数量"""
+    return len(CJK_PATTERN.findall(text))
+
+
+def estimate_tokens(text, provider=None):
+    """估算 text 在 provider 分词器下的 token 数"""
+    cjk = count_cjk(text)
+    return int(cjk * tokens_per_cjk_char(provider) + (len(text) - cjk) * TOKENS_PER_OTHER_CHAR) + 1
+
+
+def tokens_per_cjk_char(provider):
+    return TOKENS_PER_CJK_CHAR.get(provider, DEFAULT_TOKENS_PER_CJK_CHAR)